@@ -0,0 +1,458 @@
+# file: benchmarks.py
+"""
+Mikro-benchmarkok az opd3_fixed.py geokódoló és útvonal komponenseihez.
+Futtatás: python benchmarks.py [név ...]   (név nélkül mindegyik lefut)
+"""
+import itertools
+import os
+import sys
+import time
+import random
+import re
+import tempfile
+import tracemalloc
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# az opd3_fixed import létrehozza a DB-t a munkakönyvtárban: ne a valódi restaurant_orders.db-t használjuk
+os.chdir(tempfile.mkdtemp(prefix="opd_bench_"))
+
+import opd3_fixed as opd
+
+def _street_name(i: int) -> str:
+    """Betűkből álló egyedi szintetikus utcanév (a kulcsképzés a számjegyeket elhagyja)."""
+    letters = ""
+    while True:
+        letters = "abcdefghijklmnopqrstuvwxyz"[i % 26] + letters
+        i //= 26
+        if not i: return letters.capitalize()
+
+def _timeit(fn, repeat: int) -> float:
+    """Átlagos futásidő másodpercben."""
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t) / repeat
+
+def bench_local_geocoder():
+    tmp = tempfile.mkdtemp()
+    # 1) fixture: helyességi ellenőrzés
+    idx_path = os.path.join(tmp, "sample.idx")
+    opd.LocalGeocoder.build_index(os.path.join(FIXTURES, "budapest_addresses_sample.csv"), idx_path)
+    g = opd.LocalGeocoder(idx_path)
+    assert g.lookup("1061 Budapest, Andrássy út 1.") == g.lookup("Bp. VI. ker. Andrássy út 1")
+    assert g.lookup("Király u. 12") is not None
+    assert g.lookup("Teréz krt. 41") is not None       # nincs 41-es, a 39-es jön vissza
+    assert g.lookup("Nemlétező utca 5") is None
+    g.close()
+
+    # 2) szintetikus, nagy kivonat: 5000 utca x 40 házszám
+    csv_path = os.path.join(tmp, "big.csv"); idx_path = os.path.join(tmp, "big.idx")
+    rnd = random.Random(1)
+    with open(csv_path, "w", encoding="utf-8") as f:
+        f.write("street,housenumber,city,lat,lon\n")
+        for s in range(5000):
+            lat0, lon0 = 47.35 + rnd.random() * 0.3, 18.95 + rnd.random() * 0.3
+            for n in range(1, 41):
+                f.write(f"{_street_name(s)} utca,{n},Budapest,{lat0 + n * 1e-5:.6f},{lon0:.6f}\n")
+    t = time.perf_counter(); count = opd.LocalGeocoder.build_index(csv_path, idx_path); build_s = time.perf_counter() - t
+
+    queries = [f"Budapest, {_street_name(rnd.randrange(5000))} u. {rnd.randrange(1, 41)}." for _ in range(20000)]
+    tracemalloc.start()
+    g = opd.LocalGeocoder(idx_path)
+    for q in queries[:2000]:  # bemelegítés: a mmap lapok betöltése
+        g.lookup(q)
+    _, heap_peak = tracemalloc.get_traced_memory(); tracemalloc.stop()
+    t = time.perf_counter()
+    for q in queries:
+        g.lookup(q)
+    elapsed = time.perf_counter() - t
+    print(f"local_geocoder: {count} records, build {build_s:.2f} s, index {os.path.getsize(idx_path) / 1e6:.1f} MB "
+          f"({g.RECORD.size} B/record, mmap), python heap peak {heap_peak / 1e3:.0f} kB")
+    print(f"local_geocoder: {len(queries) / elapsed:,.0f} lookups/s ({elapsed / len(queries) * 1e6:.1f} us/lookup)")
+    g.close()
+
+def _legacy_parse_hungarian_address(address: str) -> str:
+    """A korábbi (opdtest_fixed.py) parser: rövidítésenként külön re.sub hívás."""
+    addr = address.strip()
+    match = re.search(r'(\d{4})\s*([A-ZÁÉÍÓÖŐÚÜŰ][a-záéíóöőúüű\s]+)', addr)
+    if match:
+        postal_code, city = match.groups()
+        addr = f"{postal_code} {city.strip()}"
+    abbreviations = {r'\bsgt\b': 'sugárút', r'\bkrt\b': 'körút', r'\but\b': 'utca', r'\bút\b': 'utca', r'\btér\b': 'tér',
+                     r'\bpl\b': 'pályaudvar', r'\báll\b': 'állomás', r'\bker\b': 'kerület', r'\bker\.\b': 'kerület'}
+    for roman in ["V", "I", "II", "III", "IV", "VI", "VII", "VIII", "IX", "X", "XI", "XII", "XIII", "XIV", "XV", "XVI",
+                  "XVII", "XVIII", "XIX", "XX", "XXI", "XXII", "XXIII"]:
+        abbreviations[rf'\b{roman}\.\s*ker\b'] = f'{roman}. kerület'
+    for pattern, replacement in abbreviations.items():
+        addr = re.sub(pattern, replacement, addr, flags=re.IGNORECASE)
+    return re.sub(r'\s+', ' ', addr).strip()
+
+def bench_address_normalizer():
+    rnd = random.Random(2)
+    streets = ["Andrássy u.", "Teréz krt", "Bartók Béla ut", "Király utca", "Nyugati pu", "Üllői út", "Hungária krt."]
+    addresses = [f"{rnd.choice(['', '1061 Budapest, ', 'Bp. '])}{rnd.randint(1, 23)}. ker. {rnd.choice(streets)} {rnd.randint(1, 120)}."
+                 for _ in range(2000)]
+    # eltérő írásmódok ugyanarra a kulcsra
+    assert opd.parse_hungarian_address("Teréz krt 12, 6. ker") == opd.parse_hungarian_address("Budapest, VI. kerület, Teréz körút 12.")
+    legacy = _timeit(lambda: [_legacy_parse_hungarian_address(a) for a in addresses], 3) / len(addresses)
+    cold = _timeit(lambda: [opd._normalize_address.__wrapped__(a) for a in addresses], 3) / len(addresses)
+    opd._normalize_address.cache_clear()
+    [opd.parse_hungarian_address(a) for a in addresses]
+    warm = _timeit(lambda: [opd.parse_hungarian_address(a) for a in addresses], 3) / len(addresses)
+    print(f"address_normalizer: legacy re.sub loop {legacy * 1e6:.1f} us, single pass {cold * 1e6:.1f} us "
+          f"({legacy / cold:.1f}x), memoized {warm * 1e6:.2f} us")
+
+def bench_geocode_standin():
+    """
+    Végponttól végpontig: geokódolás a helyi stand-in szerveren át + útvonal + térkép linkek,
+    hideg (üres cache) és meleg (cache-ből) futással.
+    """
+    server = opd.GeocodeStandinServer(os.path.join(FIXTURES, "nominatim_recordings.json"), latency_ms=(20, 80), error_rate=0.05).start()
+    opd.geocoder = opd.GeocoderService(opd.geocode_cache, opd.StandinProvider(server))
+    addresses = list(server.recordings)[:12]
+
+    def route_and_links():
+        route = opd.optimize_route(addresses)
+        return opd.coords_to_google_maps_url(route), opd.coords_to_apple_maps_url(route)
+
+    cold = _timeit(route_and_links, 1)
+    warm = _timeit(route_and_links, 20)
+    stats = opd.geocoder.provider.stats()
+    print(f"geocode_standin: 12 stops cold {cold * 1000:.0f} ms, warm {warm * 1000:.2f} ms")
+    print(f"geocode_standin: provider {stats['counters']}, p50 {stats['latency']['p50_ms']} ms, p95 {stats['latency']['p95_ms']} ms")
+    server.stop()
+
+def _budapest_points(n: int, seed: int = 7):
+    """Szintetikus megállók Budapest területén [(address, lat, lon), ...]."""
+    rnd = random.Random(seed)
+    return [(f"stop {i}", 47.40 + rnd.random() * 0.18, 18.98 + rnd.random() * 0.22) for i in range(n)]
+
+def bench_distance_matrix():
+    for n in (12, 50, 200):
+        pts = _budapest_points(n)
+        repeat = max(3, 20000 // (n * n))
+        legacy = _timeit(lambda: {(i, j): opd.haversine_distance((a[1], a[2]), (b[1], b[2])) if i != j else 0
+                                  for i, a in enumerate(pts) for j, b in enumerate(pts)}, repeat)
+        vec = _timeit(lambda: opd.distance_matrix(pts), repeat)
+        m = opd._matrix_rows(opd.distance_matrix(pts))
+        assert abs(m[0][n - 1] - opd.haversine_distance(pts[0][1:], pts[n - 1][1:])) < 1e-9
+        print(f"distance_matrix: n={n:3d} dict of haversine {legacy * 1000:8.3f} ms, "
+              f"{'numpy' if opd.NUMPY_AVAILABLE else 'python'} {vec * 1000:7.3f} ms ({legacy / vec:.0f}x)")
+
+def _legacy_tsp_2opt(coords_with_addr: list) -> list:
+    """A korábbi tsp_2opt: dict mátrix, teljes újraszámolás minden cserénél."""
+    if len(coords_with_addr) <= 2:
+        return coords_with_addr
+
+    n = len(coords_with_addr)
+    has_fixed_start = coords_with_addr[0][0] == "CURRENT_LOCATION"
+
+    # Ha van rögzített start, azt megtartjuk
+    if has_fixed_start:
+        fixed_start = coords_with_addr[0]
+        points = coords_with_addr[1:]
+    else:
+        fixed_start = None
+        points = coords_with_addr[:]
+
+    if not points:
+        return coords_with_addr
+
+    # Távolság mátrix létrehozása
+    def distance_matrix(pts):
+        matrix = {}
+        for i, p1 in enumerate(pts):
+            for j, p2 in enumerate(pts):
+                if i != j:
+                    matrix[(i, j)] = opd.haversine_distance((p1[1], p1[2]), (p2[1], p2[2]))
+                else:
+                    matrix[(i, j)] = 0
+        return matrix
+
+    # Ha van rögzített start, azt is beletesszük a mátrixba
+    all_points = [fixed_start] + points if fixed_start else points
+    distances = {}
+    for i, p1 in enumerate(all_points):
+        for j, p2 in enumerate(all_points):
+            if i != j:
+                distances[(i, j)] = opd.haversine_distance((p1[1], p1[2]), (p2[1], p2[2]))
+            else:
+                distances[(i, j)] = 0
+
+    # Nearest neighbor algoritmus javított változata
+    if fixed_start:
+        route = [0]  # Start a rögzített ponttal
+        unvisited = list(range(1, len(all_points)))
+    else:
+        # Legjobb start pont keresése: válasszuk a centroidhoz legközelebbit
+        lat_center = sum(p[1] for p in all_points) / len(all_points)
+        lon_center = sum(p[2] for p in all_points) / len(all_points)
+        best_start = min(range(len(all_points)),
+                        key=lambda i: opd.haversine_distance((all_points[i][1], all_points[i][2]),
+                                                        (lat_center, lon_center)))
+        route = [best_start]
+        unvisited = [i for i in range(len(all_points)) if i != best_start]
+
+    # Nearest neighbor építés
+    while unvisited:
+        current = route[-1]
+        next_city = min(unvisited, key=lambda city: distances[(current, city)])
+        route.append(next_city)
+        unvisited.remove(next_city)
+
+    # 2-opt javítás
+    def two_opt_swap(route, i, k):
+        new_route = route[:]
+        new_route[i:k+1] = route[i:k+1][::-1]
+        return new_route
+
+    def route_distance(route):
+        total = 0
+        for i in range(len(route)):
+            j = (i + 1) % len(route)
+            total += distances[(route[i], route[j])]
+        return total
+
+    # 2-opt optimalizálás
+    improved = True
+    max_iterations = 1000
+    iteration = 0
+
+    while improved and iteration < max_iterations:
+        improved = False
+        iteration += 1
+
+        for i in range(len(route)):
+            for k in range(i + 2, len(route)):
+                # Ha van rögzített start, ne mozgassuk
+                if fixed_start and (i == 0 or k == len(route) - 1):
+                    continue
+
+                new_route = two_opt_swap(route, i, k)
+                if route_distance(new_route) < route_distance(route):
+                    route = new_route
+                    improved = True
+                    break
+            if improved:
+                break
+
+    # Vissza alakítás koordinátákra
+    return [all_points[i] for i in route]
+
+def _tour_km(route) -> float:
+    """Zárt körút hossza (km)."""
+    return opd.calculate_total_distance(list(route) + [route[0]])
+
+def bench_local_search():
+    for n in (12, 30, 60, 100, 200, 500):
+        pts = _budapest_points(n, seed=n)
+        repeat = 5 if n <= 100 else 2
+        new = _timeit(lambda: opd.tsp_2opt(pts), repeat)
+        line = f"local_search: n={n:3d} 2-opt+Or-opt {new * 1000:7.2f} ms, {_tour_km(opd.tsp_2opt(pts)):6.1f} km"
+        if n <= 60:  # a régi változat n=100 fölött perceket fut
+            old = _timeit(lambda: _legacy_tsp_2opt(pts), 1)
+            line += f" | legacy 2-opt {old * 1000:8.1f} ms, {_tour_km(_legacy_tsp_2opt(pts)):6.1f} km ({old / new:.0f}x)"
+        print(line)
+
+def bench_held_karp():
+    for n in (6, 8, 10, 13):
+        pts = [("CURRENT_LOCATION", 47.4979, 19.0402)] + _budapest_points(n, seed=n)
+        exact = _timeit(lambda: opd.optimize_coords(pts[1:], start_coord=pts[0]), 5)
+        km = opd.calculate_total_distance(opd.optimize_coords(pts[1:], start_coord=pts[0]))
+        line = f"held_karp: {n:2d} stops + start {exact * 1000:7.2f} ms, {km:6.2f} km"
+        if n <= 8:  # permutációk: n! útvonal, a korábbi brute force a calculate_total_distance-szel
+            def brute():
+                return min(([pts[0]] + list(p) for p in itertools.permutations(pts[1:])), key=opd.calculate_total_distance)
+            old = _timeit(brute, 1)
+            assert abs(opd.calculate_total_distance(brute()) - km) < 1e-9
+            line += f" | permutations {old * 1000:8.1f} ms ({old / exact:.0f}x)"
+        print(line)
+
+def bench_time_budget():
+    for n in (50, 150, 400):
+        pts = _budapest_points(n, seed=n)
+        start = ("CURRENT_LOCATION", 47.4979, 19.0402)
+        parts = []
+        for budget in (0, 50, 200, 1000):
+            route, meta = opd.solve_route(pts, start_coord=start, time_budget_ms=budget)
+            assert len(route) == n + 1
+            parts.append(f"{budget}ms: {meta['distance_km']:.1f} km ({meta['elapsed_ms']:.0f} ms, {meta['iterations']} kicks)")
+        print(f"time_budget: n={n:3d} " + " | ".join(parts))
+
+def bench_open_path():
+    """Vezetett km: nyitott útvonal cél (solve_route) vs. a korábbi zárt kör + forgatás."""
+    start = ("CURRENT_LOCATION", 47.4979, 19.0402)
+    restaurant = ("END_LOCATION", 47.5076, 19.0660)
+    for n in (20, 50, 100):
+        old_km = new_km = old_free = new_free = 0.0
+        for seed in range(10):
+            pts = _budapest_points(n, seed=seed)
+            old_km += opd.calculate_total_distance(opd.tsp_2opt([start] + pts, time_budget_ms=100))
+            new_km += opd.solve_route(pts, start_coord=start, time_budget_ms=100)[1]["distance_km"]
+            old_free += opd.calculate_total_distance(opd.rotate_route_to_centroid_start(opd.tsp_2opt(pts, time_budget_ms=100)))
+            new_free += opd.solve_route(pts, time_budget_ms=100)[1]["distance_km"]
+        back = sum(opd.solve_route(_budapest_points(n, seed=seed), start_coord=start, end_coord=restaurant, time_budget_ms=100)[1]["distance_km"]
+                   for seed in range(10))
+        print(f"open_path: n={n:3d} from courier: cycle+rotate {old_km / 10:6.1f} km, open path {new_km / 10:6.1f} km "
+              f"({(1 - new_km / old_km) * 100:.1f}% shorter) | no start: {old_free / 10:6.1f} -> {new_free / 10:6.1f} km "
+              f"| back to restaurant {back / 10:6.1f} km")
+
+def bench_pickup_delivery():
+    """Több étterem: előbb minden felvétel, aztán kiszállítás (két külön útvonal) vs. közös felvétel+kiszállítás terv."""
+    start = ("CURRENT_LOCATION", 47.4979, 19.0402)
+    for restaurants, orders in ((2, 6), (3, 9), (4, 12), (5, 20)):
+        sep_km = pdp_km = pdp_ms = 0.0
+        for seed in range(10):
+            rnd = random.Random(seed)
+            rest = _budapest_points(restaurants, seed=100 + seed)
+            drops = _budapest_points(orders, seed=200 + seed)
+            owner = [rnd.randrange(restaurants) for _ in range(orders)]
+            # külön: éttermek a futártól, majd a kiszállítások az utolsó étteremtől
+            pickups, _ = opd.solve_route(rest, start_coord=start)
+            deliveries, _ = opd.solve_route(drops, start_coord=("CURRENT_LOCATION",) + tuple(pickups[-1][1:]))
+            sep_km += opd.calculate_total_distance(pickups) + opd.calculate_total_distance(deliveries)
+            route, meta = opd.solve_route(rest + drops, start_coord=start, precedence={restaurants + i: owner[i] for i in range(orders)})
+            pos = {x: i for i, x in enumerate(meta["order"])}
+            assert all(pos[owner[i]] < pos[restaurants + i] for i in range(orders))
+            pdp_km += meta["distance_km"]; pdp_ms += meta["elapsed_ms"]
+        print(f"pickup_delivery: {restaurants} restaurants, {orders:2d} orders: pickups-then-drops {sep_km / 10:6.1f} km, "
+              f"combined {pdp_km / 10:6.1f} km ({(1 - pdp_km / sep_km) * 100:.1f}% less, {pdp_ms / 10:.1f} ms)")
+
+def bench_road_matrix():
+    t = time.perf_counter()
+    net = opd.RoadNetwork.from_file(os.path.join(FIXTURES, "road_graph_sample.json"))
+    load_ms = (time.perf_counter() - t) * 1000
+    # a fixture gráfban a Duna (19.05 körül) csak hidakon keresztezhető, és vannak egyirányú utcák
+    west, east = ("w", 47.47, 19.04), ("e", 47.47, 19.065)
+    m = opd._matrix_rows(net.matrix([west, east]))
+    assert m[0][1] > 1.5 * opd.haversine_distance(west[1:], east[1:])
+    rnd = random.Random(5)
+    pts = [(f"stop {i}", 47.445 + rnd.random() * 0.11, 18.985 + rnd.random() * 0.15) for i in range(50)]
+    elapsed = _timeit(lambda: net.matrix(pts), 5)
+    road = opd._matrix_rows(net.matrix(pts))
+    assert any(abs(road[i][j] - road[j][i]) > 1e-6 for i in range(50) for j in range(50))
+    stats = net.stats()
+    print(f"road_matrix: graph {stats['nodes']} nodes / {stats['edges']} edges loaded in {load_ms:.0f} ms, "
+          f"50x50 matrix {elapsed * 1000:.1f} ms ({stats['settled'] // max(stats['searches'], 1)} nodes settled per source)")
+    # ugyanaz a 20 megálló: légvonalra optimalizált sorrend vs. utcahálózatra optimalizált, úthálózati km-ben
+    start = ("CURRENT_LOCATION", 47.50, 19.00)
+    legs = [start] + pts[:20]
+    _, straight_meta = opd.solve_route(pts[:20], start_coord=start, time_budget_ms=100)
+    straight_order = [0] + [i + 1 for i in straight_meta["order"]]
+    opd.road_network = net
+    _, road_meta = opd.solve_route(pts[:20], start_coord=start, time_budget_ms=100)
+    opd.road_network = None
+    on_road = opd.route_length(straight_order, opd._matrix_rows(net.matrix(legs)))
+    print(f"road_matrix: 20 stops driven on roads: haversine-optimized order {on_road:.1f} km, "
+          f"road-optimized order {road_meta['distance_km']:.1f} km ({(1 - road_meta['distance_km'] / on_road) * 100:.1f}% less)")
+
+def bench_pair_cost_cache():
+    """Visszatérő helyek (éttermek, törzsvendégek): route_matrix utcahálózaton, páronkénti cache-sel."""
+    opd.road_network = opd.RoadNetwork.from_file(os.path.join(FIXTURES, "road_graph_sample.json"))
+    rnd = random.Random(11)
+    pool = [(f"{_street_name(i)} utca {i + 1}", 47.445 + rnd.random() * 0.11, 18.985 + rnd.random() * 0.15) for i in range(60)]
+    requests_ = [[("CURRENT_LOCATION", 47.45 + rnd.random() * 0.1, 19.0 + rnd.random() * 0.12)] + rnd.sample(pool, 15) for _ in range(20)]
+    for round_name in ("cold", "sqlite", "memory"):
+        if round_name == "sqlite":
+            opd.pair_costs._lru.clear()  # újraindítás után: a memória üres, az SQLite tábla tölti vissza
+        cells = computed = 0; elapsed = 0.0
+        for pts in requests_:
+            info = {}
+            t = time.perf_counter(); opd.route_matrix(pts, info); elapsed += time.perf_counter() - t
+            cells += info["cells"]; computed += info["computed"]
+        print(f"pair_cost_cache: {round_name:6s}: 20 requests x 16x16, {computed:4d}/{cells} cells computed, "
+              f"{elapsed / 20 * 1000:5.1f} ms/matrix")
+    print(f"pair_cost_cache: {opd.pair_costs.stats()}")
+    opd.road_network = None
+
+def _dispatch_instance(couriers: int, orders: int, seed: int = 5):
+    """Szintetikus futárok (hely + 0-3 nyitott rendelés) és függő rendelések (étterem -> cím) Budapesten."""
+    rnd = random.Random(seed)
+    pt = lambda: (47.40 + rnd.random() * 0.15, 18.98 + rnd.random() * 0.20)
+    restaurants = [pt() for _ in range(20)]
+    cs = []
+    for i in range(couriers):
+        stops = [(rnd.choice(restaurants) if rnd.random() < 0.5 else None, pt()) for _ in range(rnd.randint(0, 3))]
+        cs.append({"id": i, "position": pt(), "stops": stops, "load": len(stops)})
+    return cs, [{"id": 10_000 + i, "pickup": rnd.choice(restaurants), "drop": pt()} for i in range(orders)]
+
+def _greedy_dispatch(couriers, orders):
+    """Alapvonal: a rendelések beérkezési sorrendjében mindegyik a legolcsóbban beszúrható szabad futárhoz."""
+    paths = {c["id"]: opd._courier_path(c["position"], c["stops"]) for c in couriers}
+    loads = {c["id"]: c["load"] for c in couriers}
+    total = 0.0; assigned = 0
+    for o in orders:
+        best = None
+        for cid, path in paths.items():
+            if loads[cid] >= opd.DISPATCH_MAX_LOAD:
+                continue
+            extra = float(opd._insertion_costs(path, [o["pickup"]], [o["drop"]])[0])
+            if extra <= opd.DISPATCH_MAX_DETOUR_KM and (best is None or extra < best[0]):
+                best = (extra, cid)
+        if best:
+            total += best[0]; assigned += 1; loads[best[1]] += 1
+            paths[best[1]] = opd._insert_order(paths[best[1]], o["pickup"], o["drop"])
+    return assigned, total
+
+def bench_dispatch():
+    """Függő rendelések szétosztása: körönkénti optimális párosítás (dispatch_assign) vs. mohó első-jött sorrend."""
+    for nc, no in ((50, 50), (200, 200), (300, 300), (100, 300)):
+        cs, os_ = _dispatch_instance(nc, no)
+        t = time.perf_counter(); assignments, unassigned = opd.dispatch_assign(cs, os_); elapsed = time.perf_counter() - t
+        opt_km = sum(a["detour_km"] for a in assignments)
+        t = time.perf_counter(); g_assigned, g_km = _greedy_dispatch(cs, os_); g_elapsed = time.perf_counter() - t
+        print(f"dispatch: {nc:3d} couriers x {no:3d} orders: assignment {elapsed * 1000:6.1f} ms, {len(assignments)} assigned, "
+              f"{opt_km:7.1f} km detour | greedy {g_elapsed * 1000:6.1f} ms, {g_assigned} assigned, {g_km:7.1f} km")
+
+def bench_order_bundles():
+    """Függő rendelések csomagolása: rendelésenkénti inkrementális frissítés + a csomagok teljes újraszámolása."""
+    for n in (100, 500, 2000):
+        rnd = random.Random(n)
+        bundler = opd.OrderBundler()
+        now = time.time()
+        t = time.perf_counter()
+        for i in range(n):
+            bundler.add(i, 47.40 + rnd.random() * 0.15, 18.98 + rnd.random() * 0.20, now - rnd.random() * 3600)
+        add_us = (time.perf_counter() - t) / n * 1e6
+        query_ms = _timeit(bundler.bundles, 5) * 1000
+        st = bundler.stats()
+        print(f"order_bundles: {n:5d} pending: add {add_us:5.1f} us/order, bundles() {query_ms:6.2f} ms, "
+              f"{st['bundles']} bundles / {st['bundled_orders']} orders")
+
+def bench_pending_index():
+    """Függő rendelések térbeli indexe: sugár és k legközelebbi lekérdezés vs. teljes lista rendezése."""
+    for n in (1000, 5000):
+        rnd = random.Random(n)
+        index = opd.PendingOrderIndex()
+        pts = [(47.40 + rnd.random() * 0.15, 18.98 + rnd.random() * 0.20) for _ in range(n)]
+        for i, (lat, lon) in enumerate(pts):
+            index.add(i, lat, lon)
+        queries = [(47.40 + rnd.random() * 0.15, 18.98 + rnd.random() * 0.20) for _ in range(200)]
+        it = itertools.cycle(queries)
+        full = _timeit(lambda: sorted((opd.haversine_distance(next(it), p), i) for i, p in enumerate(pts)), 20) * 1000
+        for label, fn in (("radius 1 km", lambda: index.within(*next(it), 1.0)),
+                          ("radius 3 km", lambda: index.within(*next(it), 3.0)),
+                          ("10 nearest ", lambda: index.nearest(*next(it), 10))):
+            print(f"pending_index: {n:5d} orders: {label} {_timeit(fn, 500) * 1000:6.3f} ms/query (full scan + sort {full:6.2f} ms)")
+
+BENCHMARKS = {
+    "local_geocoder": bench_local_geocoder,
+    "address_normalizer": bench_address_normalizer,
+    "geocode_standin": bench_geocode_standin,
+    "distance_matrix": bench_distance_matrix,
+    "local_search": bench_local_search,
+    "held_karp": bench_held_karp,
+    "time_budget": bench_time_budget,
+    "open_path": bench_open_path,
+    "pickup_delivery": bench_pickup_delivery,
+    "road_matrix": bench_road_matrix,
+    "pair_cost_cache": bench_pair_cost_cache,
+    "dispatch": bench_dispatch,
+    "order_bundles": bench_order_bundles,
+    "pending_index": bench_pending_index,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
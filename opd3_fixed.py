@@ -9,11 +9,25 @@ import json
 import threading
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import urllib.parse
 import math
 import itertools
+import functools
 import time
+import struct
+import mmap
+import csv
+import random
+import heapq
+import secrets
+from array import array
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from queue import Queue, Empty
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import current_process, get_context, shared_memory
 from typing import Dict, List, Optional, Tuple
 
 from flask import Flask, render_template_string, request, jsonify
@@ -23,7 +37,7 @@ from flask import send_file
 import openpyxl
 from io import BytesIO
 
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 
 # Telegram imports are optional if you run bot; keep them to preserve original behavior
 try:
@@ -34,48 +48,1058 @@ try:
 except Exception:
     TELEGRAM_AVAILABLE = False
 
+# NumPy opcionális: nélküle a távolságmátrix tiszta Pythonban készül
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
 # =============== CONFIG ===============
 BOT_TOKEN = "your_telegram_bot_token"
 WEBAPP_URL = "your_webapp_url"
 DB_NAME = "restaurant_orders.db"
 ADMIN_USER_IDS = [7553912440]  # adjust as needed
 
+# Geokód cache: sikeres találat / sikertelen cím élettartama (mp), memóriában tartott címek száma
+GEOCODE_CACHE_TTL = 30 * 24 * 3600
+GEOCODE_NEGATIVE_TTL = 6 * 3600
+GEOCODE_LRU_SIZE = 2048
+SHORT_URL_LRU_SIZE = 1024
+# Kimenő HTTP (HttpClient): hostonként tartós kapcsolat, timeout (mp), újrapróbálás backoff-fal, párhuzamos kérés korlát.
+# Rate limitelt szolgáltatónál (Nominatim) nincs HTTP szintű újrapróbálás: az megkerülné a GeocoderService
+# token bucket-jét és a megszakítót, az újrapróbálást a geokódoló (cache / breaker / geocode_worker) végzi.
+HTTP_HOST_POLICIES = {
+    "nominatim.openstreetmap.org": {"timeout": 8, "retries": 0, "backoff": 0.5, "max_concurrency": 2},
+    "tinyurl.com": {"timeout": 5, "retries": 2, "backoff": 0.3, "max_concurrency": 4},
+}
+HTTP_DEFAULT_POLICY = {"timeout": 10, "retries": 1, "backoff": 0.5, "max_concurrency": 4}
+HTTP_RETRY_STATUSES = (500, 502, 503, 504)  # 429-et nem ismétlünk: azt a geokód megszakító kezeli
+
+# Geokódoló szolgáltató: "nominatim" (éles) vagy "standin" (helyi HTTP utánzat rögzített válaszokkal, terheléses teszthez)
+GEOCODER_PROVIDER = "nominatim"
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_USER_AGENT = "OPDRouteBot/1.0"
+NOMINATIM_TIMEOUT = 8
+# Nominatim usage policy: legfeljebb 1 kérés / mp az egész alkalmazásra (Flask + bot együtt)
+NOMINATIM_RATE_PER_SEC = 1.0
+NOMINATIM_BURST = 1
+GEOCODE_STANDIN_RECORDINGS = "fixtures/nominatim_recordings.json"
+GEOCODE_STANDIN_LATENCY_MS = (50, 300)   # egyenletes eloszlású válaszidő
+GEOCODE_STANDIN_ERROR_RATE = 0.0         # ekkora arányban válaszol 503-mal / 429-cel
+GEOCODE_STANDIN_RATE_PER_SEC = 50.0
+# Megszakító: ennyi egymás utáni timeout / 429 / 5xx után a geokódoló nem hívja a szolgáltatót,
+# hanem azonnal a (lejárt) cache-ből szolgál ki; BREAKER_COOLDOWN mp múlva egy próbakéréssel ellenőriz.
+GEOCODE_BREAKER_THRESHOLD = 3
+GEOCODE_BREAKER_COOLDOWN = 30
+GEOCODE_BREAKER_PROBE_QUERY = "deák ferenc tér, budapest"
+# Bemelegítés: a korábbi rendelések címeit előre geokódolja, a szolgáltató keretének legfeljebb ekkora részét használva
+GEOCODE_WARMUP_SHARE = 0.5
+GEOCODE_BATCH_WORKERS = 4
+# Offline geokódoló: utca/házszám/koordináta kivonat (CSV vagy OSM export) és az ebből épített rendezett index.
+# Ha egyik fájl sincs meg, csak a Nominatim marad.
+LOCAL_GEOCODER_CSV = "hu_addresses.csv"
+LOCAL_GEOCODER_INDEX = "hu_addresses.idx"
+LOCAL_GEOCODER_MAX_HOUSE_GAP = 10  # ha a házszám hiányzik, ennyin belüli szomszédos házszámot fogadunk el
+LOCAL_GEOCODER_DUP_TOLERANCE_M = 100  # azonos (utca, házszám, település) ennél távolabbi pontokkal: ütközés, kimarad
+# Útvonal lokális keresés (local_search): ennyi legközelebbi szomszéd a 2-opt / Or-opt jelöltlistában
+ROUTE_NEIGHBORS_K = 8
+# Pontos (Held-Karp) megoldás eddig a megállószámig; NumPy nélkül a tiszta Python DP lassabb, ott kisebb a határ
+ROUTE_EXACT_MAX_STOPS = 13
+ROUTE_EXACT_MAX_STOPS_PURE = 9
+# Anytime megoldó (solve_route): alapértelmezett és maximális időkeret kérésenként (ms)
+ROUTE_TIME_BUDGET_MS = 200
+ROUTE_TIME_BUDGET_MAX_MS = 5000
+# Legkisebb keret: elfogyott időnél és a RouteSolverPool időtúllépés / összeomlás utáni helyi számításnál is
+# ennyi ms-on belül leáll a keresés (0 keret nem jelent korlátlan keresést)
+ROUTE_FALLBACK_BUDGET_MS = 20
+# Útvonal cache (RouteCache): rendelés halmaz + ~100 m-es rácscellára kerekített start; státuszváltáskor törlődik
+ROUTE_CACHE_SIZE = 256
+ROUTE_CACHE_TTL = 600
+ROUTE_CACHE_CELL_M = 100
+# Útvonal számítás külön folyamatokban (RouteSolverPool): workerek, ennyi várakozó feladat fölött elutasít,
+# az időkereten túl ennyi ms-ot várunk a workerre, és csak ennyi megállótól megy a poolba (alatta gyors a pontos DP)
+ROUTE_POOL_WORKERS = 2
+ROUTE_POOL_MAX_PENDING = 4
+ROUTE_POOL_GRACE_MS = 1500
+ROUTE_POOL_MIN_STOPS = ROUTE_EXACT_MAX_STOPS + 1
+# Aszinkron útvonal feladatok (/api/route_jobs): számoló szálak, kész eredmény megőrzése (s), max tárolt feladat,
+# long-poll leghosszabb várakozás (s)
+ROUTE_JOB_WORKERS = 4
+ROUTE_JOB_TTL = 600
+ROUTE_JOB_MAX = 1000
+ROUTE_JOB_MAX_WAIT_S = 25
+# Diszpécser javaslatok (dispatch_plan): futáronként max aktív rendelés, a futár helye ennyi ideig friss (s),
+# terhelés büntetés aktív rendelésenként (km), ennél nagyobb kerülőt nem javasol (km)
+DISPATCH_MAX_LOAD = 4
+DISPATCH_LOCATION_MAX_AGE_S = 1800
+DISPATCH_LOAD_PENALTY_KM = 1.0
+DISPATCH_MAX_DETOUR_KM = 15.0
+# Rendelés csomagok (OrderBundler, DBSCAN jellegű): ennyi méteren belüli címek, ennyi másodpercen belül érkezve
+# szomszédok; sűrű pont legalább ennyi rendeléssel (önmagát is számolva). Új rendelés értesítés előtt ennyit
+# várunk a geokódolásra (a geocode_worker által mentett sort figyelve), hogy a csomag már benne legyen
+ORDER_BUNDLE_EPS_M = 700
+ORDER_BUNDLE_WINDOW_S = 1200
+ORDER_BUNDLE_MIN_ORDERS = 2
+ORDER_BUNDLE_MAX_ORDERS = DISPATCH_MAX_LOAD
+ORDER_BUNDLE_NOTIFY_WAIT_S = 2.0
+ORDER_BUNDLE_NOTIFY_POLL_S = 0.1
+# Függő rendelések térbeli indexe (PendingOrderIndex): rácscella mérete (m), /api/orders_near alap és max sugár (km)
+ORDER_INDEX_CELL_M = 500
+ORDER_NEAR_RADIUS_KM = 3.0
+ORDER_NEAR_MAX_RADIUS_KM = 50.0
+# Utcahálózat (RoadNetwork): előfeldolgozott gráf fájl; ha nincs, a távolság légvonalban (haversine) számít
+ROAD_GRAPH_FILE = "road_graph.json"
+ROAD_MAX_SNAP_KM = 0.5     # ennél messzebb a legközelebbi csomóponttól: a pont a gráfon kívül esik, légvonal
+ROAD_DETOUR_FACTOR = 1.4   # ha a gráfban nincs út a két pont között: légvonal * ennyi
+# Páronkénti útköltség cache (PairCostCache): memóriában tartott cellák, SQLite sorok felső korlátja
+PAIR_COST_LRU_SIZE = 50000
+PAIR_COST_MAX_ROWS = 500000
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 notification_queue: "Queue[Dict]" = Queue()
+# Frissen mentett rendelések ID-i, amiket a háttér geokódoló feldolgoz
+geocode_queue: "Queue[int]" = Queue()
+
+# ---------------- Outbound HTTP ----------------
+class LatencyHistogram:
+    """
+    Fix vödrös késleltetés hisztogram (ms). A percentilisek a vödör felső határát adják vissza.
+    """
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+    def __init__(self) -> None:
+        self._counts = [0] * len(self.BUCKETS_MS)
+        self._lock = threading.Lock()
+        self.total = 0; self.sum_ms = 0.0; self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.BUCKETS_MS):
+                if ms <= bound:
+                    self._counts[i] += 1; break
+            self.total += 1; self.sum_ms += ms; self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            target = q * self.total; seen = 0
+            for bound, c in zip(self.BUCKETS_MS, self._counts):
+                seen += c
+                if c and seen >= target:
+                    return bound if bound != float("inf") else self.max_ms
+        return 0.0
+
+    def snapshot(self) -> Dict:
+        return {"count": self.total, "avg_ms": round(self.sum_ms / self.total, 1) if self.total else 0.0,
+                "p50_ms": self.percentile(0.5), "p95_ms": self.percentile(0.95), "p99_ms": self.percentile(0.99),
+                "max_ms": round(self.max_ms, 1),
+                "buckets": {("inf" if b == float("inf") else str(b)): c for b, c in zip(self.BUCKETS_MS, self._counts)}}
+
+class HttpClient:
+    """
+    Közös kimenő HTTP réteg (Nominatim, TinyURL, ...): hostonként egy keep-alive requests.Session
+    kapcsolat-poollal, a HTTP_HOST_POLICIES szerinti timeout / újrapróbálás (exponenciális backoff) /
+    párhuzamossági korláttal, és hostonkénti késleltetés hisztogrammal.
+    """
+    def __init__(self, policies: Dict[str, Dict] = HTTP_HOST_POLICIES, default: Dict = HTTP_DEFAULT_POLICY) -> None:
+        self.policies = policies
+        self.default = default
+        self._hosts: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host: str) -> Dict:
+        with self._lock:
+            h = self._hosts.get(host)
+            if h is None:
+                policy = dict(self.default, **self.policies.get(host, {}))
+                retry = Retry(total=policy["retries"], backoff_factor=policy["backoff"], status_forcelist=HTTP_RETRY_STATUSES,
+                              allowed_methods=frozenset(["GET"]), raise_on_status=False)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=policy["max_concurrency"], max_retries=retry)
+                session.mount("http://", adapter); session.mount("https://", adapter)
+                h = {"policy": policy, "session": session, "slots": threading.BoundedSemaphore(policy["max_concurrency"]),
+                     "latency": LatencyHistogram(), "counters": {"requests": 0, "errors": 0, "saturated": 0}}
+                self._hosts[host] = h
+            return h
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        h = self._host(urllib.parse.urlsplit(url).netloc)
+        timeout = kwargs.setdefault("timeout", h["policy"]["timeout"])
+        if not h["slots"].acquire(timeout=timeout):
+            with self._lock: h["counters"]["saturated"] += 1
+            raise requests.Timeout(f"too many concurrent requests to {urllib.parse.urlsplit(url).netloc}")
+        t = time.perf_counter()
+        try:
+            with self._lock: h["counters"]["requests"] += 1
+            return h["session"].get(url, **kwargs)
+        except Exception:
+            with self._lock: h["counters"]["errors"] += 1
+            raise
+        finally:
+            h["latency"].observe((time.perf_counter() - t) * 1000)
+            h["slots"].release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {host: {"counters": dict(h["counters"]), "latency": h["latency"].snapshot()} for host, h in hosts.items()}
+
+http_client = HttpClient()
 
 # ---------------- Utilities: Address parsing / Geocode ----------------
+STREET_TYPE_ABBREVIATIONS = {
+    "u": "utca", "ut": "út", "krt": "körút", "sgt": "sugárút", "rkp": "rakpart", "ltp": "lakótelep",
+    "ktr": "köztér", "stny": "sétány", "pu": "pályaudvar", "áll": "állomás",
+}
+_ROMAN_NUMERALS = ["", "i", "ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x", "xi", "xii",
+                   "xiii", "xiv", "xv", "xvi", "xvii", "xviii", "xix", "xx", "xxi", "xxii", "xxiii"]
+_CITY_ALIASES = {"budapest": "budapest", "bp": "budapest"}
+# Ismert települések (Budapest és az agglomeráció, nagyvárosok): irányítószám után utcanév elé írva is városnak számít
+KNOWN_SETTLEMENTS = {
+    "budapest", "budaörs", "budakeszi", "budakalász", "csömör", "diósd", "dunaharaszti", "dunakeszi", "érd", "fót", "göd",
+    "gödöllő", "gyál", "halásztelek", "kerepes", "kistarcsa", "mogyoród", "nagytarcsa", "pilisborosjenő", "pomáz",
+    "solymár", "szentendre", "szigetszentmiklós", "törökbálint", "üröm", "vác", "vecsés", "debrecen", "szeged",
+    "miskolc", "pécs", "győr", "nyíregyháza", "kecskemét", "székesfehérvár",
+}
+# Egyetlen összevont minta: kerület ("6. ker", "VI.ker.") | irányítószám (+ város) | közterület rövidítés.
+# Az irányítószám egy címrész elején vagy "Budapest" után áll; az utána jövő szó csak akkor város, ha ismert
+# település, vagy vessző / a cím vége követi ("1075 Király u. 8": a "király" az utcanév része marad).
+_ADDRESS_TOKEN_RE = re.compile(
+    r"\b(?P<district>[ivxl]+|\d{1,2})\.?\s*ker(?:ület)?\b\.?"
+    r"|(?:^|(?<=,)|(?<=, )|(?<=budapest )|(?<=bp )|(?<=bp\. ))(?P<postcode>[1-9]\d{3})\b"
+    r"(?:\s+(?P<city>(?:" + "|".join(sorted(KNOWN_SETTLEMENTS | set(_CITY_ALIASES), key=len, reverse=True)) + r")\b"
+    r"|[^\W\d_]+(?=\.?\s*(?:,|$)))\.?)?"
+    r"|\b(?P<abbr>" + "|".join(sorted(map(re.escape, STREET_TYPE_ABBREVIATIONS), key=len, reverse=True)) + r")\b\.?"
+)
+_ROMAN_DISTRICT_WORD_RE = re.compile(r"([ivxl]+)\.")
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_address(address: str) -> str:
+    districts: List[str] = []
+    postcode: List[str] = []
+    def token(m: "re.Match") -> str:
+        if m.group("district"):
+            d = m.group("district")
+            if d.isdigit():
+                d = _ROMAN_NUMERALS[int(d)] if 0 < int(d) < len(_ROMAN_NUMERALS) else d
+            districts.append(f"{d}. kerület")
+            return ""
+        if m.group("postcode"):
+            city = _CITY_ALIASES.get(m.group("city"), m.group("city")) or ("budapest" if m.group("postcode")[0] == "1" else "")
+            postcode.append(f"{m.group('postcode')} {city}".strip())
+            return ""
+        return STREET_TYPE_ABBREVIATIONS[m.group("abbr")]
+    addr = _ADDRESS_TOKEN_RE.sub(token, " ".join(address.lower().split()))
+    parts, city = [], None
+    for part in addr.split(","):
+        words = part.split()
+        after_city = False
+        while words and words[0].rstrip(".") in _CITY_ALIASES:  # "Budapest Király u. 1", "Bp. XI. ..."
+            city = _CITY_ALIASES[words.pop(0).rstrip(".")]; after_city = True
+        # római szám ponttal kerület, ha a város után áll ("Bp. XI. Bartók Béla út 5") vagy önálló rész
+        # ("XI., Bartók Béla út 5"); utcanév eleje nem ("II. Rákóczi Ferenc út"), emelet sem ("II. em. 3")
+        m = _ROMAN_DISTRICT_WORD_RE.fullmatch(words[0]) if words else None
+        if (m and m.group(1) in _ROMAN_NUMERALS and (after_city or len(words) == 1)
+                and not (len(words) > 1 and words[1].rstrip(".") in _UNIT_WORDS)):
+            districts.append(f"{words.pop(0)} kerület")
+        if city and len(words) == 1 and len(words[0]) == 4 and words[0].isdigit():  # "Budapest 1075"
+            postcode.append(f"{words[0]} {city}"); continue
+        part = " ".join(words).strip(" .")
+        if part: parts.append(part)
+    tail = postcode[:1] or ([city] if city else []) or (["budapest"] if districts else [])  # római kerület = Budapest
+    return ", ".join(parts + districts[:1] + tail)
+
 def parse_hungarian_address(address: str) -> str:
     """
-    Kezdeti egyszerű normalizálás: eltávolít felesleges szóközöket és egyes rövidítéseket.
-    Konkrét, hosszabb eredeti parser megtartva a projektedben, itt minimalizálva.
+    Kanonikus magyar cím: ez a geokód cache kulcsa és a geokódoló lekérdezés is.
+    Kisbetűs, rövidítések kifejtve (krt -> körút, u. -> utca), kerület "vi. kerület" alakban,
+    irányítószám + város a végére rendezve:
+    "1061 Budapest, VI. ker. Andrássy u. 5." -> "andrássy utca 5, vi. kerület, 1061 budapest".
+    Egyetlen összevont regex menet, az eredmény memoizálva.
     """
-    if not address:
+    if not address or not address.strip():
         return ""
-    addr = address.strip()
-    # egyszerű normalizálás: több szóköz -> egy
-    addr = re.sub(r'\s+', ' ', addr)
-    return addr
+    return _normalize_address(address.strip())
+
+class GeocodeCache:
+    """
+    Kétszintű geokód cache: memóriabeli LRU a SQLite `geocode_cache` tábla előtt.
+    Kulcs a parse_hungarian_address kimenete. A sikertelen címeket is eltároljuk
+    (lat/lon NULL), rövidebb élettartammal, hogy ne kérdezzük újra percenként.
+    """
+    def __init__(self, db_path: str = DB_NAME, ttl: int = GEOCODE_CACHE_TTL,
+                 negative_ttl: int = GEOCODE_NEGATIVE_TTL, lru_size: int = GEOCODE_LRU_SIZE) -> None:
+        self.db_path = db_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, Tuple[Optional[Tuple[float, float]], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"lru_hits": 0, "db_hits": 0, "negative_hits": 0, "misses": 0, "expired": 0, "stores": 0}
+
+    def _expired(self, coord: Optional[Tuple[float, float]], updated_at: float) -> bool:
+        ttl = self.ttl if coord else self.negative_ttl
+        return time.time() - updated_at > ttl
+
+    def _remember(self, key: str, coord: Optional[Tuple[float, float]], updated_at: float) -> None:
+        with self._lock:
+            self._lru[key] = (coord, updated_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get(self, key: str, count: bool = True) -> Tuple[bool, Optional[Tuple[float, float]]]:
+        """
+        Visszatér (found, coord). found=False: nincs érvényes bejegyzés, geokódolni kell.
+        found=True és coord=None: negatív találat (a cím korábban nem volt feloldható).
+        count=False: belső ellenőrzés (pl. bemelegítés), nem számít bele a hit/miss statisztikába.
+        """
+        counters = self.counters if count else dict(self.counters)
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                coord, updated_at = entry
+                if not self._expired(coord, updated_at):
+                    self._lru.move_to_end(key)
+                    counters["lru_hits"] += 1
+                    if coord is None: counters["negative_hits"] += 1
+                    return True, coord
+                del self._lru[key]
+        try:
+            conn = sqlite3.connect(self.db_path); cur = conn.cursor()
+            cur.execute("SELECT lat, lon, updated_at FROM geocode_cache WHERE key = ?", (key,))
+            row = cur.fetchone(); conn.close()
+        except Exception as e:
+            logger.error(f"geocode cache read error: {e}"); row = None
+        with self._lock:
+            if row is None:
+                counters["misses"] += 1
+                return False, None
+            lat, lon, updated_at = row
+            coord = (lat, lon) if lat is not None and lon is not None else None
+            if self._expired(coord, updated_at):
+                counters["expired"] += 1; counters["misses"] += 1
+                return False, None
+            counters["db_hits"] += 1
+            if coord is None: counters["negative_hits"] += 1
+        self._remember(key, coord, updated_at)
+        return True, coord
+
+    def get_stale(self, key: str) -> Optional[Tuple[float, float]]:
+        """
+        Utolsó ismert koordináta a TTL-től függetlenül (kiesés idejére); negatív bejegyzést nem ad vissza.
+        """
+        try:
+            conn = sqlite3.connect(self.db_path); cur = conn.cursor()
+            cur.execute("SELECT lat, lon FROM geocode_cache WHERE key = ? AND lat IS NOT NULL AND lon IS NOT NULL", (key,))
+            row = cur.fetchone(); conn.close()
+        except Exception as e:
+            logger.error(f"geocode cache read error: {e}"); return None
+        if row:
+            with self._lock:
+                self.counters["stale_hits"] = self.counters.get("stale_hits", 0) + 1
+            return (row[0], row[1])
+        return None
+
+    def put(self, key: str, coord: Optional[Tuple[float, float]]) -> None:
+        now = time.time()
+        self._remember(key, coord, now)
+        try:
+            conn = sqlite3.connect(self.db_path); cur = conn.cursor()
+            cur.execute("INSERT OR REPLACE INTO geocode_cache(key, lat, lon, updated_at) VALUES (?,?,?,?)",
+                        (key, coord[0] if coord else None, coord[1] if coord else None, now))
+            conn.commit(); conn.close()
+        except Exception as e:
+            logger.error(f"geocode cache write error: {e}")
+        with self._lock:
+            self.counters["stores"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self.counters)
+            out["lru_size"] = len(self._lru)
+        hits = out["lru_hits"] + out["db_hits"]
+        out["hit_ratio"] = round(hits / (hits + out["misses"]), 3) if hits + out["misses"] else 0.0
+        return out
+
+class TokenBucket:
+    """
+    Szálbiztos token bucket: rate token/mp, legfeljebb capacity token gyűlhet fel.
+    Egy példányt használ minden szál (Flask kérések, háttér geokódoló, bot), így
+    az upstream felé menő összes kérés együtt tartja a limitet.
+    """
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+# ---------------- Local geocoder (offline extract) ----------------
+_STREET_DROP_TOKENS = {"budapest", "bp", "ker", "kerület"}
+_DISTRICT_RE = re.compile(r"\b[ivxl]+\.\s*(?:ker(?:ület)?\b\.?)?", re.IGNORECASE)
+_STREET_TOKEN_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+_HOUSE_NUMBER_RE = re.compile(r"^(?P<street>.*?[^\W\d_].*?)\s+(?P<num>\d{1,4})\b")
+_POSTCODE_PREFIX_RE = re.compile(r"^\s*\d{4}\s+")
+# közterület-típus szavak (utcakulcsban) és emelet / ajtó / lépcsőház jelölők ("2. em. 5", "fsz. 1")
+STREET_TYPE_WORDS = set(STREET_TYPE_ABBREVIATIONS.values()) | {
+    "tér", "köz", "sor", "fasor", "park", "liget", "dűlő", "lejtő", "lépcső", "udvar", "körtér", "híd", "sziget"}
+_UNIT_WORDS = {"em", "emelet", "fsz", "fszt", "földszint", "ajtó", "lph", "lépcsőház", "ép", "épület"}
+
+def street_key(street: str) -> str:
+    """
+    Utcanév összehasonlító kulcsa: kisbetű, írásjelek nélkül, közterület-típus rövidítések kifejtve,
+    város / kerület tokenek elhagyva ("Bp. VI. ker. Andrássy u." -> "andrássy utca").
+    """
+    tokens = []
+    for t in _STREET_TOKEN_RE.findall(_DISTRICT_RE.sub(" ", (street or "").lower())):
+        if t in _STREET_DROP_TOKENS:
+            continue
+        tokens.append(STREET_TYPE_ABBREVIATIONS.get(t, t))
+    return " ".join(tokens)
+
+def has_street_type(key: str) -> bool:
+    """Az utcakulcsban van közterület-típus szó (utca, út, tér, ...)."""
+    return any(t in STREET_TYPE_WORDS for t in key.split())
+
+_POSTCODE_PART_RE = re.compile(r"(\d{4})(?: (.+))?")
+_DISTRICT_NAME_RE = re.compile(r"^\s*(?:([ivxl]+)|(\d{1,2}))\.?\s*(?:ker(?:ület)?\.?)?\s*$", re.IGNORECASE)
+
+def locality_key(postcode: str = "", city: str = "", district: str = "") -> str:
+    """
+    Település kulcs a helyi indexhez: Budapesten "budapest <kerület>" (1xxx irányítószámból vagy a kerületből),
+    ha a kerület nem ismert "budapest", máshol a település neve; csak irányítószámnál maga az irányítószám.
+    """
+    postcode = (postcode or "").strip()
+    city = " ".join((city or "").lower().split()).rstrip(".")
+    city = _CITY_ALIASES.get(city, city)
+    if len(postcode) == 4 and postcode.isdigit() and postcode[0] == "1" and city in ("", "budapest"):
+        return f"budapest {int(postcode[1:3])}"
+    m = _DISTRICT_NAME_RE.match(district or "")
+    if m and city in ("", "budapest"):
+        n = _ROMAN_NUMERALS.index(m.group(1).lower()) if m.group(1) and m.group(1).lower() in _ROMAN_NUMERALS else int(m.group(2) or 0)
+        if n:
+            return f"budapest {n}"
+    return city or postcode
+
+def address_locality(parsed: str) -> str:
+    """
+    A parse_hungarian_address kimenetéből a település kulcs (locality_key), "" ha a cím nem ad meg települést.
+    """
+    parts = (parsed or "").split(", ")
+    postcode = city = district = ""
+    for i, part in enumerate(parts):
+        m = _POSTCODE_PART_RE.fullmatch(part)
+        if m:
+            postcode, city = m.group(1), m.group(2) or city
+        elif part.endswith(" kerület"):
+            district = part
+        elif len(parts) > 1 and i in (0, len(parts) - 1) and not any(c.isdigit() for c in part) and not has_street_type(street_key(part)):
+            city = city or part  # "szentendre, fő utca 5" / "fő utca 5, szentendre"
+    return locality_key(postcode, city, district)
+
+def localities_match(query: str, record: str) -> bool:
+    """Ha a lekérdezés megad települést, egyeznie kell; Budapesten a hiányzó kerület bármelyikre illik."""
+    if not query or query == record:
+        return True
+    q, r = query.split(" ", 1)[0], record.split(" ", 1)[0]
+    return q == r == "budapest" and (query == "budapest" or record == "budapest")
+
+def split_street_house(address: str) -> Optional[Tuple[str, int]]:
+    """
+    Címből (utcakulcs, házszám); pl. "1061 Budapest, Andrássy út 5. 2/3" -> ("andrássy út", 5).
+    Az emelet / ajtó részeket ("2. em. 5", "fsz. 1") kihagyja; közterület-típusos rész előnyben.
+    """
+    fallback = None
+    for part in reversed((address or "").split(",")):
+        m = _HOUSE_NUMBER_RE.match(_POSTCODE_PREFIX_RE.sub("", part).strip())
+        if not m:
+            continue
+        key = street_key(m.group("street"))
+        if not key or any(t in _UNIT_WORDS for t in key.split()):
+            continue
+        if has_street_type(key):
+            return key, int(m.group("num"))
+        fallback = fallback or (key, int(m.group("num")))
+    return fallback
+
+class LocalGeocoder:
+    """
+    Offline geokódoló egy rendezett, memóriába mappelt bináris indexen.
+    Rekord: utcakulcs (fix 40 byte, UTF-8, nullával kitöltve), házszám (uint16), település kulcs (24 byte,
+    locality_key), lat/lon (float32, ~0.5 m pontosság).
+    Big-endian tárolás, így a rekord első 42 byte-ja bájtonként összehasonlítva is (utcakulcs, házszám)
+    sorrendű: a bináris keresés közvetlenül a mmap szeleteken megy, az index nem töltődik be a Python heap-re.
+    Ugyanaz az utca több településen is lehet: ha a cím nem dönti el, melyik, nincs találat (jön a cache / szolgáltató).
+    """
+    MAGIC = b"OPDGEO2\0"
+    HEADER = struct.Struct(">8sI")
+    RECORD = struct.Struct(">40sH24sff")
+    STREET_WIDTH = 40
+    LOCALITY_WIDTH = 24
+    SORT_KEY = struct.Struct(">40sH")
+
+    def __init__(self, index_path: str) -> None:
+        self.index_path = index_path
+        self._f = open(index_path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"not a local geocoder index: {index_path}")
+        self.counters = {"hits": 0, "nearest_hits": 0, "misses": 0, "ambiguous": 0}
+
+    @classmethod
+    def encode_street(cls, key: str) -> bytes:
+        return key.encode("utf-8")[:cls.STREET_WIDTH]
+
+    @classmethod
+    def encode_locality(cls, key: str) -> bytes:
+        return key.encode("utf-8")[:cls.LOCALITY_WIDTH]
+
+    @classmethod
+    def build_index(cls, csv_path: str, index_path: str) -> int:
+        """
+        CSV -> bináris index. Elfogadott oszlopnevek: street / addr:street, housenumber / addr:housenumber, lat, lon,
+        és a település: postcode / addr:postcode, city / addr:city, district / addr:district.
+        Az azonos (utca, házszám, település) kulcsú, egymástól távoli sorok ütköznek: egyik sem kerül az indexbe.
+        Visszatér a rekordok számával.
+        """
+        rows = {}
+        conflicts = set()
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            for r in csv.DictReader(f):
+                street = r.get("street") or r.get("addr:street") or ""
+                number = re.match(r"\d+", (r.get("housenumber") or r.get("addr:housenumber") or "").strip())
+                try:
+                    lat, lon = float(r["lat"]), float(r["lon"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if not number or int(number.group()) > 0xFFFF:
+                    continue
+                key = cls.encode_street(street_key(street))
+                if not key:
+                    continue
+                locality = cls.encode_locality(locality_key(r.get("postcode") or r.get("addr:postcode") or "",
+                                                            r.get("city") or r.get("addr:city") or "",
+                                                            r.get("district") or r.get("addr:district") or ""))
+                row_key = (key, int(number.group()), locality)
+                if row_key in rows and haversine_distance(rows[row_key], (lat, lon)) * 1000 > LOCAL_GEOCODER_DUP_TOLERANCE_M:
+                    conflicts.add(row_key)
+                rows.setdefault(row_key, (lat, lon))
+        for row_key in conflicts:
+            del rows[row_key]
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(cls.HEADER.pack(cls.MAGIC, len(rows)))
+            for (key, house, locality), (lat, lon) in sorted(rows.items()):
+                out.write(cls.RECORD.pack(key, house, locality, lat, lon))
+        os.replace(tmp_path, index_path)
+        logger.info(f"Local geocoder index built: {len(rows)} addresses ({len(conflicts)} conflicting left out) -> {index_path}")
+        return len(rows)
+
+    @classmethod
+    def from_files(cls, csv_path: str, index_path: str) -> Optional["LocalGeocoder"]:
+        """
+        Megnyitja az indexet; ha hiányzik, régebbi a CSV-nél vagy régi formátumú, előbb újraépíti. Ha egyik sincs, None.
+        """
+        try:
+            if os.path.exists(csv_path) and (not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(csv_path)
+                                             or not cls._current_format(index_path)):
+                cls.build_index(csv_path, index_path)
+            if os.path.exists(index_path):
+                return cls(index_path)
+        except Exception as e:
+            logger.error(f"local geocoder unavailable: {e}")
+        return None
+
+    @classmethod
+    def _current_format(cls, index_path: str) -> bool:
+        with open(index_path, "rb") as f:
+            return f.read(len(cls.MAGIC)) == cls.MAGIC
+
+    def _record(self, i: int) -> Tuple[bytes, int, str, float, float]:
+        key, house, locality, lat, lon = self.RECORD.unpack_from(self._mm, self.HEADER.size + i * self.RECORD.size)
+        return key.rstrip(b"\0"), house, locality.rstrip(b"\0").decode("utf-8", "ignore"), round(lat, 6), round(lon, 6)
+
+    def _lower_bound(self, key: bytes, house: int) -> int:
+        target = self.SORT_KEY.pack(key, house)
+        mm, base, size, width = self._mm, self.HEADER.size, self.RECORD.size, self.SORT_KEY.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = base + mid * size
+            if mm[off:off + width] < target: lo = mid + 1
+            else: hi = mid
+        return lo
+
+    def lookup(self, address: str) -> Optional[Tuple[float, float]]:
+        """
+        Pontos (utca, házszám) találat, különben ugyanazon az utcán a legközelebbi azonos oldali
+        (páros/páratlan) házszám LOCAL_GEOCODER_MAX_HOUSE_GAP-en belül. Ha a cím megad települést
+        (irányítószám, kerület, város), a rekordénak egyeznie kell. None, ha nincs ilyen, vagy ha több
+        település is szóba jön (kétértelmű: a cache / szolgáltató dönt).
+        """
+        parsed = split_street_house(address)
+        if not parsed:
+            self.counters["misses"] += 1
+            return None
+        key, house = self.encode_street(parsed[0]), parsed[1]
+        locality = address_locality(address)
+        gap_max = LOCAL_GEOCODER_MAX_HOUSE_GAP
+        best: Dict[str, Tuple[int, float, float]] = {}  # település -> (eltérés, lat, lon)
+        for i in range(self._lower_bound(key, max(0, house - gap_max)), self.count):
+            k, h, rec_locality, lat, lon = self._record(i)
+            if k != key or h > house + gap_max:
+                break
+            if not localities_match(locality, rec_locality):
+                continue
+            gap = abs(h - house) + (0 if h % 2 == house % 2 else gap_max)
+            if gap <= gap_max and (rec_locality not in best or gap < best[rec_locality][0]):
+                best[rec_locality] = (gap, lat, lon)
+        if len(best) > 1:
+            self.counters["ambiguous"] += 1
+            return None
+        if best:
+            gap, lat, lon = next(iter(best.values()))
+            self.counters["hits" if gap == 0 else "nearest_hits"] += 1
+            return (lat, lon)
+        self.counters["misses"] += 1
+        return None
+
+    def stats(self) -> Dict:
+        return dict(self.counters, records=self.count, index_bytes=len(self._mm))
+
+    def close(self) -> None:
+        self._mm.close(); self._f.close()
+
+# ---------------- Geocode providers ----------------
+class GeocodeHTTPError(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(f"geocoder HTTP {status}")
+        self.status = status
+
+class GeocodeProvider:
+    """
+    Geokódoló szolgáltató alaposztály. search(query) -> (lat, lon) vagy None (nincs találat);
+    átmeneti hiba (hálózat, nem 200-as válasz) esetén kivételt dob. Minden hívás mért:
+    késleltetés hisztogram és hibaszámlálók szolgáltatónként.
+    """
+    name = "base"
+    rate_limit = 1.0  # kérés / mp, ezt a GeocoderService tartja be
+
+    def __init__(self) -> None:
+        self.latency = LatencyHistogram()
+        self.counters = {"requests": 0, "found": 0, "not_found": 0, "timeout": 0, "http_429": 0, "http_error": 0, "other_error": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def _search(self, query: str) -> Optional[Tuple[float, float]]:
+        raise NotImplementedError
+
+    def search(self, query: str) -> Optional[Tuple[float, float]]:
+        self._count("requests")
+        t = time.perf_counter()
+        try:
+            coord = self._search(query)
+        except requests.Timeout:
+            self._count("timeout"); raise
+        except GeocodeHTTPError as e:
+            self._count("http_429" if e.status == 429 else "http_error"); raise
+        except Exception:
+            self._count("other_error"); raise
+        finally:
+            self.latency.observe((time.perf_counter() - t) * 1000)
+        self._count("found" if coord else "not_found")
+        return coord
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return {"name": self.name, "counters": counters, "latency": self.latency.snapshot()}
+
+class NominatimProvider(GeocodeProvider):
+    name = "nominatim"
+    rate_limit = NOMINATIM_RATE_PER_SEC
+
+    def __init__(self, url: str = NOMINATIM_URL, user_agent: str = NOMINATIM_USER_AGENT, timeout: float = NOMINATIM_TIMEOUT) -> None:
+        super().__init__()
+        self.url = url; self.user_agent = user_agent; self.timeout = timeout
+
+    def _search(self, query: str) -> Optional[Tuple[float, float]]:
+        params = {'q': query, 'format': 'json', 'limit': 1, 'countrycodes': 'hu', 'addressdetails': 1}
+        headers = {'User-Agent': self.user_agent}
+        r = http_client.get(self.url, params=params, headers=headers, timeout=self.timeout)
+        if r.status_code != 200:
+            raise GeocodeHTTPError(r.status_code)
+        data = r.json()
+        if data and len(data) > 0:
+            return (float(data[0]['lat']), float(data[0]['lon']))
+        return None
+
+class GeocodeStandinServer:
+    """
+    Helyi Nominatim-utánzat terheléses teszthez: GET /search?q=... a rögzített válaszokat adja vissza
+    (JSON: {kanonikus cím: nominatim válasz lista}), beállítható késleltetéssel és hibaaránnyal.
+    Ismeretlen címre üres listát ad (mint a Nominatim, ha nincs találat).
+    """
+    def __init__(self, recordings_path: str = GEOCODE_STANDIN_RECORDINGS, latency_ms: Tuple[float, float] = GEOCODE_STANDIN_LATENCY_MS,
+                 error_rate: float = GEOCODE_STANDIN_ERROR_RATE, host: str = "127.0.0.1", port: int = 0) -> None:
+        with open(recordings_path, encoding="utf-8") as f:
+            self.recordings = {parse_hungarian_address(k): v for k, v in json.load(f).items()}
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urllib.parse.urlparse(self.path)
+                if parsed.path != "/search":
+                    self.send_error(404); return
+                time.sleep(random.uniform(*server.latency_ms) / 1000)
+                if random.random() < server.error_rate:
+                    self.send_error(random.choice((429, 503))); return
+                q = urllib.parse.parse_qs(parsed.query).get("q", [""])[0]
+                body = json.dumps(server.recordings.get(parse_hungarian_address(q), [])).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/search"
+
+    def start(self) -> "GeocodeStandinServer":
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        logger.info(f"Geocode stand-in listening on {self.url} ({len(self.recordings)} recorded addresses)")
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown(); self.httpd.server_close()
+
+class StandinProvider(NominatimProvider):
+    """
+    Ugyanaz a kliens, mint a NominatimProvider, de a helyi GeocodeStandinServer-t hívja, lazább rate limittel.
+    """
+    name = "standin"
+    rate_limit = GEOCODE_STANDIN_RATE_PER_SEC
+
+    def __init__(self, server: GeocodeStandinServer, timeout: float = NOMINATIM_TIMEOUT) -> None:
+        super().__init__(url=server.url, timeout=timeout)
+        self.server = server
+        # a Nominatim host policy-ja (HTTP újrapróbálás nélkül), hogy a terheléses teszt ugyanazt mérje
+        http_client.policies.setdefault(urllib.parse.urlsplit(server.url).netloc,
+                                        HTTP_HOST_POLICIES[urllib.parse.urlsplit(NOMINATIM_URL).netloc])
+
+def make_geocode_provider(kind: str = GEOCODER_PROVIDER) -> GeocodeProvider:
+    if kind == "standin":
+        return StandinProvider(GeocodeStandinServer().start())
+    return NominatimProvider()
+
+class CircuitBreaker:
+    """
+    closed -> (threshold egymás utáni hiba) -> open -> (cooldown után) half_open: egyetlen próbakérés mehet ki;
+    siker esetén closed, hiba esetén újra open.
+    """
+    def __init__(self, threshold: int = GEOCODE_BREAKER_THRESHOLD, cooldown: float = GEOCODE_BREAKER_COOLDOWN) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"opened": 0, "short_circuited": 0, "probes": 0}
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self.counters["probes"] += 1
+                return True
+            self.counters["short_circuited"] += 1
+            return False
+
+    def probe_due(self) -> bool:
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown
+
+    def blocked(self) -> bool:
+        """
+        Előzetes ellenőrzés a próbahely lefoglalása nélkül: nyitott (cooldown alatt) vagy folyamatban lévő próba.
+        A hívó ezután várhat a rate limitre, és csak utána kér helyet az allow()-val.
+        """
+        with self._lock:
+            if self.state == "closed" or (self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown):
+                return False
+            self.counters["short_circuited"] += 1
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info("Geocode circuit breaker closed (upstream recovered)")
+            self.state = "closed"; self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                if self.state == "closed":
+                    self.counters["opened"] += 1
+                    logger.warning(f"Geocode circuit breaker opened after {self.failures} consecutive failures")
+                self.state = "open"; self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counters, state=self.state, consecutive_failures=self.failures)
+
+class GeocoderService:
+    """
+    Közös geokódoló: offline index -> cache -> singleflight -> megszakító -> rate limit -> szolgáltató (Nominatim / stand-in).
+    - azonos, éppen folyamatban lévő címekre csak egy upstream kérés megy ki (a többi megvárja),
+    - lookup_many egyszerre oldja fel egy útvonal összes megállóját egy kis szálkészleten,
+    - szolgáltató kiesés alatt (nyitott megszakító) vagy hibánál a lejárt cache bejegyzést adja 'stale' státusszal.
+    """
+    def __init__(self, cache: "GeocodeCache", provider: GeocodeProvider, max_workers: int = GEOCODE_BATCH_WORKERS,
+                 local: Optional[LocalGeocoder] = None) -> None:
+        self.cache = cache
+        self.provider = provider
+        self.limiter = TokenBucket(provider.rate_limit, NOMINATIM_BURST)
+        self.local = local
+        self.breaker = CircuitBreaker()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geocode")
+        self.counters = {"upstream_calls": 0, "coalesced": 0, "errors": 0}
+
+    def _fetch(self, key: str, budget: Optional[TokenBucket] = None) -> Tuple[str, Optional[Tuple[float, float]]]:
+        found, coord = self.cache.get(key, count=False)  # amíg a sorra vártunk, más már feloldhatta
+        if found:
+            return ("ok" if coord else "not_found"), coord
+        if self.breaker.blocked():
+            return self._fallback(key)
+        if budget:
+            budget.acquire()  # a hívó saját kerete (pl. bemelegítés), upstream kérésenként
+        self.limiter.acquire()
+        # a próbahelyet csak a rate limit token után foglaljuk: várakozás közben a többi kérés nem látna nyitott megszakítót
+        if not self.breaker.allow():
+            return self._fallback(key)
+        with self._lock:
+            self.counters["upstream_calls"] += 1
+        try:
+            coord = self.provider.search(key)
+        except Exception as e:
+            logger.error(f"geocode error for '{key}': {e}")
+            with self._lock:
+                self.counters["errors"] += 1
+            self.breaker.record_failure()
+            return self._fallback(key)
+        self.breaker.record_success()
+        self.cache.put(key, coord)
+        return ("ok" if coord else "not_found"), coord
+
+    def _fallback(self, key: str) -> Tuple[str, Optional[Tuple[float, float]]]:
+        coord = self.cache.get_stale(key)
+        return ("stale", coord) if coord else ("error", None)
+
+    def degraded(self) -> bool:
+        return self.breaker.state != "closed"
+
+    def probe(self) -> None:
+        """
+        Nyitott megszakítónál, a cooldown letelte után egy próbakérés a szolgáltató felé (half-open).
+        """
+        if not self.breaker.probe_due():
+            return
+        self.limiter.acquire()
+        if not self.breaker.allow():
+            return
+        try:
+            self.provider.search(GEOCODE_BREAKER_PROBE_QUERY)
+        except Exception as e:
+            logger.warning(f"geocode probe failed: {e}")
+            self.breaker.record_failure()
+            return
+        self.breaker.record_success()
+
+    def lookup(self, address: str, budget: Optional[TokenBucket] = None) -> Tuple[str, Optional[Tuple[float, float]]]:
+        """
+        Visszatér (status, coord): 'ok' + (lat, lon), 'not_found' + None (a cím nem oldható fel),
+        'stale' + (lat, lon) (szolgáltató nem elérhető, utolsó ismert koordináta),
+        vagy 'error' + None (átmeneti hiba, érdemes később újrapróbálni).
+        budget: opcionális plusz token bucket, csak ténylegesen kimenő upstream kérésnél fogy belőle.
+        """
+        key = parse_hungarian_address(address)
+        if not key:
+            return "not_found", None
+        if self.local:
+            coord = self.local.lookup(key)
+            if coord:
+                return "ok", coord
+        found, coord = self.cache.get(key)
+        if found:
+            return ("ok" if coord else "not_found"), coord
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future(); self._inflight[key] = fut
+            else:
+                self.counters["coalesced"] += 1
+        if not leader:
+            return fut.result()
+        try:
+            result = self._fetch(key, budget)
+        except Exception as e:
+            logger.error(f"geocode error for '{key}': {e}")
+            result = ("error", None)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        fut.set_result(result)
+        return result
+
+    def lookup_many(self, addresses: List[str], budget: Optional[TokenBucket] = None) -> List[Tuple[str, Optional[Tuple[float, float]]]]:
+        """
+        Több cím párhuzamos feloldása; az eredmény sorrendje megegyezik a bemenetével.
+        """
+        unique = list(dict.fromkeys(addresses))
+        if len(unique) > 1:
+            results = dict(zip(unique, self._pool.map(lambda a: self.lookup(a, budget), unique)))
+        else:
+            results = {a: self.lookup(a, budget) for a in unique}
+        return [results[a] for a in addresses]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self.counters)
+            out["inflight"] = len(self._inflight)
+        out["provider"] = self.provider.stats()
+        out["breaker"] = self.breaker.stats()
+        if self.local:
+            out["local"] = self.local.stats()
+        return out
+
+def geocode_lookup(address: str) -> Tuple[str, Optional[Tuple[float, float]]]:
+    """
+    Geokódolás a közös GeocoderService-en keresztül, lásd GeocoderService.lookup.
+    """
+    return geocoder.lookup(address)
 
 def geocode_address(address: str) -> Optional[Tuple[float, float]]:
     """
-    Geokódolás Nominatim szolgáltatással. Visszatér (lat, lon) vagy None.
+    Geokódolás, visszatér (lat, lon) vagy None.
     """
-    try:
-        time.sleep(0.4)
-        parsed = parse_hungarian_address(address)
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {'q': parsed, 'format': 'json', 'limit': 1, 'countrycodes': 'hu', 'addressdetails': 1}
-        headers = {'User-Agent': 'OPDRouteBot/1.0'}
-        r = requests.get(url, params=params, headers=headers, timeout=8)
-        if r.status_code == 200:
-            data = r.json()
-            if data and len(data) > 0:
-                return (float(data[0]['lat']), float(data[0]['lon']))
-    except Exception as e:
-        logger.error(f"geocode error for '{address}': {e}")
-    return None
+    return geocode_lookup(address)[1]
+
+# ---------------- Geocode fallback ladder ----------------
+# Budapest kerületek: (név, közelítő középpont). Az irányítószám 2-3. jegye a kerület száma (1061 -> VI.).
+BUDAPEST_DISTRICTS = {
+    1: ("Budavár", (47.4968, 19.0366)), 2: ("Hegyvidék-Pasarét", (47.5250, 18.9900)), 3: ("Óbuda-Békásmegyer", (47.5672, 19.0400)),
+    4: ("Újpest", (47.5630, 19.0890)), 5: ("Belváros-Lipótváros", (47.5000, 19.0500)), 6: ("Terézváros", (47.5070, 19.0640)),
+    7: ("Erzsébetváros", (47.5000, 19.0710)), 8: ("Józsefváros", (47.4890, 19.0850)), 9: ("Ferencváros", (47.4770, 19.0850)),
+    10: ("Kőbánya", (47.4850, 19.1400)), 11: ("Újbuda", (47.4660, 19.0300)), 12: ("Hegyvidék", (47.5000, 18.9900)),
+    13: ("Angyalföld-Újlipótváros", (47.5300, 19.0700)), 14: ("Zugló", (47.5150, 19.1050)), 15: ("Rákospalota-Pestújhely", (47.5600, 19.1150)),
+    16: ("Mátyásföld-Sashalom", (47.5150, 19.1900)), 17: ("Rákosmente", (47.4750, 19.2600)), 18: ("Pestszentlőrinc-Pestszentimre", (47.4300, 19.2000)),
+    19: ("Kispest", (47.4500, 19.1400)), 20: ("Pesterzsébet", (47.4330, 19.1130)), 21: ("Csepel", (47.4200, 19.0700)),
+    22: ("Budafok-Tétény", (47.4250, 19.0300)), 23: ("Soroksár", (47.4000, 19.1200)),
+}
+BUDAPEST_CENTER = (47.4979, 19.0402)
+# Feloldási szintek megbízhatósága: teljes cím > utca (kerülettel) > irányítószám / kerület középpont.
+# "none": nincs használható hely (pl. nem budapesti irányítószám) - lat/lon None, útvonalba / diszpécserbe nem kerül
+GEOCODE_CONFIDENCE = {"address": 1.0, "street": 0.7, "postcode": 0.4, "district": 0.3, "none": 0.0}
+_BUDAPEST_POSTCODE_RE = re.compile(r"\b1(\d\d)\d budapest\b")
+_ANY_POSTCODE_RE = re.compile(r"\b\d{4} [^\W\d_]+")
+_DISTRICT_PART_RE = re.compile(r"\b([ivxl]+)\. kerület\b")
+
+def _location(coord: Optional[Tuple[float, float]], tier: str, status: str) -> Dict:
+    return {"lat": coord[0] if coord else None, "lon": coord[1] if coord else None, "tier": tier,
+            "confidence": GEOCODE_CONFIDENCE[tier], "status": status}
+
+def _street_query(parsed: str) -> Optional[str]:
+    """
+    Házszám nélküli lekérdezés ugyanarra az utcára, a kerület / város résszel: "király utca, vii. kerület, budapest".
+    Csak ha a kinyert utcanévben van közterület-típus (utca, út, tér, ...), különben a találat nem utca szintű.
+    """
+    street = split_street_house(parsed)
+    if not street or not has_street_type(street[0]):
+        return None
+    context = [p for p in parsed.split(", ") if _DISTRICT_PART_RE.search(p) or p.endswith("budapest") or _ANY_POSTCODE_RE.fullmatch(p)]
+    return ", ".join([street[0]] + context)
+
+def _table_location(parsed: str) -> Tuple[str, Optional[Tuple[float, float]]]:
+    """
+    Utolsó szintek a beépített táblából: budapesti irányítószám -> kerület középpont, kerület -> középpont.
+    Más (nem 1xxx) irányítószám vagy ismeretlen kerület: ("none", None), városközpontot nem találunk ki.
+    """
+    m = _BUDAPEST_POSTCODE_RE.search(parsed)
+    if m and int(m.group(1)) in BUDAPEST_DISTRICTS:
+        return "postcode", BUDAPEST_DISTRICTS[int(m.group(1))][1]
+    m = _ANY_POSTCODE_RE.search(parsed)
+    if m and not m.group().endswith("budapest"):
+        return "none", None
+    m = _DISTRICT_PART_RE.search(parsed)
+    if m and m.group(1) in _ROMAN_NUMERALS and _ROMAN_NUMERALS.index(m.group(1)) in BUDAPEST_DISTRICTS:
+        return "district", BUDAPEST_DISTRICTS[_ROMAN_NUMERALS.index(m.group(1))][1]
+    return "none", None
+
+def resolve_addresses(addresses: List[str], budget: Optional[TokenBucket] = None) -> List[Dict]:
+    """
+    Lépcsőzetes feloldás: teljes cím -> utca + kerület -> irányítószám / kerület középpont.
+    Az első két szint a geokód cache-en megy át, a többi beépített tábla.
+    Eredmény címenként: {"lat", "lon", "tier", "confidence", "status"}; status 'ok' / 'stale' a teljes címre,
+    'approx' tartalék szintre, 'not_found' ha nincs használható hely (tier "none", lat / lon None),
+    'error' ha a teljes cím átmeneti hiba miatt maradt el (később újrapróbálandó).
+    budget: lásd GeocoderService.lookup (upstream kérésenként fogy, a két szint együtt akár kettő címenként).
+    """
+    results: List[Optional[Dict]] = [None] * len(addresses)
+    first = geocoder.lookup_many(addresses, budget)
+    street_idx, street_queries = [], []
+    for i, (status, coord) in enumerate(first):
+        if coord:
+            results[i] = _location(coord, "address", status)
+            continue
+        q = _street_query(parse_hungarian_address(addresses[i]))
+        if q:
+            street_idx.append(i); street_queries.append(q)
+    for i, (_status, coord) in zip(street_idx, geocoder.lookup_many(street_queries, budget) if street_queries else []):
+        if coord:
+            results[i] = _location(coord, "street", "error" if first[i][0] == "error" else "approx")
+    for i, r in enumerate(results):
+        if r is None:
+            tier, coord = _table_location(parse_hungarian_address(addresses[i]))
+            results[i] = _location(coord, tier, "error" if first[i][0] == "error" else "approx" if coord else "not_found")
+    return results
+
+def resolve_address(address: str, budget: Optional[TokenBucket] = None) -> Dict:
+    return resolve_addresses([address], budget)[0]
 
 # ---------------- Distance & TSP helpers ----------------
 def haversine_distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
@@ -86,6 +1110,287 @@ def haversine_distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
     c = 2 * math.asin(math.sqrt(sa))
     return R * c
 
+def distance_matrix(points: List[Tuple[str, float, float]]):
+    """
+    Haversine távolságmátrix (km) [(address, lat, lon), ...] pontokra.
+    NumPy-val egyetlen broadcast művelet (n x n float64 tömb), nélküle lista a listában.
+    """
+    if NUMPY_AVAILABLE:
+        lat = np.radians(np.array([p[1] for p in points], dtype=np.float64))
+        lon = np.radians(np.array([p[2] for p in points], dtype=np.float64))
+        dlat = lat[:, None] - lat[None, :]
+        dlon = lon[:, None] - lon[None, :]
+        sa = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+        return 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(sa, 0.0, 1.0)))
+    return [[haversine_distance((a[1], a[2]), (b[1], b[2])) if a is not b else 0.0 for b in points] for a in points]
+
+def _matrix_rows(matrix) -> List[List[float]]:
+    """A mátrix soronként Python listaként: a szűk ciklusokban a lista indexelés gyorsabb, mint a NumPy skalár elérés."""
+    return matrix.tolist() if hasattr(matrix, "tolist") else matrix
+
+def route_length(order: List[int], d: List[List[float]]) -> float:
+    """Nyitott útvonal hossza indexek sorrendjében."""
+    return sum(d[order[i]][order[i+1]] for i in range(len(order) - 1))
+
+class RoadNetwork:
+    """
+    Helyi utcahálózat gráf: előfeldolgozott JSON {"nodes": [[lat, lon], ...], "edges": [[u, v, hossz_m, egyirányú], ...]}.
+    Több-több távolság (matrix): a kért cellákat mohón lefedő Dijkstra keresések, egy keresés egy forrásból
+    előre (a sor) vagy egy célból a megfordított gráfon (az oszlop), és leáll, amint minden kért csomópont kész.
+    A pontokat a legközelebbi csomóponthoz illesztjük, a ráhordás légvonalban számít.
+    Az egyirányú utcák miatt a mátrix nem szimmetrikus: m[i][j] az i -> j út hossza (km).
+    """
+    def __init__(self, nodes: List[List[float]], edges: List[List[float]]) -> None:
+        self.lat = [float(n[0]) for n in nodes]
+        self.lon = [float(n[1]) for n in nodes]
+        self.adj: List[List[Tuple[int, float]]] = [[] for _ in nodes]
+        self.radj: List[List[Tuple[int, float]]] = [[] for _ in nodes]
+        for u, v, length_m, oneway in edges:
+            u, v, km = int(u), int(v), float(length_m) / 1000.0
+            self.adj[u].append((v, km)); self.radj[v].append((u, km))
+            if not oneway:
+                self.adj[v].append((u, km)); self.radj[u].append((v, km))
+        self.edge_count = len(edges)
+        if NUMPY_AVAILABLE:
+            self._lat_rad = np.radians(np.array(self.lat)); self._lon_rad = np.radians(np.array(self.lon))
+        self._lock = threading.Lock()
+        self.counters = {"matrices": 0, "searches": 0, "settled": 0, "off_graph": 0, "unreachable": 0}
+
+    @classmethod
+    def from_file(cls, path: str) -> Optional["RoadNetwork"]:
+        """Betölti a gráfot; ha a fájl nincs meg vagy hibás, None (a távolság légvonalban számít)."""
+        try:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                return cls(data["nodes"], data["edges"])
+        except Exception as e:
+            logger.error(f"road network unavailable: {e}")
+        return None
+
+    def snap(self, lat: float, lon: float) -> Tuple[int, float]:
+        """Legközelebbi csomópont és a távolsága (km)."""
+        if NUMPY_AVAILABLE:
+            la, lo = math.radians(lat), math.radians(lon)
+            sa = np.sin((self._lat_rad - la) / 2) ** 2 + math.cos(la) * np.cos(self._lat_rad) * np.sin((self._lon_rad - lo) / 2) ** 2
+            i = int(sa.argmin())
+            return i, 2 * 6371.0 * math.asin(math.sqrt(min(1.0, float(sa[i]))))
+        i = min(range(len(self.lat)), key=lambda k: haversine_distance((lat, lon), (self.lat[k], self.lon[k])))
+        return i, haversine_distance((lat, lon), (self.lat[i], self.lon[i]))
+
+    def _search(self, source: int, targets: set, reverse: bool = False) -> Dict[int, float]:
+        """Dijkstra source-ból a targets csomópontokig; reverse=True esetén a targets -> source utak hossza."""
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        found: Dict[int, float] = {}
+        remaining = set(targets)
+        settled = 0
+        adj = self.radj if reverse else self.adj
+        while heap and remaining:
+            du, u = heapq.heappop(heap)
+            if du > dist[u]:
+                continue
+            settled += 1
+            if u in remaining:
+                found[u] = du; remaining.discard(u)
+            for v, w in adj[u]:
+                nd = du + w
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        with self._lock:
+            self.counters["searches"] += 1; self.counters["settled"] += settled
+        return found
+
+    def matrix(self, points: List[Tuple[str, float, float]], cells: Optional[List[Tuple[int, int]]] = None):
+        """
+        Úthálózati távolság mátrix (km) ugyanabban a formában, mint a distance_matrix.
+        cells: csak ezeket az (i, j) cellákat számolja (a többi 0 marad), pl. ami a PairCostCache-ből hiányzik.
+        """
+        n = len(points)
+        if cells is None:
+            cells = [(i, j) for i in range(n) for j in range(n) if i != j]
+        snapped = [self.snap(p[1], p[2]) for p in points]
+        on_graph = [off <= ROAD_MAX_SNAP_KM for _node, off in snapped]
+        by_source: Dict[int, set] = defaultdict(set)
+        by_target: Dict[int, set] = defaultdict(set)
+        for i, j in cells:
+            si, tj = snapped[i][0], snapped[j][0]
+            if on_graph[i] and on_graph[j] and si != tj:
+                by_source[si].add(tj); by_target[tj].add(si)
+        # mohó lefedés: mindig az a sor / oszlop, amelyik a legtöbb még hiányzó csomópont párt adja
+        paths: Dict[Tuple[int, int], float] = {}
+        while by_source:
+            src = max(by_source, key=lambda k: len(by_source[k]))
+            dst = max(by_target, key=lambda k: len(by_target[k]))
+            if len(by_source[src]) >= len(by_target[dst]):
+                found = self._search(src, by_source[src])
+                pairs = [(src, t) for t in by_source[src]]
+                paths.update(((src, t), found.get(t)) for t in by_source[src])
+            else:
+                found = self._search(dst, by_target[dst], reverse=True)
+                pairs = [(s_, dst) for s_ in by_target[dst]]
+                paths.update(((s_, dst), found.get(s_)) for s_ in by_target[dst])
+            for a, b in pairs:
+                by_source[a].discard(b); by_target[b].discard(a)
+                if not by_source[a]: del by_source[a]
+                if not by_target[b]: del by_target[b]
+        rows = [[0.0] * n for _ in range(n)]
+        off_graph = unreachable = 0
+        for i, j in cells:
+            (si, ai), (tj, bj) = snapped[i], snapped[j]
+            straight = haversine_distance((points[i][1], points[i][2]), (points[j][1], points[j][2]))
+            if not (on_graph[i] and on_graph[j]) or si == tj:
+                rows[i][j] = straight; off_graph += si != tj
+                continue
+            road = paths.get((si, tj))
+            if road is None:
+                rows[i][j] = straight * ROAD_DETOUR_FACTOR; unreachable += 1
+            else:
+                rows[i][j] = ai + road + bj
+        with self._lock:
+            self.counters["matrices"] += 1; self.counters["off_graph"] += off_graph; self.counters["unreachable"] += unreachable
+        return np.array(rows) if NUMPY_AVAILABLE else rows
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counters, nodes=len(self.lat), edges=self.edge_count)
+
+class PairCostCache:
+    """
+    Páronkénti útköltség (km) gyakori helyek között: memóriában LRU, mögötte a pair_costs SQLite tábla.
+    Kulcs: (metrika, honnan, hová) hely kulcsok (_location_key: kerekített koordináta). A két pont koordinátáját
+    is tároljuk, a találatnál ezt is ellenőrizzük; a régi (cím kulcsú) sorok nem találnak, a max_rows ritkítás törli őket.
+    """
+    def __init__(self, db_path: str = DB_NAME, lru_size: int = PAIR_COST_LRU_SIZE, max_rows: int = PAIR_COST_MAX_ROWS) -> None:
+        self.db_path = db_path
+        self.lru_size = lru_size
+        self.max_rows = max_rows
+        self._lru: "OrderedDict[Tuple[str, str, str], Tuple[float, Tuple[float, float], Tuple[float, float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stored": 0, "evicted_rows": 0}
+
+    @staticmethod
+    def _same(a: Tuple[float, float], b: Tuple[float, float]) -> bool:
+        return abs(a[0] - b[0]) < 1e-6 and abs(a[1] - b[1]) < 1e-6
+
+    def _remember(self, key: Tuple[str, str, str], value) -> None:
+        self._lru[key] = value; self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, metric: str, wanted: Dict[Tuple[str, str], Tuple[Tuple[float, float], Tuple[float, float]]]) -> Dict[Tuple[str, str], float]:
+        """wanted: {(honnan, hová): (honnan koordináta, hová koordináta)} -> a meglévő cellák költsége."""
+        found: Dict[Tuple[str, str], float] = {}
+        missing = []
+        with self._lock:
+            for (a, b), (ca, cb) in wanted.items():
+                item = self._lru.get((metric, a, b))
+                if item and self._same(item[1], ca) and self._same(item[2], cb):
+                    self._lru.move_to_end((metric, a, b)); found[(a, b)] = item[0]
+                    self.counters["memory_hits"] += 1
+                else:
+                    missing.append((a, b))
+        if missing:
+            try:
+                conn = sqlite3.connect(self.db_path); cur = conn.cursor()
+                keys = sorted({a for a, _b in missing})
+                rows = []
+                for i in range(0, len(keys), 900):  # SQLite paraméter korlát; b szűrése lent, hogy a darabok közti párok is meglegyenek
+                    chunk = keys[i:i + 900]; marks = ",".join("?" * len(chunk))
+                    cur.execute(f"SELECT a, b, cost, a_lat, a_lon, b_lat, b_lon FROM pair_costs WHERE metric = ? AND a IN ({marks})",
+                                [metric] + chunk)
+                    rows.extend(cur.fetchall())
+                conn.close()
+            except Exception as e:
+                logger.error(f"pair cost cache read error: {e}"); rows = []
+            db_rows = {(a, b): (cost, (alat, alon), (blat, blon)) for a, b, cost, alat, alon, blat, blon in rows}
+            with self._lock:
+                for pair in missing:
+                    item = db_rows.get(pair)
+                    ca, cb = wanted[pair]
+                    if item and self._same(item[1], ca) and self._same(item[2], cb):
+                        found[pair] = item[0]; self._remember((metric,) + pair, item)
+                        self.counters["db_hits"] += 1
+                    else:
+                        self.counters["misses"] += 1
+        return found
+
+    def put_many(self, metric: str, items: Dict[Tuple[str, str], Tuple[float, Tuple[float, float], Tuple[float, float]]]) -> None:
+        """items: {(honnan, hová): (költség, honnan koordináta, hová koordináta)}"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            for pair, value in items.items():
+                self._remember((metric,) + pair, value)
+            self.counters["stored"] += len(items)
+            self._writes += len(items)
+            prune = self._writes >= 1000
+            if prune:
+                self._writes = 0
+        try:
+            conn = sqlite3.connect(self.db_path); cur = conn.cursor()
+            cur.executemany("INSERT OR REPLACE INTO pair_costs(metric, a, b, cost, a_lat, a_lon, b_lat, b_lon, updated_at) VALUES (?,?,?,?,?,?,?,?,?)",
+                            [(metric, a, b, cost, ca[0], ca[1], cb[0], cb[1], now) for (a, b), (cost, ca, cb) in items.items()])
+            if prune:
+                cur.execute("SELECT COUNT(*) FROM pair_costs"); extra = cur.fetchone()[0] - self.max_rows
+                if extra > 0:
+                    cur.execute("DELETE FROM pair_costs WHERE rowid IN (SELECT rowid FROM pair_costs ORDER BY updated_at LIMIT ?)", (extra,))
+                    with self._lock: self.counters["evicted_rows"] += extra
+            conn.commit(); conn.close()
+        except Exception as e:
+            logger.error(f"pair cost cache write error: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self.counters, lru_size=len(self._lru))
+        total = out["memory_hits"] + out["db_hits"] + out["misses"]
+        out["hit_ratio"] = round((out["memory_hits"] + out["db_hits"]) / total, 3) if total else 0.0
+        return out
+
+def _location_key(point: Tuple[str, float, float]) -> Optional[str]:
+    """
+    A pont PairCostCache kulcsa: a koordináta (~0,1 m-re kerekítve), nem a cím szövege - ugyanaz a cím két
+    különböző helyen (pl. felvétel és kiszállítás) nem kaphatja egymás útköltségét. A futár / cél pozíciónak nincs.
+    """
+    if point[0] in ("CURRENT_LOCATION", "END_LOCATION"):
+        return None
+    return f"{point[1]:.6f},{point[2]:.6f}"
+
+def route_matrix(points: List[Tuple[str, float, float]], info: Optional[Dict] = None):
+    """
+    Az útvonal megoldók költség mátrixa: utcahálózat, ha van betöltött gráf (road_network), különben légvonal.
+    Utcahálózatnál az ismert helyek közti cellák a PairCostCache-ből jönnek, csak a hiányzók számolódnak.
+    info: ha meg van adva, ide kerül a cellák száma, ebből a cache-ből jött és a most számolt cellák száma.
+    """
+    n = len(points)
+    cells = n * (n - 1)
+    if not road_network:
+        if info is not None:
+            info.update(cells=cells, cached=0, computed=cells)
+        return distance_matrix(points)
+    keys = [_location_key(p) for p in points]
+    wanted = {}
+    for i in range(n):
+        for j in range(n):
+            if i != j and keys[i] and keys[j] and keys[i] != keys[j]:
+                wanted[(keys[i], keys[j])] = ((points[i][1], points[i][2]), (points[j][1], points[j][2]))
+    found = pair_costs.get_many("road", wanted) if wanted else {}
+    todo = [(i, j) for i in range(n) for j in range(n)
+            if i != j and not (keys[i] and keys[j] and (keys[i], keys[j]) in found)]
+    rows = _matrix_rows(road_network.matrix(points, cells=todo)) if todo else [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(n):
+            if i != j and keys[i] and keys[j] and (keys[i], keys[j]) in found:
+                rows[i][j] = found[(keys[i], keys[j])]
+    pair_costs.put_many("road", {(keys[i], keys[j]): (rows[i][j], wanted[(keys[i], keys[j])][0], wanted[(keys[i], keys[j])][1])
+                                 for i, j in todo if (keys[i], keys[j]) in wanted})
+    if info is not None:
+        info.update(cells=cells, cached=cells - len(todo), computed=len(todo))
+    return np.array(rows) if NUMPY_AVAILABLE else rows
+
 def calculate_total_distance(route: List[Tuple[str, float, float]]) -> float:
     if not route or len(route) < 2: return 0.0
     total = 0.0
@@ -110,144 +1415,809 @@ def rotate_route_to_centroid_start(route: List[Tuple[str, float, float]]) -> Lis
             min_d = d; min_idx = i
     return route[min_idx:] + route[:min_idx]
 
-def tsp_2opt(coords_with_addr: List[Tuple[str, float, float]]) -> List[Tuple[str, float, float]]:
-    if len(coords_with_addr) <= 2:
-        return coords_with_addr
-    
-    n = len(coords_with_addr)
-    has_fixed_start = coords_with_addr[0][0] == "CURRENT_LOCATION"
-    
-    # Ha van rögzített start, azt megtartjuk
-    if has_fixed_start:
-        fixed_start = coords_with_addr[0]
-        points = coords_with_addr[1:]
-    else:
-        fixed_start = None
-        points = coords_with_addr[:]
-    
-    if not points:
-        return coords_with_addr
-    
-    # Távolság mátrix létrehozása
-    def distance_matrix(pts):
-        matrix = {}
-        for i, p1 in enumerate(pts):
-            for j, p2 in enumerate(pts):
-                if i != j:
-                    matrix[(i, j)] = haversine_distance((p1[1], p1[2]), (p2[1], p2[2]))
-                else:
-                    matrix[(i, j)] = 0
-        return matrix
-    
-    # Ha van rögzített start, azt is beletesszük a mátrixba
-    all_points = [fixed_start] + points if fixed_start else points
-    distances = {}
-    for i, p1 in enumerate(all_points):
-        for j, p2 in enumerate(all_points):
-            if i != j:
-                distances[(i, j)] = haversine_distance((p1[1], p1[2]), (p2[1], p2[2]))
-            else:
-                distances[(i, j)] = 0
-    
-    # Nearest neighbor algoritmus javított változata
-    if fixed_start:
-        route = [0]  # Start a rögzített ponttal
-        unvisited = list(range(1, len(all_points)))
+def nearest_neighbors(matrix, k: int = ROUTE_NEIGHBORS_K) -> List[List[int]]:
+    """Pontonként a k legközelebbi másik pont indexe, távolság szerint növekvő sorrendben."""
+    n = len(matrix)
+    k = min(k, n - 1)
+    if k <= 0:
+        return [[] for _ in range(n)]
+    if NUMPY_AVAILABLE:
+        m = np.array(matrix, dtype=np.float64)
+        np.fill_diagonal(m, np.inf)
+        part = np.argpartition(m, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(m, part, axis=1).argsort(axis=1)
+        return np.take_along_axis(part, order, axis=1).tolist()
+    rows = _matrix_rows(matrix)
+    return [sorted((j for j in range(n) if j != i), key=rows[i].__getitem__)[:k] for i in range(n)]
+
+def _reverse_segment(tour: List[int], pos: List[int], i: int, j: int) -> None:
+    """
+    A körút i..j pozíciói közötti szakasz helyben megfordítása (körkörösen, i-től előre j-ig).
+    Ha a szakasz a kör több mint fele, a komplementerét fordítjuk: ugyanaz a körút, kevesebb csere.
+    """
+    n = len(tour)
+    inner = (j - i) % n + 1
+    if inner * 2 > n:
+        i, j = (j + 1) % n, (i - 1) % n
+        inner = n - inner
+    for _ in range(inner // 2):
+        a, b = tour[i], tour[j]
+        tour[i], tour[j] = b, a
+        pos[b], pos[a] = i, j
+        i = (i + 1) % n; j = (j - 1) % n
+
+def local_search(tour: List[int], d: List[List[float]], neighbors: List[List[int]], or_opt: bool = True,
+                 active_nodes: Optional[List[int]] = None, deadline: Optional[float] = None) -> List[int]:
+    """
+    2-opt + Or-opt javítás zárt körúton (szimmetrikus d mátrix, indexek).
+    - minden lépés értékelése O(1) (csak a cserélt élek különbsége),
+    - jelöltek csak a neighbors (k legközelebbi) listából,
+    - don't-look bitek: csak azokat a pontokat vizsgáljuk újra, amelyek környezete változott,
+    - a 2-opt a szakaszt helyben fordítja meg.
+    active_nodes: csak ezekből indul a keresés (pl. egy perturbáció végpontjai), None = minden pont.
+    deadline: time.perf_counter() határidő, utána a keresés leáll (a körút akkor is érvényes).
+    Visszatér a javított körúttal (a bemeneti lista helyben módosul).
+    """
+    n = len(tour)
+    if n < 4:
+        return tour
+    eps = 1e-10
+    pos = [0] * n
+    for i, c in enumerate(tour):
+        pos[c] = i
+    queue = deque(tour if active_nodes is None else active_nodes)
+    active = [False] * n
+    for x in queue:
+        active[x] = True
+
+    steps = 0
+    while queue:
+        steps += 1
+        if deadline is not None and not steps & 63 and time.perf_counter() > deadline:
+            break
+        a = queue.popleft(); active[a] = False
+        touched = None
+
+        # 2-opt: az (a, b) él cseréje (a, c)-re, mindkét irányban
+        for forward in (True, False):
+            pa = pos[a]
+            b = tour[(pa + 1) % n] if forward else tour[pa - 1]
+            dab = d[a][b]
+            for c in neighbors[a]:
+                dac = d[a][c]
+                if dac >= dab:
+                    break
+                pc = pos[c]
+                e = tour[(pc + 1) % n] if forward else tour[pc - 1]
+                if c == b or e == a:
+                    continue
+                if dac + d[b][e] - dab - d[c][e] < -eps:
+                    if forward:
+                        _reverse_segment(tour, pos, (pa + 1) % n, pc)
+                    else:
+                        _reverse_segment(tour, pos, pc, (pa - 1) % n)
+                    touched = (a, b, c, e)
+                    break
+            if touched:
+                break
+
+        # Or-opt: az a-val kezdődő 1-3 hosszú szakasz áthelyezése egy szomszéd mellé (akár fordítva)
+        if touched is None and or_opt:
+            pa = pos[a]
+            for seg_len in (1, 2, 3):
+                if n < seg_len + 3:
+                    break
+                s1 = a; s2 = tour[(pa + seg_len - 1) % n]
+                p = tour[pa - 1]; nx = tour[(pa + seg_len) % n]
+                gain = d[p][s1] + d[s2][nx] - d[p][nx]
+                if gain <= eps:
+                    continue
+                for end_node, other in ((s1, s2), (s2, s1)):
+                    for c in neighbors[end_node]:
+                        if d[c][end_node] >= gain:
+                            break
+                        pc = pos[c]
+                        if (pc - pa) % n < seg_len:
+                            continue
+                        for e in (tour[(pc + 1) % n], tour[pc - 1]):
+                            if (pos[e] - pa) % n < seg_len:
+                                continue
+                            if d[c][end_node] + d[other][e] - d[c][e] - gain < -eps:
+                                touched = (p, nx, c, e, s1, s2)
+                                break
+                        if touched: break
+                    if touched: break
+                if touched:
+                    seg = [tour[(pa + i) % n] for i in range(seg_len)]
+                    rest = [tour[(pa + seg_len + i) % n] for i in range(n - seg_len)]
+                    ic = rest.index(c)
+                    if rest[(ic + 1) % len(rest)] == e:
+                        rest[ic + 1:ic + 1] = seg if end_node == s1 else seg[::-1]
+                    else:
+                        rest[ic:ic] = seg if other == s1 else seg[::-1]
+                    tour[:] = rest
+                    for i, x in enumerate(tour):
+                        pos[x] = i
+                    break
+
+        if touched:
+            for x in (a,) + touched:
+                if not active[x]:
+                    active[x] = True; queue.append(x)
+    return tour
+
+def held_karp(matrix, start: Optional[int] = None, end: Optional[int] = None, precedence: Optional[Dict[int, int]] = None) -> List[int]:
+    """
+    Pontos legrövidebb nyitott útvonal bitmaszkos dinamikus programozással, O(2^m * m^2).
+    start: rögzített kezdőpont indexe (pl. CURRENT_LOCATION), None esetén bármelyik pont lehet az első.
+    end: rögzített végpont indexe (pl. vissza az étteremhez), None esetén az útvonal az utolsó megállónál ér véget.
+    precedence: {pont: előtte kötelező pont} (pl. kiszállítás -> felvétel az étteremben).
+    NumPy-val egy rétegben (azonos elemszámú részhalmazok) minden részhalmaz egyszerre számolódik.
+    Visszatér a pontok index sorrendjével (start az első, end az utolsó, ha meg voltak adva).
+    """
+    n = len(matrix)
+    nodes = [i for i in range(n) if i != start and i != end]
+    m = len(nodes)
+    head = [start] if start is not None else []
+    tail = [end] if end is not None else []
+    if m <= 1:
+        return head + nodes + tail
+    full = (1 << m) - 1
+    local = {x: i for i, x in enumerate(nodes)}
+    # req[j]: azok a pontok (bitmaszk), amelyeknek j előtt kell lenniük
+    req = [0] * m
+    for x, before in (precedence or {}).items():
+        if x in local and before in local:
+            req[local[x]] |= 1 << local[before]
+    if NUMPY_AVAILABLE:
+        mat = np.asarray(matrix, dtype=np.float64)
+        D = mat[np.ix_(nodes, nodes)]
+        bits = 1 << np.arange(m)
+        dp = np.full((full + 1, m), np.inf)
+        parent = np.full((full + 1, m), -1, dtype=np.int8)
+        dp[bits, np.arange(m)] = mat[start, nodes] if start is not None else 0.0
+        req_arr = np.array(req, dtype=np.int64)
+        dp[bits[req_arr != 0], np.nonzero(req_arr)[0]] = np.inf
+        masks = np.arange(full + 1)
+        popcount = np.zeros(full + 1, dtype=np.int64)
+        for b in range(m):
+            popcount += (masks >> b) & 1
+        for size in range(2, m + 1):
+            layer = masks[popcount == size]
+            # prev[s, j]: a részhalmaz j nélkül; ha j nincs benne, egy nagyobb (még inf) részhalmazra mutat
+            prev = layer[:, None] ^ bits[None, :]
+            cand = dp[prev] + D.T[None, :, :]
+            best_k = cand.argmin(axis=2)
+            vals = np.take_along_axis(cand, best_k[..., None], axis=2)[..., 0]
+            if precedence:
+                vals[(prev & req_arr[None, :]) != req_arr[None, :]] = np.inf
+            dp[layer] = vals
+            parent[layer] = best_k
+        final = dp[full] + (mat[nodes, end] if end is not None else 0.0)
+        j = int(final.argmin())
+        parent_of = lambda mask, j: int(parent[mask, j])
     else:
-        # Legjobb start pont keresése: válasszuk a centroidhoz legközelebbit
-        lat_center = sum(p[1] for p in all_points) / len(all_points)
-        lon_center = sum(p[2] for p in all_points) / len(all_points)
-        best_start = min(range(len(all_points)), 
-                        key=lambda i: haversine_distance((all_points[i][1], all_points[i][2]), 
-                                                        (lat_center, lon_center)))
-        route = [best_start]
-        unvisited = [i for i in range(len(all_points)) if i != best_start]
-    
-    # Nearest neighbor építés
+        d = _matrix_rows(matrix)
+        D = [[d[a][b] for b in nodes] for a in nodes]
+        dp = [[math.inf] * m for _ in range(full + 1)]
+        parent = [[-1] * m for _ in range(full + 1)]
+        for j in range(m):
+            if not req[j]:
+                dp[1 << j][j] = d[start][nodes[j]] if start is not None else 0.0
+        for mask in range(1, full + 1):
+            row = dp[mask]
+            for j in range(m):
+                if not (mask >> j) & 1 or mask == 1 << j or (mask & req[j]) != req[j]:
+                    continue
+                prev = dp[mask ^ (1 << j)]
+                best, best_k = math.inf, -1
+                for k in range(m):
+                    c = prev[k] + D[k][j]
+                    if c < best:
+                        best, best_k = c, k
+                row[j] = best; parent[mask][j] = best_k
+        final = [dp[full][j] + (d[nodes[j]][end] if end is not None else 0.0) for j in range(m)]
+        j = min(range(m), key=final.__getitem__)
+        parent_of = lambda mask, j: parent[mask][j]
+    path = []
+    mask = full
+    while mask:
+        path.append(nodes[j])
+        pj = parent_of(mask, j)
+        mask ^= 1 << j
+        j = pj
+    path.reverse()
+    return head + path + tail
+
+def _nearest_neighbor_tour(d: List[List[float]], start: int, exclude: Tuple[int, ...] = ()) -> List[int]:
+    route = [start]
+    unvisited = set(range(len(d))) - set(exclude); unvisited.discard(start)
     while unvisited:
-        current = route[-1]
-        next_city = min(unvisited, key=lambda city: distances[(current, city)])
+        row = d[route[-1]]
+        next_city = min(unvisited, key=row.__getitem__)
         route.append(next_city)
-        unvisited.remove(next_city)
-    
-    # 2-opt javítás
-    def two_opt_swap(route, i, k):
-        new_route = route[:]
-        new_route[i:k+1] = route[i:k+1][::-1]
-        return new_route
-    
-    def route_distance(route):
-        total = 0
-        for i in range(len(route)):
-            j = (i + 1) % len(route)
-            total += distances[(route[i], route[j])]
-        return total
-    
-    # 2-opt optimalizálás
-    improved = True
-    max_iterations = 1000
-    iteration = 0
-    
-    while improved and iteration < max_iterations:
-        improved = False
-        iteration += 1
-        
-        for i in range(len(route)):
-            for k in range(i + 2, len(route)):
-                # Ha van rögzített start, ne mozgassuk
-                if fixed_start and (i == 0 or k == len(route) - 1):
-                    continue
-                    
-                new_route = two_opt_swap(route, i, k)
-                if route_distance(new_route) < route_distance(route):
-                    route = new_route
-                    improved = True
-                    break
-            if improved:
+        unvisited.discard(next_city)
+    return route
+
+def _double_bridge(tour: List[int], rnd: random.Random) -> Tuple[List[int], List[int]]:
+    """
+    Double-bridge perturbáció (A B C D -> A C B D) egy rövid ablakon belül, hogy a kör többi része megmaradjon.
+    Visszaadja az új körutat és az érintett végpontokat (ezekből indul újra a local_search).
+    """
+    n = len(tour)
+    window = min(n - 1, 30)
+    p1 = rnd.randrange(1, n - 2)
+    p2, p3 = sorted(rnd.sample(range(p1 + 1, min(n, p1 + window) + 1), 2))
+    new = tour[:p1] + tour[p2:p3] + tour[p1:p2] + tour[p3:]
+    ends = {tour[p1 - 1], tour[p1], tour[p2 - 1], tour[p2], tour[p3 - 1], tour[p3 % n]}
+    return new, list(ends)
+
+def _anytime_tour(coords_with_addr: List[Tuple[str, float, float]], time_budget_ms: float, start: Optional[int] = None,
+                  end: Optional[int] = None, open_path: bool = True, matrix=None, on_improve=None) -> Tuple[List[int], Dict]:
+    """
+    Építés + local_search, majd iterált lokális keresés az időkeret végéig.
+    open_path: a cél a ténylegesen vezetett táv (start -> ... -> end vagy utolsó megálló), nem a zárt kör.
+    Ezt egy fiktív ponttal oldjuk meg: a körút a fiktív ponton át zárul, ami csak a starthoz / endhez
+    kapcsolódik olcsón (0), minden máshoz M költséggel, így a kör-motor a nyitott útvonalat optimalizálja.
+    A 2-opt szimmetrikus költséget feltételez: irányított (utcahálózat) mátrixnál az oda-vissza átlagán keres.
+    on_improve(order): minden új legjobb sorrendnél meghívódik (RouteSolverPool: részeredmény időtúllépéskor).
+    Visszatér: (pont indexek sorrendben, info).
+    """
+    t0 = time.perf_counter()
+    deadline = t0 + time_budget_ms / 1000.0 if time_budget_ms > 0 else None
+    n = len(coords_with_addr)
+    if n <= 2:
+        order = list(range(n))
+        if (start is not None and order[0] != start) or (end is not None and order[-1] != end):
+            order.reverse()
+        return order, {"iterations": 0, "improvements": 0}
+    directed = _matrix_rows(route_matrix(coords_with_addr) if matrix is None else matrix)
+    d = [[(directed[i][j] + directed[j][i]) / 2 for j in range(n)] for i in range(n)]
+
+    first = start
+    if first is None:
+        # Legjobb start pont keresése: válasszuk a centroidhoz legközelebbit
+        lat_center = sum(p[1] for p in coords_with_addr) / n
+        lon_center = sum(p[2] for p in coords_with_addr) / n
+        first = min((i for i in range(n) if i != end), key=lambda i: haversine_distance((coords_with_addr[i][1], coords_with_addr[i][2]),
+                                                                                        (lat_center, lon_center)))
+    offset = 0.0
+    if open_path:
+        dummy = n
+        anchors = [x for x in (start, end) if x is not None]
+        big = max(max(row) for row in d) * n + 1.0
+        d = [row + [0.0 if not anchors or i in anchors else big] for i, row in enumerate(d)]
+        d.append([row[dummy] for row in d] + [0.0])
+        offset = big if len(anchors) == 1 else 0.0
+        tour = [dummy] + _nearest_neighbor_tour(d, first, exclude=(dummy,) + ((end,) if end is not None else ())) + ([end] if end is not None else [])
+    else:
+        tour = _nearest_neighbor_tour(d, first)
+    cycle = lambda t: route_length(t, d) + d[t[-1]][t[0]] - offset
+    initial = cycle(tour)
+    neighbors = nearest_neighbors(d)
+
+    def to_order(t: List[int]) -> List[int]:
+        if open_path:
+            i = t.index(dummy)
+            order = t[i + 1:] + t[:i]
+            if (start is not None and order[0] != start) or (start is None and end is not None and order[-1] != end):
+                order.reverse()
+            elif start is None and end is None and route_length(order[::-1], directed) < route_length(order, directed):
+                order.reverse()
+            return order
+        i = t.index(first)
+        return t[i:] + t[:i]
+
+    tour = local_search(tour, d, neighbors, deadline=deadline)
+    best, best_len = tour[:], cycle(tour)
+    if on_improve:
+        on_improve(to_order(best))
+    iterations = improvements = last_improvement = 0
+    rnd = random.Random(n)
+    # ha 10*n perturbáció óta nincs javulás, a keresés beállt: nem várjuk ki a teljes időkeretet
+    while deadline is not None and n >= 8 and time.perf_counter() < deadline and iterations - last_improvement < 10 * n:
+        iterations += 1
+        cand, ends = _double_bridge(best, rnd)
+        cand = local_search(cand, d, neighbors, active_nodes=ends, deadline=deadline)
+        cand_len = cycle(cand)
+        if cand_len < best_len - 1e-10:
+            best, best_len = cand, cand_len; improvements += 1; last_improvement = iterations
+            if on_improve:
+                on_improve(to_order(best))
+    order = to_order(best)
+    info = {"iterations": iterations, "improvements": improvements, "initial_km": round(initial, 3)}
+    return order, info
+
+def _precedence_route(d: List[List[float]], start: Optional[int], end: Optional[int], precedence: Dict[int, int],
+                      deadline: Optional[float] = None, on_improve=None) -> Tuple[List[int], Dict]:
+    """
+    Nyitott útvonal sorrendi feltételekkel (felvétel a kiszállítás előtt), nagyobb megállószámra.
+    Legközelebbi megengedett szomszéd építés, majd áthelyezéses (relocate) lokális keresés O(1) költség
+    különbséggel: egy pont csak az előfeltétele után és a tőle függő pontok elé kerülhet.
+    Az időkeret maradékában véletlen áthelyezésekkel perturbál és újra javít (a legjobbat tartja meg).
+    on_improve(order): minden új legjobb sorrendnél meghívódik (RouteSolverPool: részeredmény időtúllépéskor).
+    """
+    n = len(d)
+    dependents: Dict[int, List[int]] = defaultdict(list)
+    for x, before in precedence.items():
+        dependents[before].append(x)
+    free = [i for i in range(n) if i != start and i != end]
+
+    # építés: mindig a legközelebbi olyan pont, amelynek az előfeltétele már megvolt
+    route = [start] if start is not None else []
+    visited = set(route)
+    pending = set(free)
+    while pending:
+        ready = [x for x in pending if precedence.get(x) is None or precedence[x] in visited]
+        last = route[-1] if route else None
+        x = min(ready, key=lambda c: d[last][c] if last is not None else 0.0)
+        route.append(x); visited.add(x); pending.discard(x)
+    if end is not None:
+        route.append(end)
+
+    def length(r: List[int]) -> float:
+        return sum(d[r[i]][r[i + 1]] for i in range(len(r) - 1))
+
+    def descend(r: List[int]) -> List[int]:
+        improved = True
+        while improved:
+            if deadline is not None and time.perf_counter() > deadline:
                 break
-    
-    # Vissza alakítás koordinátákra
-    return [all_points[i] for i in route]
+            improved = False
+            for x in free:
+                i = r.index(x)
+                a = r[i - 1] if i > 0 else None; b = r[i + 1] if i + 1 < len(r) else None
+                gain = (d[a][x] if a is not None else 0.0) + (d[x][b] if b is not None else 0.0) - (d[a][b] if a is not None and b is not None else 0.0)
+                rest = r[:i] + r[i + 1:]
+                lo = 1 if start is not None else 0
+                if precedence.get(x) is not None:
+                    lo = max(lo, rest.index(precedence[x]) + 1)
+                hi = len(rest) - 1 if end is not None else len(rest)
+                for dep in dependents.get(x, ()):
+                    hi = min(hi, rest.index(dep))
+                best_k, best_delta = None, -1e-10
+                for k in range(lo, hi + 1):
+                    if k == i:
+                        continue
+                    p = rest[k - 1] if k > 0 else None; q = rest[k] if k < len(rest) else None
+                    add = (d[p][x] if p is not None else 0.0) + (d[x][q] if q is not None else 0.0) - (d[p][q] if p is not None and q is not None else 0.0)
+                    if add - gain < best_delta:
+                        best_k, best_delta = k, add - gain
+                if best_k is not None:
+                    rest.insert(best_k, x); r = rest; improved = True
+        return r
+
+    route = descend(route)
+    best, best_len = route, length(route)
+    if on_improve:
+        on_improve(best)
+    iterations = improvements = 0
+    rnd = random.Random(n)
+    while deadline is not None and len(free) >= 4 and time.perf_counter() < deadline and iterations < 20 * n:
+        iterations += 1
+        cand = best[:]
+        for x in rnd.sample(free, min(3, len(free))):
+            cand.remove(x)
+            lo = (1 if start is not None else 0)
+            if precedence.get(x) is not None:
+                lo = max(lo, cand.index(precedence[x]) + 1)
+            hi = len(cand) - 1 if end is not None else len(cand)
+            for dep in dependents.get(x, ()):
+                hi = min(hi, cand.index(dep))
+            cand.insert(rnd.randint(lo, hi), x)
+        cand = descend(cand)
+        cand_len = length(cand)
+        if cand_len < best_len - 1e-10:
+            best, best_len = cand, cand_len; improvements += 1
+            if on_improve:
+                on_improve(best)
+    return best, {"iterations": iterations, "improvements": improvements}
+
+def tsp_2opt(coords_with_addr: List[Tuple[str, float, float]], time_budget_ms: float = 0) -> List[Tuple[str, float, float]]:
+    """
+    Legközelebbi szomszéd építés, majd local_search (2-opt + Or-opt) a zárt körúton.
+    time_budget_ms > 0 esetén a maradék időben iterált lokális keresés (double-bridge + local_search) fut.
+    Ha az első elem CURRENT_LOCATION, a visszaadott sorrend azzal kezdődik.
+    Futár útvonalhoz a solve_route (nyitott útvonal) való; ez a zárt körös változat.
+    """
+    start = 0 if coords_with_addr and coords_with_addr[0][0] == "CURRENT_LOCATION" else None
+    order = _anytime_tour(coords_with_addr, time_budget_ms, start=start, open_path=False)[0]
+    return [coords_with_addr[j] for j in order]
 
-def optimize_route(addresses: List[str], start_coord: Optional[Tuple[str,float,float]] = None) -> List[Tuple[str,float,float]]:
+def optimize_route(addresses: List[str], start_coord: Optional[Tuple[str,float,float]] = None,
+                   time_budget_ms: float = ROUTE_TIME_BUDGET_MS, end_coord: Optional[Tuple[str,float,float]] = None) -> List[Tuple[str,float,float]]:
     """
     Geokódol minden címet (ha lehetséges), majd optimalizálja a sorrendet.
     start_coord: optional ("CURRENT_LOCATION", lat, lon) amely mindig az első elem lesz.
+    end_coord: optional (név, lat, lon) amely mindig az utolsó elem lesz (pl. vissza az étterembe).
     Visszaadott lista: [(address, lat, lon), ...] - első elem a start, ha volt.
     """
     if not addresses:
         return []
-    if len(addresses) > 12:
-        addresses = addresses[:12]  # korlátozás
     coords_with_addr = []
-    for a in addresses:
-        c = geocode_address(a)
-        if c:
-            coords_with_addr.append((a, c[0], c[1]))
-        else:
-            logger.warning(f"Could not geocode: {a}")
-    if not coords_with_addr:
-        return []
-    # Insert start coordinate if provided
-    if start_coord:
+    for a, loc in zip(addresses, resolve_addresses(addresses)):
+        if loc["lat"] is None:
+            logger.warning(f"No usable location, left out of the route: {a}"); continue
+        if loc["tier"] != "address":
+            logger.warning(f"Approximate location ({loc['tier']}) for: {a}")
+        coords_with_addr.append((a, loc["lat"], loc["lon"]))
+    return optimize_coords(coords_with_addr, start_coord=start_coord, time_budget_ms=time_budget_ms, end_coord=end_coord)
+
+def optimize_coords(coords_with_addr: List[Tuple[str,float,float]], start_coord: Optional[Tuple[str,float,float]] = None,
+                    time_budget_ms: float = ROUTE_TIME_BUDGET_MS, end_coord: Optional[Tuple[str,float,float]] = None) -> List[Tuple[str,float,float]]:
+    """
+    Már geokódolt pontok [(address, lat, lon), ...] sorrendjének optimalizálása.
+    """
+    return solve_route(coords_with_addr, start_coord=start_coord, time_budget_ms=time_budget_ms, end_coord=end_coord)[0]
+
+def solve_route(coords_with_addr: List[Tuple[str,float,float]], start_coord: Optional[Tuple[str,float,float]] = None,
+                time_budget_ms: float = ROUTE_TIME_BUDGET_MS, end_coord: Optional[Tuple[str,float,float]] = None,
+                precedence: Optional[Dict[int, int]] = None) -> Tuple[List[Tuple[str,float,float]], Dict]:
+    """
+    Bármennyi megálló sorrendje, időkerettel (anytime): kevés megállónál pontos megoldás,
+    különben gyors építés + lokális keresés, majd javítás amíg az időkeret tart.
+    A cél a vezetett táv: startból (ha van) a megállókon át az endig (ha van), visszaút nélkül.
+    precedence: {megálló index: előtte kötelező megálló index} a coords_with_addr listában (felvétel -> kiszállítás).
+    Visszatér: (útvonal, meta) ahol meta: method, optimal, stops, order (megálló indexek), distance_km, elapsed_ms, ...
+    """
+    t0 = time.perf_counter()
+    time_budget_ms = max(0.0, min(float(time_budget_ms), ROUTE_TIME_BUDGET_MAX_MS))
+    coords_with_addr = list(coords_with_addr)
+    stops = len(coords_with_addr)
+    # Insert start / end coordinate if provided
+    if start_coord and coords_with_addr:
         coords_with_addr.insert(0, start_coord)
-    # Small n: brute-force permutations (including start if present)
-    if len(coords_with_addr) <= 5:
-        best = list(coords_with_addr)
-        min_d = float('inf')
-        for perm in itertools.permutations(coords_with_addr[1:] if start_coord else coords_with_addr):
-            candidate = ([coords_with_addr[0]] + list(perm)) if start_coord else list(perm)
-            d = calculate_total_distance(candidate)
-            if d < min_d:
-                min_d = d; best = candidate
-        if not start_coord:
-            best = rotate_route_to_centroid_start(best)
-        return best
-    # 2-opt optimalizálás
-    optimized = tsp_2opt(coords_with_addr)
-    if not start_coord:
-        optimized = rotate_route_to_centroid_start(optimized)
-    return optimized
+    if end_coord and coords_with_addr:
+        coords_with_addr.append(end_coord)
+    start = 0 if start_coord else None
+    end = len(coords_with_addr) - 1 if end_coord else None
+    shift = 1 if start_coord else 0
+    precedence = {x + shift: before + shift for x, before in (precedence or {}).items()}
+    matrix_info: Dict = {}
+    matrix = route_matrix(coords_with_addr, matrix_info) if stops else []
+    meta = {"stops": stops, "budget_ms": time_budget_ms, "metric": "road" if road_network else "haversine"}
+    remaining_ms = max(ROUTE_FALLBACK_BUDGET_MS, time_budget_ms - (time.perf_counter() - t0) * 1000)
+    if not stops:
+        order = []
+        meta.update(method="empty", optimal=True)
+    elif route_pool.accepts(stops):
+        order, info = route_pool.solve(coords_with_addr, matrix, start, end, precedence, remaining_ms)
+        meta.update(info)
+    else:
+        order, info = _solve_order(coords_with_addr, matrix, start, end, precedence, remaining_ms)
+        meta.update(info)
+    route = [coords_with_addr[i] for i in order]
+    meta["order"] = [i - shift for i in order if i != start and i != end]
+    meta["distance_km"] = round(route_length(order, _matrix_rows(matrix)), 3)
+    meta["matrix"] = matrix_info
+    meta["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return route, meta
+
+def _solve_order(coords_with_addr: List[Tuple[str,float,float]], matrix, start: Optional[int], end: Optional[int],
+                 precedence: Dict[int, int], time_budget_ms: float, on_improve=None) -> Tuple[List[int], Dict]:
+    """
+    A solve_route megoldó része (a RouteSolverPool workerében is ez fut): pont indexek sorrendje + meta.
+    A keret legalább ROUTE_FALLBACK_BUDGET_MS: a heurisztikus keresés mindig határidővel fut.
+    """
+    time_budget_ms = max(time_budget_ms, ROUTE_FALLBACK_BUDGET_MS)
+    stops = len(coords_with_addr) - (start is not None) - (end is not None)
+    # Kevés megálló: pontos nyitott útvonal (Held-Karp)
+    if stops <= (ROUTE_EXACT_MAX_STOPS if NUMPY_AVAILABLE else ROUTE_EXACT_MAX_STOPS_PURE):
+        return held_karp(matrix, start=start, end=end, precedence=precedence), {"method": "held_karp", "optimal": True}
+    if precedence:
+        deadline = time.perf_counter() + time_budget_ms / 1000.0
+        order, info = _precedence_route(_matrix_rows(matrix), start, end, precedence, deadline, on_improve=on_improve)
+        return order, dict(info, method="precedence_search", optimal=False)
+    order, info = _anytime_tour(coords_with_addr, time_budget_ms, start=start, end=end, matrix=matrix, on_improve=on_improve)
+    return order, dict(info, method="local_search", optimal=False)
+
+class RouteSolverBusy(Exception):
+    """A RouteSolverPool tele van (befogadás): a kérést később kell megismételni."""
+
+def _route_pool_worker(matrix_name: str, result_name: str, coords_with_addr: List[Tuple[str,float,float]], start: Optional[int],
+                       end: Optional[int], precedence: Dict[int, int], time_budget_ms: float) -> Tuple[List[int], Dict]:
+    """
+    RouteSolverPool worker: a mátrixot a shared memory-ból olvassa, minden javulásnál a legjobb sorrendet
+    a result blokkba írja ([verzió, hossz, index...]), hogy időtúllépéskor a szülő azt használhassa.
+    """
+    shm_m = shared_memory.SharedMemory(name=matrix_name)
+    shm_r = shared_memory.SharedMemory(name=result_name)
+    n = len(coords_with_addr)
+    flat = shm_m.buf.cast("d")
+    res = shm_r.buf.cast("d")
+    try:
+        rows = [list(flat[i * n:(i + 1) * n]) for i in range(n)]
+        version = [0.0]
+
+        def publish(order: List[int]) -> None:
+            version[0] += 1
+            res[0] = -1.0  # írás közben érvénytelen
+            res[1] = float(len(order))
+            res[2:2 + len(order)] = array("d", order)
+            res[0] = version[0]
+
+        return _solve_order(coords_with_addr, rows, start, end, precedence, time_budget_ms, on_improve=publish)
+    finally:
+        flat.release(); res.release()
+        shm_m.close(); shm_r.close()
+
+class RouteSolverPool:
+    """
+    Nagy (heurisztikus) útvonal számítások korlátos ProcessPoolExecutor-ban, hogy egy hosszú útvonal ne fogja
+    a GIL-t a Flask szálak elől. A mátrix shared memory-ban megy át; időtúllépéskor a worker által utoljára
+    beírt legjobb sorrend (vagy ha még nincs, egy gyors helyi építés) a válasz. Befogadás: ha workers + max_pending
+    feladat fut / vár, RouteSolverBusy. Amíg nincs elindítva (start), minden helyben fut.
+    """
+    def __init__(self, workers: int = ROUTE_POOL_WORKERS, max_pending: int = ROUTE_POOL_MAX_PENDING,
+                 grace_ms: float = ROUTE_POOL_GRACE_MS, min_stops: int = ROUTE_POOL_MIN_STOPS) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.grace_ms = grace_ms
+        self.min_stops = min_stops
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.counters = {"submitted": 0, "completed": 0, "timeouts": 0, "partial": 0, "rejected": 0, "crashed": 0}
+
+    def start(self) -> None:
+        with self._lock:
+            if self._executor is None and self.workers > 0:
+                # spawn: a szülő szálai (Flask, bot, geokódoló) mellett a fork nem biztonságos
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+
+    def stop(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def accepts(self, stops: int) -> bool:
+        return self._executor is not None and stops >= self.min_stops
+
+    def _restart(self) -> None:
+        self.stop(); self.start()
+
+    @staticmethod
+    def _read_partial(res) -> Optional[List[int]]:
+        view = res.buf.cast("d")
+        try:
+            version = view[0]
+            if version <= 0:
+                return None
+            order = [int(x) for x in view[2:2 + int(view[1])]]
+            return order if view[0] == version else None
+        finally:
+            view.release()
+
+    def solve(self, coords_with_addr: List[Tuple[str,float,float]], matrix, start: Optional[int], end: Optional[int],
+              precedence: Dict[int, int], time_budget_ms: float) -> Tuple[List[int], Dict]:
+        with self._lock:
+            if self._inflight >= self.workers + self.max_pending:
+                self.counters["rejected"] += 1
+                raise RouteSolverBusy("route solver pool saturated")
+            self._inflight += 1; self.counters["submitted"] += 1
+            executor = self._executor
+        n = len(coords_with_addr)
+        shm_m = shm_r = None
+        holders = [2]  # a szülő és a worker: a shared memory az utolsó elengedésekor szabadul fel
+
+        def release(worker_done: bool) -> None:
+            # a worker a határidő után is futhat: a pool helye csak a befejezésekor (done callback) szabadul fel
+            with self._lock:
+                if worker_done:
+                    self._inflight -= 1
+                holders[0] -= 1; last = holders[0] == 0
+            if last:
+                for shm in (shm_m, shm_r):
+                    if shm:
+                        shm.close(); shm.unlink()
+
+        try:
+            shm_m = shared_memory.SharedMemory(create=True, size=max(8, n * n * 8))
+            shm_r = shared_memory.SharedMemory(create=True, size=(n + 2) * 8)
+            flat = shm_m.buf.cast("d")
+            flat[:n * n] = array("d", (x for row in _matrix_rows(matrix) for x in row))
+            flat.release()
+            shm_r.buf[:8] = bytes(8)
+            future = executor.submit(_route_pool_worker, shm_m.name, shm_r.name, coords_with_addr, start, end, precedence, time_budget_ms)
+        except BaseException:
+            release(True); release(False); raise
+        future.add_done_callback(lambda _f: release(True))
+        try:
+            order, info = future.result(timeout=(time_budget_ms + self.grace_ms) / 1000.0)
+            with self._lock: self.counters["completed"] += 1
+            return order, dict(info, pool=True)
+        except FuturesTimeout:
+            future.cancel()
+            with self._lock: self.counters["timeouts"] += 1
+            order = self._read_partial(shm_r)
+            if order:
+                with self._lock: self.counters["partial"] += 1
+                return order, {"method": "partial", "optimal": False, "timed_out": True, "pool": True}
+            order, info = _solve_order(coords_with_addr, matrix, start, end, precedence, ROUTE_FALLBACK_BUDGET_MS)
+            return order, dict(info, timed_out=True, pool=False)
+        except BrokenProcessPool:
+            logger.error("route solver pool crashed, restarting")
+            with self._lock: self.counters["crashed"] += 1
+            self._restart()
+            order, info = _solve_order(coords_with_addr, matrix, start, end, precedence, ROUTE_FALLBACK_BUDGET_MS)
+            return order, dict(info, pool=False)
+        finally:
+            release(False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counters, inflight=self._inflight, workers=self.workers if self._executor else 0)
+
+class RouteCache:
+    """
+    Kész útvonal válaszok memóriában (LRU + TTL), kulcs: rendelés ID-k rendezve + start / end rácscella.
+    Rendelésenként nyilvántartja, mely kulcsokban szerepel, így státusz / hely változáskor csak azok törlődnek.
+    Számítás közbeni változás ellen: a hívó a rendelések beolvasása előtt stamp()-et kér, és a put() eldobja az
+    eredményt, ha azóta valamelyik rendelése érvénytelenítődött (vagy a cache ürült) - régi állapotból ne legyen találat.
+    """
+    def __init__(self, size: int = ROUTE_CACHE_SIZE, ttl: float = ROUTE_CACHE_TTL, cell_m: float = ROUTE_CACHE_CELL_M) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.cell_deg = cell_m / 111_320.0
+        self._data: "OrderedDict[tuple, Tuple[float, Dict]]" = OrderedDict()
+        self._by_order: Dict[int, set] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._changed_at: Dict[int, Tuple[int, float]] = {}  # rendelés -> (utolsó érvénytelenítés epoch, idő)
+        self._cleared_at = 0
+        self.counters = {"hits": 0, "misses": 0, "invalidated": 0, "stale_puts": 0}
+
+    def cell(self, coord: Optional[Tuple[str, float, float]]) -> Optional[Tuple[int, int]]:
+        if not coord:
+            return None
+        lat, lon = coord[1], coord[2]
+        return (round(lat / self.cell_deg), round(lon * math.cos(math.radians(lat)) / self.cell_deg))
+
+    def key(self, order_ids: List[int], start_coord=None, end_coord=None) -> tuple:
+        return (tuple(sorted(order_ids)), self.cell(start_coord), self.cell(end_coord))
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item and time.time() - item[0] < self.ttl:
+                self._data.move_to_end(key); self.counters["hits"] += 1
+                return item[1]
+            if item:
+                self._drop(key)
+            self.counters["misses"] += 1
+            return None
+
+    def stamp(self) -> Tuple[int, float]:
+        """A put() stamp paramétere: a rendelések beolvasása előtt kérendő."""
+        with self._lock:
+            return self._epoch, time.time()
+
+    def _stale(self, key: tuple, stamp: Tuple[int, float]) -> bool:
+        epoch, taken = stamp
+        if self._cleared_at > epoch or time.time() - taken > self.ttl:  # a ttl-nél régebbi változásokat már nem tartjuk
+            return True
+        return any(self._changed_at.get(oid, (0, 0.0))[0] > epoch for oid in key[0])
+
+    def put(self, key: tuple, value: Dict, stamp: Optional[Tuple[int, float]] = None) -> None:
+        with self._lock:
+            if stamp is not None and self._stale(key, stamp):
+                self.counters["stale_puts"] += 1
+                return
+            self._data[key] = (time.time(), value); self._data.move_to_end(key)
+            for oid in key[0]:
+                self._by_order[oid].add(key)
+            while len(self._data) > self.size:
+                self._drop(next(iter(self._data)))
+
+    def _drop(self, key: tuple) -> None:
+        self._data.pop(key, None)
+        for oid in key[0]:
+            keys = self._by_order.get(oid)
+            if keys:
+                keys.discard(key)
+                if not keys: del self._by_order[oid]
+
+    def invalidate_order(self, order_id: int) -> None:
+        with self._lock:
+            self._epoch += 1
+            now = time.time()
+            self._changed_at[order_id] = (self._epoch, now)
+            if len(self._changed_at) > 4 * self.size:
+                self._changed_at = {oid: v for oid, v in self._changed_at.items() if now - v[1] <= self.ttl}
+            for key in list(self._by_order.get(order_id, ())):
+                self._drop(key); self.counters["invalidated"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1; self._cleared_at = self._epoch
+            self.counters["invalidated"] += len(self._data)
+            self._data.clear(); self._by_order.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.counters["hits"] + self.counters["misses"]
+            return dict(self.counters, size=len(self._data), hit_ratio=round(self.counters["hits"] / total, 3) if total else 0.0)
+
+class RouteJobs:
+    """
+    Aszinkron útvonal feladatok: a beküldés azonnal job id-t ad, a számítás (geokódolás + megoldás) háttérszálon fut,
+    az eredmény státusz / long-poll lekérdezéssel jön és ttl másodpercig megmarad (job id-nként).
+    Dedup: ha a futárnak ugyanarra a kérésre (RouteCache kulcs) már fut / vár feladata, annak az id-ja jön vissza.
+    """
+    def __init__(self, workers: int = ROUTE_JOB_WORKERS, ttl: float = ROUTE_JOB_TTL, max_jobs: int = ROUTE_JOB_MAX) -> None:
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="route-job")
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._by_courier: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "deduped": 0, "done": 0, "failed": 0}
+
+    def submit(self, courier_id: int, key: tuple, fn) -> Dict:
+        """fn() -> eredmény dict; hibánál (error kód, HTTP státusz) kerül a feladatba."""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(self._by_courier.get(courier_id, ""))
+            if job and job["key"] == key and job["status"] in ("queued", "running"):
+                self.counters["deduped"] += 1
+                return self._public(job)
+            job = {"id": secrets.token_urlsafe(12), "courier_id": courier_id, "key": key, "status": "queued",
+                   "created": time.time(), "finished": None, "result": None, "error": None, "code": 200,
+                   "event": threading.Event()}
+            self._jobs[job["id"]] = job
+            self._by_courier[courier_id] = job["id"]
+            self.counters["submitted"] += 1
+        self._pool.submit(self._run, job, fn)
+        return self._public(job)
+
+    def _run(self, job: Dict, fn) -> None:
+        job["status"] = "running"
+        try:
+            job["result"] = fn()
+            job["status"] = "done"
+        except RouteSolverBusy:
+            job["error"], job["code"], job["status"] = "busy", 503, "error"
+        except ValueError as e:
+            job["error"], job["code"], job["status"] = str(e), 400, "error"
+        except Exception as e:
+            logger.error(f"route job {job['id']} error: {e}")
+            job["error"], job["code"], job["status"] = str(e), 500, "error"
+        finally:
+            job["finished"] = time.time()
+            with self._lock:
+                self.counters["done" if job["status"] == "done" else "failed"] += 1
+            job["event"].set()
+
+    def wait(self, job_id: str, courier_id: int, timeout: float = 0) -> Optional[Dict]:
+        """Long-poll: legfeljebb timeout másodpercig vár a befejezésre. None ha nincs ilyen (vagy nem a futáré)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if not job or job["courier_id"] != courier_id:
+            return None
+        if timeout > 0:
+            job["event"].wait(timeout)
+        return self._public(job)
+
+    @staticmethod
+    def _public(job: Dict) -> Dict:
+        end = job["finished"] or time.time()
+        return {"job_id": job["id"], "status": job["status"], "result": job["result"], "error": job["error"],
+                "code": job["code"], "age_ms": round((end - job["created"]) * 1000, 1)}
+
+    def _prune(self) -> None:
+        now = time.time()
+        for jid, job in list(self._jobs.items()):
+            done = job["finished"] is not None
+            if done and (now - job["finished"] > self.ttl or len(self._jobs) > self.max_jobs):
+                del self._jobs[jid]
+                if self._by_courier.get(job["courier_id"]) == jid:
+                    del self._by_courier[job["courier_id"]]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            active = sum(1 for j in self._jobs.values() if j["finished"] is None)
+            return dict(self.counters, jobs=len(self._jobs), active=active)
 
 # ---------------- Map URL builders ----------------
 def coords_to_google_maps_url(coords_with_addr: List[Tuple[str, float, float]]) -> str:
@@ -297,6 +2267,295 @@ def coords_to_waze_url(coords_with_addr: List[Tuple[str, float, float]]) -> str:
     lat, lon = coords_with_addr[0][1], coords_with_addr[0][2]
     return f"https://waze.com/ul?ll={lat},{lon}&navigate=yes"
 
+def shorten_url(url: str) -> str:
+    """
+    Rövidíti a kapott URL-t TinyURL API-val.
+    Ha nem sikerül, visszaadja az eredeti URL-t.
+    """
+    try:
+        r = http_client.get("https://tinyurl.com/api-create.php", params={"url": url})
+        if r.status_code == 200 and r.text.startswith("http"):
+            return r.text.strip()
+    except Exception as e:
+        logger.error(f"URL rövidítés hiba: {e}")
+    return url
+
+class ShortUrlCache:
+    """
+    Rövidített URL-ek memóriában (LRU) és a short_urls táblában, a teljes URL a kulcs.
+    get() soha nem hív külső szolgáltatót: ha még nincs rövid változat, a teljes URL-t adja vissza,
+    és sorba teszi a rövidítést a háttér workernek, így a következő kérés már a rövid formát kapja.
+    """
+    def __init__(self, db_path: str = DB_NAME, lru_size: int = SHORT_URL_LRU_SIZE) -> None:
+        self.db_path = db_path
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: set = set()
+        self._queue: "Queue[str]" = Queue()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "shortened": 0, "failed": 0}
+
+    def _remember(self, long_url: str, short: str) -> None:
+        with self._lock:
+            self._lru[long_url] = short; self._lru.move_to_end(long_url)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get(self, long_url: str) -> str:
+        if not long_url:
+            return long_url
+        with self._lock:
+            short = self._lru.get(long_url)
+            if short:
+                self._lru.move_to_end(long_url); self.counters["hits"] += 1
+                return short
+        try:
+            conn = sqlite3.connect(self.db_path); cur = conn.cursor()
+            cur.execute("SELECT short_url FROM short_urls WHERE long_url = ?", (long_url,))
+            row = cur.fetchone(); conn.close()
+        except Exception as e:
+            logger.error(f"short url cache read error: {e}"); row = None
+        if row:
+            self._remember(long_url, row[0])
+            with self._lock: self.counters["hits"] += 1
+            return row[0]
+        with self._lock:
+            self.counters["misses"] += 1
+            if long_url not in self._pending:
+                self._pending.add(long_url); self._queue.put(long_url)
+        return long_url
+
+    def worker(self) -> None:
+        """
+        Háttérszál: a sorba tett URL-eket rövidíti és elmenti.
+        """
+        while True:
+            long_url = self._queue.get()
+            try:
+                short = shorten_url(long_url)
+                if short and short != long_url:
+                    conn = sqlite3.connect(self.db_path); cur = conn.cursor()
+                    cur.execute("INSERT OR REPLACE INTO short_urls(long_url, short_url, created_at) VALUES (?,?,?)", (long_url, short, time.time()))
+                    conn.commit(); conn.close()
+                    self._remember(long_url, short)
+                    with self._lock: self.counters["shortened"] += 1
+                else:
+                    with self._lock: self.counters["failed"] += 1
+            except Exception as e:
+                logger.error(f"short url worker error: {e}")
+            finally:
+                with self._lock: self._pending.discard(long_url)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counters, pending=len(self._pending), lru_size=len(self._lru))
+
+# ---------------- Order bundles ----------------
+def _order_ts(created_at: Optional[str]) -> float:
+    """orders.created_at (helyi idő, 'YYYY-MM-DD HH:MM:SS') epoch másodpercben."""
+    try:
+        return time.mktime(time.strptime(str(created_at)[:19], "%Y-%m-%d %H:%M:%S"))
+    except (TypeError, ValueError):
+        return time.time()
+
+class OrderBundler:
+    """
+    Függő, geokódolt rendelések csomagolása (DBSCAN jellegű): két rendelés szomszéd, ha a címük eps méteren belül
+    van és window másodpercen belül érkeztek. Mag: legalább min_orders rendelés a szomszédsággal együtt; a csomag a
+    magokon át összefüggő rendelések, a szegély rendelés a legkisebb ID-jú szomszédos mag csomagjába kerül.
+    A max_orders-nél nagyobb (láncolódott) klasztert egy futárnyi csomagokra bontja: a legrégebbi rendelés
+    mellé a hozzá eps-en belüli legközelebbiek. Inkrementális: rendelésenként csak a szomszédság gráf frissül (eps méretű rács, 3x3 cella), a csomagok
+    lekérdezéskor állnak össze (BFS, O(rendelés + él)).
+    """
+    def __init__(self, eps_m: float = ORDER_BUNDLE_EPS_M, window_s: float = ORDER_BUNDLE_WINDOW_S,
+                 min_orders: int = ORDER_BUNDLE_MIN_ORDERS, max_orders: int = ORDER_BUNDLE_MAX_ORDERS) -> None:
+        self.eps_km = eps_m / 1000.0
+        self.window_s = window_s
+        self.min_orders = min_orders
+        self.max_orders = max_orders
+        self.cell_deg = eps_m / 111_320.0
+        self._points: Dict[int, Tuple[float, float, float]] = {}
+        self._cells: Dict[Tuple[int, int], set] = defaultdict(set)
+        self._adj: Dict[int, set] = {}
+        self._lock = threading.Lock()
+        self.counters = {"added": 0, "removed": 0}
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lon * math.cos(math.radians(lat)) / self.cell_deg))
+
+    def add(self, order_id: int, lat: float, lon: float, ts: float) -> None:
+        with self._lock:
+            self._discard(order_id)
+            cx, cy = self._cell(lat, lon)
+            adj = set()
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for other in self._cells.get((cx + dx, cy + dy), ()):
+                        olat, olon, ots = self._points[other]
+                        if abs(ts - ots) <= self.window_s and haversine_distance((lat, lon), (olat, olon)) <= self.eps_km:
+                            adj.add(other); self._adj[other].add(order_id)
+            self._points[order_id] = (lat, lon, ts)
+            self._cells[(cx, cy)].add(order_id)
+            self._adj[order_id] = adj
+            self.counters["added"] += 1
+
+    def discard(self, order_id: int) -> None:
+        with self._lock:
+            self._discard(order_id)
+
+    def _discard(self, order_id: int) -> None:
+        point = self._points.pop(order_id, None)
+        if point is None:
+            return
+        cell = self._cell(point[0], point[1])
+        self._cells[cell].discard(order_id)
+        if not self._cells[cell]: del self._cells[cell]
+        for other in self._adj.pop(order_id, ()):
+            self._adj[other].discard(order_id)
+        self.counters["removed"] += 1
+
+    def load(self, orders: List[Dict]) -> None:
+        """Induláskor: a get_open_orders függő, geokódolt sorai."""
+        for o in orders:
+            if o.get("status") == "pending" and o.get("lat") is not None and o.get("lon") is not None:
+                self.add(o["id"], o["lat"], o["lon"], _order_ts(o.get("created_at")))
+
+    def bundles(self) -> List[Dict]:
+        """Csomagok: [{"bundle_id" (legkisebb rendelés ID), "order_ids", "center": [lat, lon], "radius_m"}]."""
+        with self._lock:
+            core = {i for i, adj in self._adj.items() if len(adj) + 1 >= self.min_orders}
+            owner: Dict[int, int] = {}
+            groups: List[List[int]] = []
+            for seed in sorted(core):
+                if seed in owner:
+                    continue
+                members = [seed]; owner[seed] = seed; todo = [seed]
+                while todo:
+                    for other in sorted(self._adj[todo.pop()]):
+                        if other in owner:
+                            continue
+                        owner[other] = seed; members.append(other)
+                        if other in core:
+                            todo.append(other)
+                groups.extend(self._split(members) if len(members) > self.max_orders else [members])
+            out = []
+            for members in groups:
+                if len(members) < max(2, self.min_orders):
+                    continue
+                pts = [self._points[i] for i in members]
+                center = (sum(p[0] for p in pts) / len(pts), sum(p[1] for p in pts) / len(pts))
+                radius = max(haversine_distance(center, (p[0], p[1])) for p in pts)
+                out.append({"bundle_id": min(members), "order_ids": sorted(members),
+                            "center": [round(center[0], 6), round(center[1], 6)], "radius_m": round(radius * 1000)})
+            return out
+
+    def _split(self, members: List[int]) -> List[List[int]]:
+        left = set(members)
+        out = []
+        for seed in sorted(members, key=lambda i: (self._points[i][2], i)):
+            if seed not in left:
+                continue
+            sp = self._points[seed]
+            near = sorted((haversine_distance((sp[0], sp[1]), self._points[i][:2]), i) for i in self._adj[seed] if i in left)
+            group = [seed] + [i for _, i in near[:self.max_orders - 1]]
+            left.difference_update(group)
+            out.append(group)
+        return out
+
+    def by_order(self) -> Dict[int, Dict]:
+        return {oid: b for b in self.bundles() for oid in b["order_ids"]}
+
+    def bundle_of(self, order_id: int) -> Optional[Dict]:
+        return self.by_order().get(order_id)
+
+    def stats(self) -> Dict:
+        bundles = self.bundles()
+        with self._lock:
+            return dict(self.counters, orders=len(self._points), bundles=len(bundles),
+                        bundled_orders=sum(len(b["order_ids"]) for b in bundles))
+
+class PendingOrderIndex:
+    """
+    Függő, geokódolt rendelések memóriabeli rács indexe (geohash jellegű, cell_m méretű fok-cellák): rendelésenként
+    O(1) frissítés, sugár lekérdezés csak a befoglaló téglalap celláit nézi, k legközelebbi: növekvő sugárral.
+    A pontok radiánban + cos(lat)-tal tárolva, így a jelöltenkénti haversine csak néhány szorzás.
+    """
+    def __init__(self, cell_m: float = ORDER_INDEX_CELL_M) -> None:
+        self.cell_deg = cell_m / 111_320.0
+        self._points: Dict[int, Tuple[float, float]] = {}
+        self._rad: Dict[int, Tuple[float, float, float]] = {}
+        self._cells: Dict[Tuple[int, int], set] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def add(self, order_id: int, lat: float, lon: float) -> None:
+        with self._lock:
+            self._discard(order_id)
+            self._points[order_id] = (lat, lon)
+            self._rad[order_id] = (math.radians(lat), math.radians(lon), math.cos(math.radians(lat)))
+            self._cells[self._cell(lat, lon)].add(order_id)
+
+    def discard(self, order_id: int) -> None:
+        with self._lock:
+            self._discard(order_id)
+
+    def _discard(self, order_id: int) -> None:
+        point = self._points.pop(order_id, None)
+        if point is not None:
+            del self._rad[order_id]
+            cell = self._cell(*point)
+            self._cells[cell].discard(order_id)
+            if not self._cells[cell]: del self._cells[cell]
+
+    def load(self, orders: List[Dict]) -> None:
+        for o in orders:
+            if o.get("status") == "pending" and o.get("lat") is not None and o.get("lon") is not None:
+                self.add(o["id"], o["lat"], o["lon"])
+
+    def _within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[float, int]]:
+        dlat = radius_km / 111.32
+        dlon = radius_km / (111.32 * max(math.cos(math.radians(min(abs(lat) + dlat, 89.0))), 1e-6))
+        (x0, y0), (x1, y1) = self._cell(lat - dlat, lon - dlon), self._cell(lat + dlat, lon + dlon)
+        out = []
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            cands = (i for cell in self._cells.values() for i in cell)  # nagy sugár: olcsóbb minden cellát nézni
+        else:
+            cands = (i for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) for i in self._cells.get((x, y), ()))
+        qlat, qlon = math.radians(lat), math.radians(lon); qcos = math.cos(qlat)
+        # haversine (lásd haversine_distance) a sin^2 tagon összehasonlítva: a küszöb is erre átszámolva
+        limit = math.sin(min(radius_km / 6371.0, math.pi) / 2) ** 2
+        sin, rad = math.sin, self._rad
+        for i in cands:
+            plat, plon, pcos = rad[i]
+            sa = sin((plat - qlat) / 2) ** 2 + qcos * pcos * sin((plon - qlon) / 2) ** 2
+            if sa <= limit:
+                out.append((2 * 6371.0 * math.asin(math.sqrt(min(sa, 1.0))), i))
+        return out
+
+    def within(self, lat: float, lon: float, radius_km: float, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Rendelések radius_km-en belül távolság szerint: [(order_id, km), ...]."""
+        with self._lock:
+            found = self._within(lat, lon, radius_km)
+        found = heapq.nsmallest(limit, found) if limit else sorted(found)
+        return [(i, d) for d, i in found]
+
+    def nearest(self, lat: float, lon: float, k: int, max_km: float = ORDER_NEAR_MAX_RADIUS_KM) -> List[Tuple[int, float]]:
+        """k legközelebbi rendelés (max_km-en belül): [(order_id, km), ...]."""
+        radius = self.cell_deg * 111.32
+        with self._lock:
+            while True:
+                found = self._within(lat, lon, radius)
+                if len(found) >= k or radius >= max_km or len(found) == len(self._points):
+                    break
+                radius = min(radius * 2, max_km)
+        return [(i, d) for d, i in heapq.nsmallest(k, found)]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"orders": len(self._points), "cells": len(self._cells)}
+
 # ---------------- Database Manager ----------------
 class DatabaseManager:
     def __init__(self) -> None:
@@ -331,6 +2590,69 @@ class DatabaseManager:
         cur.execute("""CREATE TABLE IF NOT EXISTS groups(id INTEGER PRIMARY KEY, name TEXT NOT NULL)""")
     
         cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_group ON orders(group_name)")
+
+        # Rendelés koordináták: a háttér geokódoló tölti ki mentés után
+        try:
+            cur.execute("PRAGMA table_info(orders)")
+            cols = [r[1] for r in cur.fetchall()]
+            if "lat" not in cols:
+                cur.execute("ALTER TABLE orders ADD COLUMN lat REAL")
+            if "lon" not in cols:
+                cur.execute("ALTER TABLE orders ADD COLUMN lon REAL")
+            if "geocode_status" not in cols:
+                cur.execute("ALTER TABLE orders ADD COLUMN geocode_status TEXT")
+            if "geocode_tier" not in cols:
+                cur.execute("ALTER TABLE orders ADD COLUMN geocode_tier TEXT")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_geocode_status ON orders(geocode_status)")
+            # a régi "city" (városközpont) szint nem valódi hely: újrageokódolás
+            cur.execute("UPDATE orders SET lat = NULL, lon = NULL, geocode_status = 'stale', geocode_tier = NULL WHERE geocode_tier = 'city'")
+        except Exception as e:
+            logger.error(f'DB migrate error: {e}')
+
+        # Étterem (csoport) helye: a felvételi pont az útvonaltervezéshez (/etterem parancs)
+        try:
+            cur.execute("PRAGMA table_info(groups)")
+            cols = [r[1] for r in cur.fetchall()]
+            if "address" not in cols:
+                cur.execute("ALTER TABLE groups ADD COLUMN address TEXT")
+            if "lat" not in cols:
+                cur.execute("ALTER TABLE groups ADD COLUMN lat REAL")
+            if "lon" not in cols:
+                cur.execute("ALTER TABLE groups ADD COLUMN lon REAL")
+            if "geocode_tier" not in cols:
+                cur.execute("ALTER TABLE groups ADD COLUMN geocode_tier TEXT")
+            cur.execute("UPDATE groups SET lat = NULL, lon = NULL, geocode_tier = NULL WHERE geocode_tier = 'city'")
+        except Exception as e:
+            logger.error(f'DB migrate error: {e}')
+
+        # Rövidített URL-ek (ShortUrlCache)
+        cur.execute("""CREATE TABLE IF NOT EXISTS short_urls (
+                long_url TEXT PRIMARY KEY,
+                short_url TEXT NOT NULL,
+                created_at REAL
+            )
+        """)
+
+        # Páronkénti útköltség (PairCostCache)
+        cur.execute("""CREATE TABLE IF NOT EXISTS pair_costs (
+                metric TEXT NOT NULL,
+                a TEXT NOT NULL,
+                b TEXT NOT NULL,
+                cost REAL NOT NULL,
+                a_lat REAL, a_lon REAL, b_lat REAL, b_lon REAL,
+                updated_at REAL,
+                PRIMARY KEY (metric, a, b)
+            )
+        """)
+
+        # Geokód cache (GeocodeCache): lat/lon NULL = sikertelen cím (negatív cache)
+        cur.execute("""CREATE TABLE IF NOT EXISTS geocode_cache (
+                key TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                updated_at REAL NOT NULL
+            )
+        """)
     
         # Futárok tábla létrehozása ugyanabban a kapcsolatban
         cur.execute("""CREATE TABLE IF NOT EXISTS couriers (
@@ -341,6 +2663,19 @@ class DatabaseManager:
                 last_seen TIMESTAMP DEFAULT (datetime('now', 'localtime'))
             )
         """)
+
+        # Futár utolsó ismert helye (megosztott hely / útvonal kérés), a diszpécser javaslatokhoz
+        try:
+            cur.execute("PRAGMA table_info(couriers)")
+            cols = [r[1] for r in cur.fetchall()]
+            if "last_lat" not in cols:
+                cur.execute("ALTER TABLE couriers ADD COLUMN last_lat REAL")
+            if "last_lon" not in cols:
+                cur.execute("ALTER TABLE couriers ADD COLUMN last_lon REAL")
+            if "last_location_at" not in cols:
+                cur.execute("ALTER TABLE couriers ADD COLUMN last_location_at REAL")
+        except Exception as e:
+            logger.error(f'DB migrate error: {e}')
     
         # Minden változtatás mentése és kapcsolat bezárása
         conn.commit()
@@ -351,17 +2686,66 @@ class DatabaseManager:
         cur.execute("INSERT OR IGNORE INTO groups(id, name) VALUES (?,?)", (group_id, group_name))
         conn.commit(); conn.close()
 
+    def set_group_location(self, group_id: int, group_name: str, address: str, coord: Tuple[float, float], tier: str) -> None:
+        conn = sqlite3.connect(DB_NAME); cur = conn.cursor()
+        cur.execute("INSERT OR IGNORE INTO groups(id, name) VALUES (?,?)", (group_id, group_name))
+        cur.execute("UPDATE groups SET address = ?, lat = ?, lon = ?, geocode_tier = ? WHERE id = ?", (address, coord[0], coord[1], tier, group_id))
+        conn.commit(); conn.close()
+        route_cache.clear()  # felvételi pont változott: a kulcs nem tartalmazza a csoportot
+
     def save_order(self, item: Dict) -> int:
         conn = sqlite3.connect(DB_NAME); cur = conn.cursor()
-        cur.execute("""INSERT INTO orders (restaurant_name, restaurant_address, phone_number, order_details, group_id, group_name, message_id) VALUES (?,?,?,?,?,?,?)""",
+        cur.execute("""INSERT INTO orders (restaurant_name, restaurant_address, phone_number, order_details, group_id, group_name, message_id, geocode_status) VALUES (?,?,?,?,?,?,?,'pending')""",
                     (item.get("restaurant_name",""), item.get("restaurant_address",""), item.get("phone_number",""), item.get("order_details",""), item.get("group_id"), item.get("group_name"), item.get("message_id")))
-        oid = cur.lastrowid; conn.commit(); conn.close(); return oid
+        oid = cur.lastrowid; conn.commit(); conn.close()
+        sync_pending_order(oid)
+        # geokódolás háttérben, hogy a futár végpontok már kész koordinátát olvassanak
+        geocode_queue.put(oid)
+        return oid
+
+    def set_order_geocode(self, order_id: int, status: str, coord: Optional[Tuple[float, float]] = None, tier: Optional[str] = None) -> None:
+        conn = sqlite3.connect(DB_NAME); cur = conn.cursor()
+        cur.execute("UPDATE orders SET lat = ?, lon = ?, geocode_status = ?, geocode_tier = ? WHERE id = ?",
+                    (coord[0] if coord else None, coord[1] if coord else None, status, tier, order_id))
+        conn.commit(); conn.close()
+        route_cache.invalidate_order(order_id)
+        sync_pending_order(order_id)
+
+    def update_order_address(self, order_id: int, address: str) -> None:
+        conn = sqlite3.connect(DB_NAME); cur = conn.cursor()
+        cur.execute("UPDATE orders SET restaurant_address = ?, lat = NULL, lon = NULL, geocode_status = 'pending', geocode_tier = NULL WHERE id = ?", (address, order_id))
+        conn.commit(); conn.close()
+        route_cache.invalidate_order(order_id)
+        order_bundles.discard(order_id); pending_index.discard(order_id)
+        geocode_queue.put(order_id)
+
+    def get_warmup_addresses(self) -> List[str]:
+        """
+        Különböző címek bemelegítéshez: előbb a nyitott rendelésekéi, utána a gyakran kiszállítottak.
+        """
+        conn = sqlite3.connect(DB_NAME); cur = conn.cursor()
+        cur.execute("""
+            SELECT restaurant_address, MAX(CASE WHEN status IN ('pending','accepted','picked_up') THEN 1 ELSE 0 END) AS open_orders, COUNT(*) AS cnt
+            FROM orders WHERE restaurant_address <> '' GROUP BY restaurant_address ORDER BY open_orders DESC, cnt DESC
+        """)
+        rows = [r[0] for r in cur.fetchall()]; conn.close(); return rows
+
+    def get_orders_to_geocode(self, statuses: Tuple[str, ...] = ("pending", "error", "stale")) -> List[int]:
+        conn = sqlite3.connect(DB_NAME); cur = conn.cursor()
+        cur.execute(f"SELECT id FROM orders WHERE geocode_status IN ({','.join('?' * len(statuses))}) AND status IN ('pending','accepted','picked_up') ORDER BY created_at", statuses)
+        ids = [r[0] for r in cur.fetchall()]; conn.close(); return ids
 
     def get_open_orders(self) -> List[Dict]:
         conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row; cur = conn.cursor()
-        cur.execute("SELECT id, restaurant_name, restaurant_address, phone_number, order_details, group_id, group_name, created_at, status, delivery_partner_id, estimated_time FROM orders WHERE status IN ('pending','accepted','picked_up') ORDER BY created_at DESC")
+        cur.execute("SELECT id, restaurant_name, restaurant_address, phone_number, order_details, group_id, group_name, created_at, status, delivery_partner_id, estimated_time, lat, lon FROM orders WHERE status IN ('pending','accepted','picked_up') ORDER BY created_at DESC")
         rows = [dict(r) for r in cur.fetchall()]; conn.close(); return rows
 
+    def get_orders_by_ids(self, order_ids: List[int]) -> Dict[int, Dict]:
+        if not order_ids: return {}
+        conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row; cur = conn.cursor()
+        cur.execute(f"SELECT id, restaurant_name, restaurant_address, phone_number, order_details, group_id, group_name, created_at, status, lat, lon FROM orders WHERE id IN ({','.join('?' * len(order_ids))})", list(order_ids))
+        rows = {r["id"]: dict(r) for r in cur.fetchall()}; conn.close(); return rows
+
     def get_order_by_id(self, order_id: int) -> Optional[Dict]:
         conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row; cur = conn.cursor()
         cur.execute("SELECT * FROM orders WHERE id = ?", (order_id,)); row = cur.fetchone(); conn.close(); return dict(row) if row else None
@@ -372,10 +2756,25 @@ class DatabaseManager:
             UPDATE orders SET status = ?, delivery_partner_id = COALESCE(?, delivery_partner_id), delivery_partner_name = COALESCE(?, delivery_partner_name), delivery_partner_username = COALESCE(?, delivery_partner_username), estimated_time = COALESCE(?, estimated_time), accepted_at = CASE WHEN ?='accepted' THEN datetime('now', 'localtime') ELSE accepted_at END, picked_up_at = CASE WHEN ?='picked_up' THEN datetime ('now', 'localtime') ELSE picked_up_at END, delivered_at = CASE WHEN ?='delivered' THEN datetime('now', 'localtime') ELSE delivered_at END WHERE id = ?
         """, (status, partner_id, partner_name, partner_username, estimated_time, status, status, status, order_id))
         conn.commit(); conn.close()
+        route_cache.invalidate_order(order_id)
+        sync_pending_order(order_id)
 
     def get_partner_addresses(self, partner_id: int, status: str) -> List[Dict]:
         conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row; cur = conn.cursor()
-        cur.execute("SELECT id, restaurant_address, group_name FROM orders WHERE delivery_partner_id = ? AND status = ? ORDER BY created_at", (partner_id, status))
+        cur.execute("SELECT id, restaurant_address, group_name, lat, lon, geocode_status, geocode_tier FROM orders WHERE delivery_partner_id = ? AND status = ? ORDER BY created_at", (partner_id, status))
+        rows = [dict(r) for r in cur.fetchall()]; conn.close(); return rows
+
+    def get_partner_route_orders(self, partner_id: int) -> List[Dict]:
+        """
+        A futár elfogadott és felvett rendelései az étterem (csoport) helyével együtt, útvonaltervezéshez.
+        """
+        conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row; cur = conn.cursor()
+        cur.execute("""
+            SELECT o.id, o.restaurant_address, o.group_id, o.group_name, o.status, o.lat, o.lon, o.geocode_status, o.geocode_tier,
+                   g.address AS pickup_address, g.lat AS pickup_lat, g.lon AS pickup_lon, g.geocode_tier AS pickup_tier
+            FROM orders o LEFT JOIN groups g ON g.id = o.group_id
+            WHERE o.delivery_partner_id = ? AND o.status IN ('accepted','picked_up') ORDER BY o.created_at
+        """, (partner_id,))
         rows = [dict(r) for r in cur.fetchall()]; conn.close(); return rows
 
     def get_partner_order_count(self, partner_id: int, status: str = None) -> int:
@@ -392,6 +2791,22 @@ class DatabaseManager:
         """, (user.get("id"), user.get("username"), user.get("first_name"), user.get("last_name")))
         conn.commit(); conn.close()
 
+    def set_courier_location(self, user_id: int, lat: float, lon: float) -> None:
+        conn = sqlite3.connect(DB_NAME); cur = conn.cursor()
+        cur.execute("UPDATE couriers SET last_lat = ?, last_lon = ?, last_location_at = ? WHERE user_id = ?", (lat, lon, time.time(), user_id))
+        conn.commit(); conn.close()
+
+    def get_courier_locations(self, max_age_s: float = DISPATCH_LOCATION_MAX_AGE_S) -> List[Dict]:
+        conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row; cur = conn.cursor()
+        cur.execute("SELECT user_id, username, first_name, last_lat, last_lon, last_location_at FROM couriers WHERE last_lat IS NOT NULL AND last_location_at >= ?",
+                    (time.time() - max_age_s,))
+        rows = [dict(r) for r in cur.fetchall()]; conn.close(); return rows
+
+    def get_group_locations(self) -> Dict[int, Tuple[float, float]]:
+        conn = sqlite3.connect(DB_NAME); cur = conn.cursor()
+        cur.execute("SELECT id, lat, lon FROM groups WHERE lat IS NOT NULL AND lon IS NOT NULL")
+        rows = {r[0]: (r[1], r[2]) for r in cur.fetchall()}; conn.close(); return rows
+
     def get_all_couriers(self) -> List[Dict]:
         conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row; cur = conn.cursor()
         cur.execute("SELECT user_id, username, first_name, last_name FROM couriers")
@@ -419,7 +2834,39 @@ class DatabaseManager:
         conn.close()
         return rows
 
-db = DatabaseManager()
+# A RouteSolverPool spawn workere is importálja ezt a modult (script indításnál __mp_main__-ként), de ott csak a
+# tiszta útvonal függvények kellenek: DB, geokódoló, úthálózat, stand-in szerver csak a fő folyamatban indul.
+# (A worker nevét a spawn már az import előtt beállítja, a parent_process() ekkor még None.)
+IN_SOLVER_WORKER = current_process().name != "MainProcess"
+
+if not IN_SOLVER_WORKER:
+    db = DatabaseManager()
+    geocode_cache = GeocodeCache()
+    short_urls = ShortUrlCache()
+    route_cache = RouteCache()
+    route_pool = RouteSolverPool()
+    route_jobs = RouteJobs()
+    local_geocoder = LocalGeocoder.from_files(LOCAL_GEOCODER_CSV, LOCAL_GEOCODER_INDEX)
+    road_network = RoadNetwork.from_file(ROAD_GRAPH_FILE)
+    pair_costs = PairCostCache()
+    geocoder = GeocoderService(geocode_cache, make_geocode_provider(), local=local_geocoder)
+    order_bundles = OrderBundler()
+    order_bundles.load(db.get_open_orders())
+    pending_index = PendingOrderIndex()
+    pending_index.load(db.get_open_orders())
+
+def sync_pending_order(order_id: int) -> None:
+    """
+    Egy rendelés mentése / státusz / hely változása után: függő és geokódolt rendelés benne van a csomagolóban
+    és a térbeli indexben, más nincs.
+    """
+    order = db.get_order_by_id(order_id)
+    if order and order.get("status") == "pending" and order.get("lat") is not None and order.get("lon") is not None:
+        order_bundles.add(order_id, order["lat"], order["lon"], _order_ts(order.get("created_at")))
+        pending_index.add(order_id, order["lat"], order["lon"])
+    else:
+        order_bundles.discard(order_id)
+        pending_index.discard(order_id)
 
 def notify_all_couriers_order(order_id: int, text: str):
     """
@@ -452,8 +2899,414 @@ def notify_all_couriers_order(order_id: int, text: str):
                 logger.info(f"Queued interactive notification for courier {uid}")
     except Exception as e:
         logger.error(f"notify_all_couriers_order error: {e}")
-1
+
+def resolve_orders(orders: List[Dict]) -> List[Dict]:
+    """
+    A rendelések helye (lásd resolve_addresses): a sorra mentett koordináta, ahol még nincs (régi vagy még
+    sorban álló rendelés), ott egy kötegben feloldja és elmenti, hogy a következő kérés már csak olvasson.
+    """
+    out: List[Optional[Dict]] = [None] * len(orders)
+    missing = []
+    for i, o in enumerate(orders):
+        if o.get("lat") is not None and o.get("lon") is not None:
+            out[i] = _location((o["lat"], o["lon"]), o.get("geocode_tier") or "address", o.get("geocode_status") or "ok")
+        elif o.get("geocode_status") == "not_found":
+            out[i] = _location(None, "none", "not_found")
+        else:
+            missing.append(i)
+    if missing:
+        for i, loc in zip(missing, resolve_addresses([orders[i].get("restaurant_address", "") for i in missing])):
+            out[i] = loc
+            if orders[i].get("id"):
+                db.set_order_geocode(orders[i]["id"], loc["status"], (loc["lat"], loc["lon"]), loc["tier"])
+    return out
+
+def plan_courier_route(orders: List[Dict], start_coord: Optional[Tuple[str,float,float]] = None,
+                       time_budget_ms: float = ROUTE_TIME_BUDGET_MS, end_coord: Optional[Tuple[str,float,float]] = None) -> Tuple[List[Tuple[str,float,float]], List[Dict], Dict]:
+    """
+    Felvétel + kiszállítás egy útvonalban (get_partner_route_orders sorai).
+    Elfogadott rendelésnél az étterem (csoport) felvételi pontja a kiszállítás elé kerül; éttermenként egy felvétel.
+    Felvett rendelésnél csak a kiszállítás. Ha az étteremnek nincs mentett helye, a rendelés felvétel nélkül
+    kerül az útvonalba (meta["pickup_missing"]). A térképen nem található című rendelés kimarad (meta["drop_missing"]).
+    Visszatér: (útvonal, megállók leírása az útvonal sorrendjében, meta). A start / end pontnak nincs leírása.
+    """
+    stops: List[Tuple[str, float, float]] = []
+    info: List[Dict] = []
+    precedence: Dict[int, int] = {}
+    pickup_index: Dict[int, int] = {}
+    missing = []
+    drop_missing = []
+    for o in orders:
+        if o["status"] != "accepted":
+            continue
+        if o.get("pickup_lat") is None or o.get("pickup_lon") is None:
+            missing.append(o["id"]); continue
+        if o["group_id"] not in pickup_index:
+            pickup_index[o["group_id"]] = len(stops)
+            stops.append((o.get("pickup_address") or o.get("group_name") or "", o["pickup_lat"], o["pickup_lon"]))
+            info.append({"kind": "pickup", "group_name": o.get("group_name"), "order_ids": [],
+                         "confidence": GEOCODE_CONFIDENCE.get(o.get("pickup_tier") or "address", 1.0)})
+        info[pickup_index[o["group_id"]]]["order_ids"].append(o["id"])
+    for o, loc in zip(orders, resolve_orders(orders)):
+        if loc["lat"] is None:
+            drop_missing.append(o["id"]); continue
+        if o["status"] == "accepted" and o["group_id"] in pickup_index:
+            precedence[len(stops)] = pickup_index[o["group_id"]]
+        stops.append((o["restaurant_address"], loc["lat"], loc["lon"]))
+        info.append({"kind": "drop", "order_ids": [o["id"]], "status": o["status"], "confidence": loc["confidence"]})
+    route, meta = solve_route(stops, start_coord=start_coord, time_budget_ms=time_budget_ms, end_coord=end_coord, precedence=precedence)
+    meta["pickups"] = len(pickup_index)
+    meta["pickup_missing"] = missing
+    meta["drop_missing"] = drop_missing
+    return route, [info[i] for i in meta["order"]], meta
+
+# ---------------- Dispatch ----------------
+def _haversine_rect(a: List[Tuple[float, float]], b: List[Tuple[float, float]]):
+    """len(a) x len(b) haversine távolság (km), NumPy tömb vagy lista a listában."""
+    if NUMPY_AVAILABLE:
+        la = np.radians(np.array([p[0] for p in a], dtype=np.float64))[:, None]
+        oa = np.radians(np.array([p[1] for p in a], dtype=np.float64))[:, None]
+        lb = np.radians(np.array([p[0] for p in b], dtype=np.float64))[None, :]
+        ob = np.radians(np.array([p[1] for p in b], dtype=np.float64))[None, :]
+        sa = np.sin((la - lb) / 2) ** 2 + np.cos(la) * np.cos(lb) * np.sin((oa - ob) / 2) ** 2
+        return 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(sa, 0.0, 1.0)))
+    return [[haversine_distance(p, q) for q in b] for p in a]
+
+def linear_assignment(cost) -> List[Tuple[int, int]]:
+    """
+    Minimális összköltségű párosítás (Hungarian módszer potenciálokkal, O(n^2 m)) n x m mátrixra: min(n, m) pár
+    (sor, oszlop). NumPy-val a belső oszlop ciklus vektoros, így pár száz x pár száz is néhányszor 10 ms.
+    """
+    inf = float("inf")
+    if NUMPY_AVAILABLE:
+        cost = np.asarray(cost, dtype=np.float64)
+        if cost.ndim != 2 or not cost.size:
+            return []
+        n, m = cost.shape
+        if n > m:
+            return sorted((i, j) for j, i in linear_assignment(cost.T))
+        a = np.zeros((n + 1, m + 1)); a[1:, 1:] = cost
+        u = np.zeros(n + 1); v = np.zeros(m + 1)
+        p = np.zeros(m + 1, dtype=np.int64); way = np.zeros(m + 1, dtype=np.int64)
+        for i in range(1, n + 1):
+            p[0] = i; j0 = 0
+            minv = np.full(m + 1, inf); used = np.zeros(m + 1, dtype=bool)
+            while True:
+                used[j0] = True; i0 = p[j0]
+                cur = a[i0] - u[i0] - v
+                upd = ~used & (cur < minv)
+                minv[upd] = cur[upd]; way[upd] = j0
+                free_minv = np.where(used, inf, minv)
+                j1 = int(free_minv.argmin()); delta = free_minv[j1]
+                u[p[used]] += delta; v[used] -= delta; minv[~used] -= delta
+                j0 = j1
+                if p[j0] == 0:
+                    break
+            while j0:
+                j1 = way[j0]; p[j0] = p[j1]; j0 = j1
+        p = p.tolist()
+    else:
+        rows = _matrix_rows(cost)
+        n = len(rows); m = len(rows[0]) if n else 0
+        if not n or not m:
+            return []
+        if n > m:
+            return sorted((i, j) for j, i in linear_assignment([list(col) for col in zip(*rows)]))
+        u = [0.0] * (n + 1); v = [0.0] * (m + 1); p = [0] * (m + 1); way = [0] * (m + 1)
+        for i in range(1, n + 1):
+            p[0] = i; j0 = 0
+            minv = [inf] * (m + 1); used = [False] * (m + 1)
+            while True:
+                used[j0] = True; i0 = p[j0]; row = rows[i0 - 1]
+                delta = inf; j1 = 0
+                for j in range(1, m + 1):
+                    if not used[j]:
+                        cur = row[j - 1] - u[i0] - v[j]
+                        if cur < minv[j]: minv[j] = cur; way[j] = j0
+                        if minv[j] < delta: delta = minv[j]; j1 = j
+                for j in range(m + 1):
+                    if used[j]: u[p[j]] += delta; v[j] -= delta
+                    else: minv[j] -= delta
+                j0 = j1
+                if p[j0] == 0:
+                    break
+            while j0:
+                j1 = way[j0]; p[j0] = p[j1]; j0 = j1
+    return sorted((p[j] - 1, j - 1) for j in range(1, m + 1) if p[j])
+
+def _insertion_costs(path: List[Tuple[float, float]], pickups: List[Tuple[float, float]], drops: List[Tuple[float, float]], dpd=None):
+    """
+    Minden rendelés (felvétel, kiszállítás) legolcsóbb beszúrása a futár nyitott útjába (path[0] a futár helye),
+    a felvétel a kiszállítás előtt. dpd: felvétel -> kiszállítás km rendelésenként (több futárnál egyszer számolva).
+    Visszatér: többlet km rendelésenként (NumPy tömb vagy lista).
+    """
+    k = len(path) - 1
+    dqp = _haversine_rect(path, pickups); dqd = _haversine_rect(path, drops)
+    if dpd is None:
+        dpd = [haversine_distance(a, b) for a, b in zip(pickups, drops)]
+    legs = [haversine_distance(path[i], path[i + 1]) for i in range(k)]
+    if NUMPY_AVAILABLE:
+        dpd = np.asarray(dpd)
+        ins_p = [dqp[i] + dqp[i + 1] - legs[i] for i in range(k)] + [dqp[k]]
+        ins_d = [dqd[i] + dqd[i + 1] - legs[i] for i in range(k)] + [dqd[k]]
+        # felvétel és kiszállítás ugyanabba a résbe: q_i -> p -> d -> q_i+1
+        best = dqp[k] + dpd
+        for i in range(k):
+            best = np.minimum(best, dqp[i] + dpd + dqd[i + 1] - legs[i])
+        # külön résekbe (i < j)
+        pref = ins_p[0]
+        for j in range(1, k + 1):
+            best = np.minimum(best, pref + ins_d[j])
+            pref = np.minimum(pref, ins_p[j])
+        return best
+    out = []
+    for o in range(len(pickups)):
+        best = dqp[k][o] + dpd[o]
+        pref = inf = float("inf")
+        for j in range(k + 1):
+            if j < k:
+                best = min(best, dqp[j][o] + dpd[o] + dqd[j + 1][o] - legs[j])
+            if pref < inf:
+                best = min(best, pref + (dqd[j][o] + dqd[j + 1][o] - legs[j] if j < k else dqd[k][o]))
+            pref = min(pref, dqp[j][o] + dqp[j + 1][o] - legs[j] if j < k else dqp[k][o])
+        out.append(best)
+    return out
+
+def _path_km(path: List[Tuple[float, float]]) -> float:
+    return sum(haversine_distance(path[i], path[i + 1]) for i in range(len(path) - 1))
+
+def _insert_order(path: List[Tuple[float, float]], pickup: Tuple[float, float], drop: Tuple[float, float]) -> List[Tuple[float, float]]:
+    """A rendelés tényleges beszúrása a legolcsóbb helyre (lásd _insertion_costs), a következő körhöz."""
+    best = None
+    for i in range(1, len(path) + 1):
+        for j in range(i, len(path) + 1):
+            cand = path[:i] + [pickup] + path[i:j] + [drop] + path[j:]
+            length = _path_km(cand)
+            if best is None or length < best[0]:
+                best = (length, cand)
+    return best[1]
+
+def _courier_path(position: Tuple[float, float], stops: List[Tuple[Optional[Tuple[float, float]], Tuple[float, float]]]) -> List[Tuple[float, float]]:
+    """
+    A futár jelenlegi útja a helyéből: legközelebbi szomszéd a még nyitott megállókon, a kiszállítás csak a
+    felvétele után (stops: [(felvétel vagy None ha már felvette, kiszállítás), ...]).
+    """
+    path = [position]
+    todo = [[pick, drop] for pick, drop in stops]
+    while todo:
+        cands = [(haversine_distance(path[-1], t[0] or t[1]), n) for n, t in enumerate(todo)]
+        _, n = min(cands)
+        if todo[n][0]:
+            path.append(todo[n][0]); todo[n][0] = None
+        else:
+            path.append(todo[n][1]); todo.pop(n)
+    return path
+
+def dispatch_assign(couriers: List[Dict], orders: List[Dict], max_load: int = DISPATCH_MAX_LOAD,
+                    load_penalty_km: float = DISPATCH_LOAD_PENALTY_KM, max_detour_km: float = DISPATCH_MAX_DETOUR_KM) -> Tuple[List[Dict], List[int]]:
+    """
+    Függő rendelések szétosztása futárok között.
+    couriers: [{"id", "position": (lat, lon), "stops": [(felvétel|None, kiszállítás), ...], "load"}]
+    orders: [{"id", "pickup": (lat, lon)|None, "drop": (lat, lon)}]
+    Minden futár annyi "helyet" kap, amennyi kapacitása maradt (max_load - load); a rendelés költsége egy helyen:
+    beszúrási többlet km a futár jelenlegi útjába (_insertion_costs) + load_penalty_km * (terhelés a hellyel együtt),
+    így egy futárra több rendelés is kerülhet, de a terhelés kiegyenlítődik. Erre optimális párosítás
+    (linear_assignment), majd a rendelések tényleges beszúrása futáronként. max_detour_km fölötti párt nem javasol.
+    Visszatér: (javaslatok [{"order_id", "courier_id", "detour_km"}], kiosztatlan rendelés ID-k).
+    """
+    state = [{"id": c["id"], "path": _courier_path(c["position"], c.get("stops") or []), "load": c.get("load", 0)} for c in couriers]
+    active = [c for c in state if c["load"] < max_load]
+    slots = [(ci, c["load"] + s + 1) for ci, c in enumerate(active) for s in range(max_load - c["load"])]
+    if not slots or not orders:
+        return [], [o["id"] for o in orders]
+    pickups = [o["pickup"] or o["drop"] for o in orders]
+    drops = [o["drop"] for o in orders]
+    dpd = [haversine_distance(a, b) for a, b in zip(pickups, drops)]
+    forbidden = max_detour_km * 1000
+    if NUMPY_AVAILABLE:
+        dpd = np.array(dpd)
+        detour = np.vstack([_insertion_costs(c["path"], pickups, drops, dpd) for c in active])
+        slot_c = np.array([ci for ci, _ in slots]); slot_load = np.array([ld for _, ld in slots], dtype=np.float64)
+        cost = np.where(detour[slot_c] <= max_detour_km, detour[slot_c] + load_penalty_km * slot_load[:, None], forbidden)
+    else:
+        detour = [_insertion_costs(c["path"], pickups, drops, dpd) for c in active]
+        cost = [[x + load_penalty_km * ld if x <= max_detour_km else forbidden for x in detour[ci]] for ci, ld in slots]
+    won: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for si, oi in linear_assignment(cost):
+        ci, ld = slots[si]
+        if float(detour[ci][oi]) <= max_detour_km:
+            won[ci].append((ld, oi))
+    out: List[Dict] = []
+    for ci, items in won.items():
+        c = active[ci]
+        for _, oi in sorted(items):
+            o = orders[oi]
+            before = _path_km(c["path"])
+            c["path"] = _insert_order(c["path"], pickups[oi], drops[oi])
+            extra = _path_km(c["path"]) - before
+            out.append({"order_id": o["id"], "courier_id": c["id"], "detour_km": round(extra, 3)})
+    assigned = {a["order_id"] for a in out}
+    return sorted(out, key=lambda a: a["order_id"]), [o["id"] for o in orders if o["id"] not in assigned]
+
+def dispatch_plan() -> Dict:
+    """
+    Diszpécser javaslat a nyitott rendelésekből (get_open_orders): a függő, geokódolt rendelések a friss hellyel
+    rendelkező futárok között (dispatch_assign), a futár terhelése és meglévő útja a nála lévő rendelésekből.
+    """
+    t0 = time.perf_counter()
+    open_orders = db.get_open_orders()
+    groups = db.get_group_locations()
+    located = db.get_courier_locations()
+    loads: Dict[int, List] = defaultdict(list)
+    orders, not_geocoded = [], []
+    for o in open_orders:
+        drop = (o["lat"], o["lon"]) if o.get("lat") is not None and o.get("lon") is not None else None
+        if o["status"] == "pending":
+            if drop: orders.append({"id": o["id"], "pickup": groups.get(o["group_id"]), "drop": drop})
+            else: not_geocoded.append(o["id"])
+        elif o.get("delivery_partner_id") and drop:
+            loads[o["delivery_partner_id"]].append((groups.get(o["group_id"]) if o["status"] == "accepted" else None, drop))
+        elif o.get("delivery_partner_id"):
+            loads[o["delivery_partner_id"]].append(None)  # hely nélkül is terhelés
+    couriers = [{"id": c["user_id"], "position": (c["last_lat"], c["last_lon"]),
+                 "stops": [s for s in loads.get(c["user_id"], []) if s], "load": len(loads.get(c["user_id"], []))} for c in located]
+    names = {c["user_id"]: c.get("first_name") or c.get("username") or str(c["user_id"]) for c in located}
+    assignments, unassigned = dispatch_assign(couriers, orders)
+    for a in assignments:
+        a["courier_name"] = names.get(a["courier_id"])
+    return {"assignments": assignments, "unassigned": unassigned, "not_geocoded": not_geocoded,
+            "orders": len(orders), "couriers": len(couriers), "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+def geocode_order(order_id: int) -> str:
+    """
+    Egy rendelés helyének feloldása és mentése az orders sorra.
+    Ha csak közelítő hely adható (utca / kerület / város szint), szólunk az étterem csoportnak, hogy pontosítsa.
+    """
+    order = db.get_order_by_id(order_id)
+    if not order:
+        return "missing"
+    if order.get("geocode_status") in ("ok", "approx", "not_found"):
+        return order["geocode_status"]  # már feldolgozva (pl. induláskori újra-sorbaállítás)
+    loc = resolve_address(order.get("restaurant_address", ""))
+    db.set_order_geocode(order_id, loc["status"], (loc["lat"], loc["lon"]), loc["tier"])
+    if loc["status"] in ("approx", "not_found"):
+        logger.warning(f"Order #{order_id} address only resolved to {loc['tier']} level: {order.get('restaurant_address')}")
+        try:
+            text = (("⚠️ **A cím nem található pontosan a térképen!**\n\n" if loc["status"] == "approx" else
+                     "❌ **A cím nem található a térképen, útvonalba nem kerül!**\n\n") +
+                    f"📍 {order.get('restaurant_address')}\n"
+                    f"📋 **Rendelés ID:** #{order_id}\n\n"
+                    f"Kérjük pontosítsátok: `/cim {order_id} <helyes cím>`")
+            notification_queue.put({"chat_id": order["group_id"], "text": text})
+        except Exception as e:
+            logger.error(f"Group notify error (geocode): {e}")
+    return loc["status"]
+
+def geocode_worker() -> None:
+    """
+    Háttérszál: a save_order által sorba tett rendeléseket geokódolja.
+    Induláskor a még fel nem dolgozott (vagy hibára futott) rendeléseket is újra sorba teszi.
+    Üresjáratban kiesés esetén próbakérést küld a szolgáltatónak, helyreállás után pedig
+    újra sorba teszi a hibás / elavult koordinátájú rendeléseket.
+    """
+    for oid in db.get_orders_to_geocode():
+        geocode_queue.put(oid)
+    while True:
+        try:
+            order_id = geocode_queue.get(timeout=GEOCODE_BREAKER_COOLDOWN)
+        except Empty:
+            try:
+                if geocoder.degraded():
+                    geocoder.probe()
+                if not geocoder.degraded():
+                    for oid in db.get_orders_to_geocode(("error", "stale")):
+                        geocode_queue.put(oid)
+            except Exception as e:
+                logger.error(f"geocode_worker idle error: {e}")
+            continue
+        try:
+            status = geocode_order(order_id)
+            logger.info(f"Order #{order_id} geocode status: {status}")
+        except Exception as e:
+            logger.error(f"geocode_worker error for order #{order_id}: {e}")
         
+class GeocodeWarmup:
+    """
+    Háttér bemelegítő: az orders tábla különböző címeit (nyitott rendelések, majd gyakoriság szerint)
+    előre feloldja, hogy a csúcsidő első kérései már cache-ből menjenek. A már friss cache bejegyzéssel
+    rendelkező címeket kihagyja, így megszakítás / újraindítás után ott folytatja, ahol abbahagyta.
+    Saját token bucket-tel a szolgáltató keretének csak egy részét használja (upstream kérésenként, nem
+    címenként fogy), kiesés alatt vár.
+    """
+    def __init__(self, service: GeocoderService, share: float = GEOCODE_WARMUP_SHARE) -> None:
+        self.service = service
+        self.limiter = TokenBucket(max(service.provider.rate_limit * share, 0.01), 1)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._status = {"state": "idle", "total": 0, "done": 0, "already_cached": 0, "resolved": 0, "approx": 0, "errors": 0,
+                        "started_at": None, "finished_at": None}
+
+    def start(self) -> bool:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="geocode-warmup")
+            self._thread.start()
+            return True
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _set(self, **kw) -> None:
+        with self._lock:
+            self._status.update(kw)
+
+    def _bump(self, key: str) -> None:
+        with self._lock:
+            self._status[key] += 1; self._status["done"] += 1
+
+    def _cached(self, address: str) -> bool:
+        key = parse_hungarian_address(address)
+        return not key or (self.service.local and self.service.local.lookup(key)) or self.service.cache.get(key, count=False)[0]
+
+    def _run(self) -> None:
+        try:
+            addresses = list({parse_hungarian_address(a): a for a in reversed(db.get_warmup_addresses())}.values())[::-1]
+            self._set(state="running", total=len(addresses), done=0, already_cached=0, resolved=0, approx=0, errors=0,
+                      started_at=time.time(), finished_at=None)
+            logger.info(f"Geocode warm-up started: {len(addresses)} distinct addresses")
+            for address in addresses:
+                if self._stop.is_set():
+                    self._set(state="stopped"); return
+                if self._cached(address):
+                    self._bump("already_cached"); continue
+                while self.service.degraded() and not self._stop.wait(GEOCODE_BREAKER_COOLDOWN):
+                    self._set(state="waiting_upstream")
+                self._set(state="running")
+                loc = resolve_address(address, self.limiter)
+                self._bump("errors" if loc["status"] == "error" else "resolved" if loc["tier"] == "address" else "approx")
+            self._set(state="done", finished_at=time.time())
+            logger.info(f"Geocode warm-up finished: {self.status()}")
+        except Exception as e:
+            logger.error(f"geocode warm-up error: {e}"); self._set(state="failed")
+
+    def status(self) -> Dict:
+        with self._lock:
+            out = dict(self._status)
+        fetched = out["resolved"] + out["approx"] + out["errors"]
+        elapsed = (out["finished_at"] or time.time()) - out["started_at"] if out["started_at"] else 0.0
+        remaining = out["total"] - out["done"]
+        rate = fetched / elapsed if fetched and elapsed else self.limiter.rate
+        out["progress"] = round(out["done"] / out["total"], 3) if out["total"] else 0.0
+        # felső becslés: minden hátralévő címre upstream kérést számol
+        out["eta_seconds"] = round(remaining / rate) if out["state"] in ("running", "waiting_upstream") and rate else 0
+        return out
+
+if not IN_SOLVER_WORKER:
+    geocode_warmup = GeocodeWarmup(geocoder)
+
 # ---------------- Telegram Bot (kept intact) ----------------
 class RestaurantBot:
     def __init__(self) -> None:
@@ -468,10 +3321,14 @@ class RestaurantBot:
         app.add_handler(CommandHandler("start", self.start_cmd))
         app.add_handler(CommandHandler("help", self.help_cmd))
         app.add_handler(CommandHandler("register", self.register_group))
+        app.add_handler(CommandHandler("cim", self.fix_address_cmd))
+        app.add_handler(CommandHandler("etterem", self.set_restaurant_location_cmd))
         app.add_handler(MessageHandler(filters.TEXT & filters.ChatType.GROUPS, self.handle_group_message))
 
         app.add_handler(CommandHandler("route_all", self.route_all))
         app.add_handler(CommandHandler("route", self.route_single))
+        app.add_handler(CommandHandler("javaslat", self.dispatch_cmd))
+        app.add_handler(MessageHandler(filters.LOCATION & filters.ChatType.PRIVATE, self.courier_location))
         app.add_handler(CallbackQueryHandler(self.handle_callback_query))
     
         if app.job_queue:
@@ -520,7 +3377,7 @@ class RestaurantBot:
             kb = InlineKeyboardMarkup([[InlineKeyboardButton("🚚 Elérhető rendelések", web_app=WebAppInfo(url=f"{WEBAPP_URL}"))]])
             await update.message.reply_text(f"Üdv, {user.first_name}!\nNyisd meg a futár felületet:", reply_markup=kb)
         else:
-            await update.message.reply_text("Használd a /register parancsot a csoport regisztrálásához.\nRendelés formátum:\nCím: ...\nTelefonszám: ...\nMegjegyzés: ...")
+            await update.message.reply_text("Használd a /register parancsot a csoport regisztrálásához, az /etterem <cím> paranccsal pedig add meg az étterem címét.\nRendelés formátum:\nCím: ...\nTelefonszám: ...\nMegjegyzés: ...")
 
     async def help_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Rendelés formátum (csoportban):\n```\nCím: Budapest, Példa utca 1.\nTelefonszám: +36301234567\nMegjegyzés: kp / kártya / megjegyzés\n```", parse_mode="Markdown")
@@ -531,6 +3388,42 @@ class RestaurantBot:
         gid = update.effective_chat.id; gname = update.effective_chat.title or "Ismeretlen csoport"
         db.register_group(gid, gname); await update.message.reply_text(f"✅ A '{gname}' csoport regisztrálva.")
 
+    async def fix_address_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        /cim <rendeles_id> <új cím> - a csoport javítja egy fel nem oldható rendelés címét.
+        """
+        if not context.args or len(context.args) < 2:
+            await update.message.reply_text("Használat: /cim <rendeles_id> <helyes cím>"); return
+        try:
+            order_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Az ID-nak számnak kell lennie."); return
+        order = db.get_order_by_id(order_id)
+        if not order or order.get("group_id") != update.effective_chat.id:
+            await update.message.reply_text("❌ Nincs ilyen rendelés ebben a csoportban."); return
+        address = " ".join(context.args[1:]).strip()
+        db.update_order_address(order_id, address)
+        await update.message.reply_text(f"✅ Cím frissítve (#{order_id}): {address}")
+
+    async def set_restaurant_location_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        /etterem <cím> - az étterem (csoport) címe, a futár útvonalában ez a felvételi pont.
+        """
+        if update.effective_chat.type not in ("group","supergroup"):
+            await update.message.reply_text("Ezt a parancsot csoportban használd."); return
+        address = " ".join(context.args or []).strip()
+        if not address:
+            await update.message.reply_text("Használat: /etterem <az étterem címe>"); return
+        loc = await asyncio.get_running_loop().run_in_executor(None, resolve_address, address)
+        if loc["lat"] is None:
+            await update.message.reply_text(f"❌ A cím nem található a térképen, nem mentettem: {address}\nPontosítsd: /etterem <cím>"); return
+        gid = update.effective_chat.id; gname = update.effective_chat.title or "Ismeretlen csoport"
+        db.set_group_location(gid, gname, address, (loc["lat"], loc["lon"]), loc["tier"])
+        if loc["tier"] == "address":
+            await update.message.reply_text(f"✅ Étterem címe mentve: {address}")
+        else:
+            await update.message.reply_text(f"⚠️ Mentve, de a cím csak közelítőleg található ({loc['tier']} szint): {address}\nPontosítsd: /etterem <cím>")
+
     def parse_order_message(self, text: str) -> Dict | None:
         lines = [ln.strip() for ln in (text or "").splitlines() if ln.strip()]
         info = {}
@@ -552,13 +3445,25 @@ class RestaurantBot:
         item = {"restaurant_name": gname, "restaurant_address": parsed["address"], "phone_number": parsed.get("phone",""), "order_details": parsed.get("details",""), "group_id": gid, "group_name": gname, "message_id": update.message.message_id}
         order_id = db.save_order(item)
         await update.message.reply_text("✅ Rendelés rögzítve.\n\n" f"📍 Cím: {item['restaurant_address']}\n" f"📞 Telefon: {item['phone_number'] or '—'}\n" f"📝 Megjegyzés: {item['order_details']}\n" f"ID: #{order_id}")
+        # rövid várakozás a geocode_worker eredményére (a mentett sort figyeljük, nem geokódolunk még egyszer),
+        # hogy a közeli függő rendelések (csomag) már az értesítésben legyenek
+        bundle = None
+        try:
+            deadline = time.monotonic() + ORDER_BUNDLE_NOTIFY_WAIT_S
+            while (db.get_order_by_id(order_id) or {}).get("geocode_status") == "pending" and time.monotonic() < deadline:
+                await asyncio.sleep(ORDER_BUNDLE_NOTIFY_POLL_S)
+            bundle = order_bundles.bundle_of(order_id)
+        except Exception as e:
+            logger.error(f"bundle lookup fail: {e}")
         # küldjünk push értesítést minden regisztrált futárnak
         try:
+            others = [f"#{i}" for i in (bundle or {}).get("order_ids", []) if i != order_id]
             text = ("📣 *ÚJ RENDELÉS!* \n\n"
                     f"📍 {item['restaurant_address']}\n"
                     f"📝 {item['order_details'] or '—'}\n"
-                    f"🆔 #{order_id}\n\n"
-                    "Nyisd meg a futár appot és fogadd el, ha szeretnéd.")
+                    f"🆔 #{order_id}\n"
+                    + (f"📦 Egy úton a közelben: {', '.join(others)}\n" if others else "") +
+                    "\nNyisd meg a futár appot és fogadd el, ha szeretnéd.")
             # sorban rakjuk be az értesítéseket; a bot worker elküldi
             notify_all_couriers_order(order_id, text)
             logger.info(f"Notification queued for order #{order_id}")
@@ -692,23 +3597,54 @@ class RestaurantBot:
 
     async def route_all(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        orders = db.get_orders_by_courier(user_id, status_filter="accepted")
+        orders = [o for o in db.get_partner_route_orders(user_id) if o.get("restaurant_address")]
         if not orders:
             await update.message.reply_text("📭 Nincsenek aktív rendeléseid.")
             return
 
-        addresses = [o["restaurant_address"] for o in orders]
-        # Url-kódolás miatt
-        encoded = [urllib.parse.quote(addr) for addr in addresses]
-        if len(encoded) == 1:
-            maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded[0]}"
-        else:
-            waypoints = "|".join(encoded[:-1])
-            destination = encoded[-1]
-            maps_url = f"https://www.google.com/maps/dir/?api=1&destination={destination}&waypoints={waypoints}&travelmode=driving"
-            
+        # felvétel az éttermekben + kiszállítás egy útvonalban
+        try:
+            route, _stops, _meta = await asyncio.get_running_loop().run_in_executor(None, plan_courier_route, orders)
+        except RouteSolverBusy:
+            await update.message.reply_text("⏳ Sok az útvonal kérés, próbáld újra pár másodperc múlva.")
+            return
+        maps_url = coords_to_google_maps_url(route)
         await update.message.reply_text(f"🗺 Útvonal minden rendeléshez:\n{maps_url}")
 
+    async def courier_location(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Megosztott (élő) hely a privát chatben: a futár utolsó ismert helye a diszpécser javaslatokhoz."""
+        msg = update.effective_message
+        if not msg or not msg.location: return
+        db.set_courier_location(update.effective_user.id, msg.location.latitude, msg.location.longitude)
+        if not msg.edit_date:  # élő hely frissítésére nem válaszolunk
+            await msg.reply_text("📍 Hely mentve. Javasolt rendelések: /javaslat")
+
+    async def dispatch_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        /javaslat - a futárnak javasolt függő rendelések (dispatch_plan) elfogadás gombokkal; adminnak összesítés.
+        """
+        user_id = update.effective_user.id
+        plan = await asyncio.get_running_loop().run_in_executor(None, dispatch_plan)
+        if user_id in ADMIN_USER_IDS:
+            lines = [f"#{a['order_id']} → {a['courier_name']} (+{a['detour_km']:.1f} km)" for a in plan["assignments"]]
+            await update.message.reply_text(
+                f"🧭 Javaslat: {len(plan['assignments'])}/{plan['orders']} rendelés, {plan['couriers']} futár, {plan['elapsed_ms']} ms\n"
+                + ("\n".join(lines[:50]) or "—"))
+            return
+        mine = [a for a in plan["assignments"] if a["courier_id"] == user_id]
+        if not mine:
+            await update.message.reply_text("Most nincs javasolt rendelés. Ha még nem tetted, oszd meg a helyed (📎 → Hely).")
+            return
+        for a in mine:
+            order = db.get_order_by_id(a["order_id"])
+            if not order: continue
+            kb = InlineKeyboardMarkup([[InlineKeyboardButton("⏱️ 10 perc", callback_data=f"accept_{order['id']}_10"),
+                                        InlineKeyboardButton("⏱️ 20 perc", callback_data=f"accept_{order['id']}_20"),
+                                        InlineKeyboardButton("⏱️ 30 perc", callback_data=f"accept_{order['id']}_30")]])
+            await update.message.reply_text(
+                f"🧭 Javasolt rendelés (+{a['detour_km']:.1f} km az utadhoz)\n📍 {order['restaurant_address']}\n🏪 {order.get('group_name') or ''}\n🆔 #{order['id']}",
+                reply_markup=kb)
+
     async def route_single(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not context.args or len(context.args) < 1:
             await update.message.reply_text("Használat: /route <rendeles_id>")
@@ -774,45 +3710,150 @@ def api_get_coordinates():
         if not order_id: return jsonify({"ok": False, "error": "missing_order_id"}), 400
         order = db.get_order_by_id(order_id)
         if not order: return jsonify({"ok": False, "error": "order_not_found"}), 404
-        coord = geocode_address(order.get("restaurant_address",""))
-        if not coord: return jsonify({"ok": False, "error": "geocode_failed"}), 500
-        lat, lon = coord
-        return jsonify({"ok": True, "lat": lat, "lon": lon})
+        loc = resolve_orders([order])[0]
+        if loc["lat"] is None: return jsonify({"ok": False, "error": "location_not_found", "tier": loc["tier"]}), 404
+        return jsonify({"ok": True, "lat": loc["lat"], "lon": loc["lon"], "tier": loc["tier"], "confidence": loc["confidence"], "degraded": geocoder.degraded()})
     except Exception as e:
         logger.error(f"api_get_coordinates error: {e}"); return jsonify({"ok": False, "error": str(e)}), 500
 
+def route_payload(optimized: List[Tuple[str,float,float]], stops: List[Dict], solver: Dict,
+                  start_coord: Optional[Tuple[str,float,float]] = None, end_coord: Optional[Tuple[str,float,float]] = None) -> Dict:
+    """
+    Az /api/optimize_route válasz útvonal része (RouteCache ezt tárolja): pontok, megálló leírások, térkép linkek.
+    """
+    # ensure optimized contains coords_only in string form for client
+    coords_list = [f"{lat},{lon}" for (_addr, lat, lon) in optimized]
+    # a start / end pontnak nincs megálló leírása
+    described = iter(stops)
+    coords_objects = []
+    for i, (_addr, lat, lon) in enumerate(optimized):
+        obj = {"address": _addr, "lat": lat, "lon": lon, "confidence": 1.0}
+        if not (start_coord and i == 0) and not (end_coord and i == len(optimized) - 1):
+            stop = next(described)
+            obj.update(kind=stop["kind"], order_ids=stop["order_ids"], confidence=stop["confidence"])
+        coords_objects.append(obj)
+    return {"addresses": coords_list, "coords": coords_objects, "google_url": coords_to_google_maps_url(optimized),
+            "apple_url": coords_to_apple_maps_url(optimized), "waze_url": coords_to_waze_url(optimized),
+            "count": len(coords_list), "solver": solver}
+
+def _route_request(data: Dict) -> Tuple[Optional[Tuple[str,float,float]], Optional[Tuple[str,float,float]], float]:
+    """Útvonal kérés paraméterei (start, end, time_budget_ms); hibás time_budget_ms -> ValueError."""
+    # parse provided current position (optional) - prefer explicit start
+    start_coord = None
+    try:
+        if data.get("current_lat") is not None and data.get("current_lon") is not None:
+            start_coord = ("CURRENT_LOCATION", float(data.get("current_lat")), float(data.get("current_lon")))
+    except Exception:
+        start_coord = None
+    end_coord = None
+    try:
+        if data.get("end_lat") is not None and data.get("end_lon") is not None:
+            end_coord = ("END_LOCATION", float(data.get("end_lat")), float(data.get("end_lon")))
+    except Exception:
+        end_coord = None
+    try:
+        time_budget_ms = float(data.get("time_budget_ms", ROUTE_TIME_BUDGET_MS))
+    except (TypeError, ValueError):
+        raise ValueError("invalid time_budget_ms")
+    return start_coord, end_coord, time_budget_ms
+
+def courier_route(rows: List[Dict], cache_key: tuple, start_coord=None, end_coord=None,
+                  time_budget_ms: float = ROUTE_TIME_BUDGET_MS, stamp: Optional[Tuple[int, float]] = None) -> Tuple[Dict, bool]:
+    """
+    Futár útvonal payload (route_payload) a RouteCache-ből vagy kiszámolva; visszatér: (payload, cached).
+    stamp: route_cache.stamp() a rows beolvasása előtt; ha közben változott egy rendelés, az eredmény nem kerül a cache-be.
+    """
+    # ugyanarra a rendelés halmazra és ~ugyanonnan induló ismételt kérés: kész útvonal a cache-ből
+    payload = route_cache.get(cache_key)
+    if payload is not None:
+        return payload, True
+    optimized, stops, solver = plan_courier_route(rows, start_coord=start_coord, time_budget_ms=time_budget_ms, end_coord=end_coord)
+    payload = route_payload(optimized, stops, solver, start_coord=start_coord, end_coord=end_coord)
+    route_cache.put(cache_key, payload, stamp)
+    return payload, False
+
+def _route_response(payload: Dict, cached: bool, **extra) -> Dict:
+    # rövid link csak cache-ből; ha még nincs, a teljes URL megy, a rövidítés háttérben készül
+    short = {"google": short_urls.get(payload["google_url"]), "apple": short_urls.get(payload["apple_url"])}
+    return dict(payload, ok=True, short_urls=short, cached=cached, degraded=geocoder.degraded(), **extra)
+
 @app.route("/api/optimize_route", methods=["POST"])
 def api_optimize_route():
     """
-    Optimizes route for orders assigned to the courier (status='picked_up').
+    Optimizes route for orders assigned to the courier: picked-up orders are delivered, accepted ones are
+    picked up at their restaurant (group location) first - one combined pickup-and-delivery route.
     Accepts optional 'current_lat' and 'current_lon' in the request body — if present, they are used as the start point.
+    Optional 'time_budget_ms': solver time budget (latency vs. route quality), capped at ROUTE_TIME_BUDGET_MAX_MS.
+    Optional 'end_lat' and 'end_lon': fixed last stop (e.g. back to the restaurant); otherwise the route ends at the last delivery.
     Returns coordinate-only list and prebuilt Google Maps URL.
+    For long routes prefer /api/route_jobs (same body, returns a job id at once).
     """
     try:
         data = request.json or {}
         user = validate_telegram_data(data.get("initData", ""))
         if not user: return jsonify({"ok": False, "error": "unauthorized"}), 401
-        rows = db.get_partner_addresses(partner_id=user["id"], status="picked_up")
-        addresses = [r["restaurant_address"] for r in rows if r.get("restaurant_address")]
-        if not addresses: return jsonify({"ok": False, "error": "no_addresses"}), 400
-        # parse provided current position (optional) - prefer explicit start
-        start_coord = None
+        stamp = route_cache.stamp()
+        rows = [r for r in db.get_partner_route_orders(user["id"]) if r.get("restaurant_address")]
+        if not rows: return jsonify({"ok": False, "error": "no_addresses"}), 400
         try:
-            if data.get("current_lat") is not None and data.get("current_lon") is not None:
-                start_coord = ("CURRENT_LOCATION", float(data.get("current_lat")), float(data.get("current_lon")))
-        except Exception:
-            start_coord = None
-        optimized = optimize_route(addresses, start_coord=start_coord)
-        # ensure optimized contains coords_only in string form for client
-        coords_list = [f"{lat},{lon}" for (_addr, lat, lon) in optimized]
-        coords_objects = [{"address": _addr, "lat": lat, "lon": lon} for (_addr, lat, lon) in optimized]
-        google_url = coords_to_google_maps_url(optimized)
-        apple_url = coords_to_apple_maps_url(optimized)
-        waze_url = coords_to_waze_url(optimized)
-        return jsonify({"ok": True, "addresses": coords_list, "coords": coords_objects, "google_url": google_url, "apple_url": apple_url, "waze_url": waze_url, "count": len(coords_list)})
+            start_coord, end_coord, time_budget_ms = _route_request(data)
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        if start_coord: db.set_courier_location(user["id"], start_coord[1], start_coord[2])
+        cache_key = route_cache.key([r["id"] for r in rows], start_coord, end_coord)
+        payload, cached = courier_route(rows, cache_key, start_coord, end_coord, time_budget_ms, stamp)
+        return jsonify(_route_response(payload, cached))
+    except RouteSolverBusy:
+        return jsonify({"ok": False, "error": "busy"}), 503
     except Exception as e:
         logger.error(f"api_optimize_route error: {e}"); return jsonify({"ok": False, "error": str(e)}), 500
 
+@app.route("/api/route_jobs", methods=["POST"])
+def api_route_job_submit():
+    """
+    Async /api/optimize_route: same body, returns {job_id, status} immediately (202), the route is computed
+    in the background. Resubmitting the same request while it runs returns the same job_id.
+    Result: GET /api/route_jobs/<job_id>?init_data=...&wait=<s> (long-poll up to ROUTE_JOB_MAX_WAIT_S).
+    """
+    try:
+        data = request.json or {}
+        user = validate_telegram_data(data.get("initData", ""))
+        if not user: return jsonify({"ok": False, "error": "unauthorized"}), 401
+        stamp = route_cache.stamp()
+        rows = [r for r in db.get_partner_route_orders(user["id"]) if r.get("restaurant_address")]
+        if not rows: return jsonify({"ok": False, "error": "no_addresses"}), 400
+        try:
+            start_coord, end_coord, time_budget_ms = _route_request(data)
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        if start_coord: db.set_courier_location(user["id"], start_coord[1], start_coord[2])
+        cache_key = route_cache.key([r["id"] for r in rows], start_coord, end_coord)
+        job = route_jobs.submit(user["id"], cache_key, lambda: courier_route(rows, cache_key, start_coord, end_coord, time_budget_ms, stamp))
+        return jsonify({"ok": True, "job_id": job["job_id"], "status": job["status"]}), 202
+    except Exception as e:
+        logger.error(f"api_route_job_submit error: {e}"); return jsonify({"ok": False, "error": str(e)}), 500
+
+@app.route("/api/route_jobs/<job_id>", methods=["GET"])
+def api_route_job_status(job_id):
+    """Route job status; with 'wait' (seconds) the request blocks until the job finishes or the wait expires."""
+    try:
+        user = validate_telegram_data(request.args.get("init_data", ""))
+        if not user: return jsonify({"ok": False, "error": "unauthorized"}), 401
+        try:
+            wait = min(max(float(request.args.get("wait", 0)), 0.0), ROUTE_JOB_MAX_WAIT_S)
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "invalid wait"}), 400
+        job = route_jobs.wait(job_id, user["id"], wait)
+        if not job: return jsonify({"ok": False, "error": "not_found"}), 404
+        if job["status"] == "error":
+            return jsonify({"ok": False, "job_id": job_id, "status": "error", "error": job["error"]}), job["code"]
+        if job["status"] != "done":
+            return jsonify({"ok": True, "job_id": job_id, "status": job["status"], "age_ms": job["age_ms"]})
+        payload, cached = job["result"]
+        return jsonify(_route_response(payload, cached, job_id=job_id, status="done", age_ms=job["age_ms"]))
+    except Exception as e:
+        logger.error(f"api_route_job_status error: {e}"); return jsonify({"ok": False, "error": str(e)}), 500
+
 HTML_TEMPLATE = r"""
 <!doctype html>
 <html lang="hu">
@@ -1086,7 +4127,8 @@ async function wazeLink(orderId){
         <div>📍 <b>Cím:</b> ${order.restaurant_address}</div>
         ${order.phone_number ? `<div>📞 <b>Telefon:</b> ${order.phone_number}</div>` : ''}
         ${order.order_details ? `<div>📝 <b>Megjegyzés:</b> ${order.order_details}</div>` : ''}
-        <div class="muted">ID: #${order.id} • ${order.created_at}</div>
+        <div class="muted">ID: #${order.id} • ${order.created_at}${order.distance_km != null ? ` • 📏 ${order.distance_km.toFixed(1)} km` : ''}</div>
+        ${(order.bundle_order_ids || []).length > 1 ? `<div>📦 <b>Egy úton:</b> ${order.bundle_order_ids.filter(i => i !== order.id).map(i => '#' + i).join(', ')}</div>` : ''}
         ${nav}
         ${timeBtns}
         ${showBtn ? `<button class="accept-btn" id="btn-${order.id}" onclick="doAction(${order.id}, '${order.status}')">${btnLabel}</button>` : ''}
@@ -1130,6 +4172,17 @@ async function wazeLink(orderId){
     });
   }
 
+  function currentPosition(){
+    return new Promise(resolve => {
+      if(!navigator.geolocation) return resolve(null);
+      navigator.geolocation.getCurrentPosition(
+        p => resolve({ lat: p.coords.latitude, lon: p.coords.longitude }),
+        () => resolve(null),
+        { timeout: 3000, maximumAge: 60000 }
+      );
+    });
+  }
+
   async function load(){
     // tab aktív állapot
     document.getElementById('tab-av').classList.toggle('active', TAB==='available');
@@ -1149,6 +4202,22 @@ async function wazeLink(orderId){
         const r = await fetch(`${API}/api/orders_by_status?status=pending`);
         if (!r.ok) throw new Error(`HTTP ${r.status}: ${r.statusText}`);
         data = await r.json();
+        // ha ismert a futár helye: a legközelebbi rendelések elöl (a még nem geokódoltak a lista végén)
+        const pos = await currentPosition();
+        if(pos){
+          const n = await fetch(`${API}/api/orders_near`, {
+            method:'POST',
+            headers:{'Content-Type':'application/json'},
+            body: JSON.stringify({ initData: tg?.initData || '', lat: pos.lat, lon: pos.lon, radius_km: 50 })
+          });
+          const nj = n.ok ? await n.json() : {};
+          if(nj.ok){
+            const ids = new Set(data.map(o => o.id));
+            const near = (nj.orders || []).filter(o => ids.has(o.id));
+            const seen = new Set(near.map(o => o.id));
+            data = near.concat(data.filter(o => !seen.has(o.id)));
+          }
+        }
       }else{
         const r = await fetch(`${API}/api/my_orders`, {
           method:'POST', 
@@ -1250,15 +4319,22 @@ async function wazeLink(orderId){
   // Útvonal optimalizáló függvény
     async function openOptimizedRoute(mapType = 'google'){
       try{
-        const r = await fetch(`${API}/api/optimize_route`, {
+        // feladat beküldése, majd long-poll amíg kész (nem tartja nyitva a kérést a teljes számítás alatt)
+        const s = await fetch(`${API}/api/route_jobs`, {
           method:'POST',
           headers:{'Content-Type':'application/json'},
           body: JSON.stringify({ initData: tg?.initData || '' })
         });
-
-        if (!r.ok) throw new Error(`HTTP ${r.status}: ${r.statusText}`);
-        const j = await r.json();
-        if(!j.ok) throw new Error(j.error||'Hálózati hiba');
+        const sj = await s.json();
+        if(!sj.ok) throw new Error(sj.error||`HTTP ${s.status}: ${s.statusText}`);
+        let j = null;
+        for(let i = 0; i < 10; i++){
+          const r = await fetch(`${API}/api/route_jobs/${encodeURIComponent(sj.job_id)}?wait=20&init_data=${encodeURIComponent(tg?.initData || '')}`);
+          j = await r.json();
+          if(!j.ok) throw new Error(j.error === 'busy' ? 'Sok az útvonal kérés, próbáld újra' : (j.error||`HTTP ${r.status}: ${r.statusText}`));
+          if(j.status === 'done') break;
+        }
+        if(!j || j.status !== 'done') throw new Error('Az útvonaltervezés túl sokáig tart');
 
         // Use coords array from server (objects with {address, lat, lon})
         const coords = j.coords || [];
@@ -2103,6 +5179,12 @@ def api_orders_by_status():
         if status == "pending":
             cur.execute("SELECT id, restaurant_name, restaurant_address, phone_number, order_details, group_id, group_name, created_at, status FROM orders WHERE status='pending' AND DATE(created_at) = DATE('now', 'localtime') ORDER BY created_at DESC")
             rows = [dict(r) for r in cur.fetchall()]
+            # közeli, egy útba vihető rendelések (OrderBundler)
+            bundles = order_bundles.by_order()
+            for r in rows:
+                b = bundles.get(r["id"])
+                r["bundle_id"] = b["bundle_id"] if b else None
+                r["bundle_order_ids"] = b["order_ids"] if b else []
         elif status in ("accepted","picked_up","delivered"):
             if not courier_id: conn.close(); return jsonify({"ok": False, "error": "missing_courier"}), 400
             cur.execute("SELECT id, restaurant_name, restaurant_address, phone_number, order_details, group_id, group_name, created_at, status, estimated_time FROM orders WHERE status=? AND delivery_partner_id=? ORDER BY created_at DESC", (status, courier_id))
@@ -2113,6 +5195,45 @@ def api_orders_by_status():
     except Exception as e:
         logger.error(f"api_orders_by_status error: {e}"); return jsonify([]), 500
 
+@app.route("/api/orders_near", methods=["POST"])
+def api_orders_near():
+    """
+    Pending orders near the courier, nearest first (PendingOrderIndex).
+    Body: initData, lat, lon, optional radius_km (default ORDER_NEAR_RADIUS_KM) and/or k (k nearest within the radius).
+    """
+    try:
+        data = request.json or {}
+        user = validate_telegram_data(data.get("initData", ""))
+        if not user: return jsonify({"ok": False, "error": "unauthorized"}), 401
+        try:
+            lat, lon = float(data["lat"]), float(data["lon"])
+            radius_km = float(ORDER_NEAR_RADIUS_KM if data.get("radius_km") is None else data["radius_km"])
+            k = None if data.get("k") is None else int(data["k"])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"ok": False, "error": "invalid position"}), 400
+        if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+            return jsonify({"ok": False, "error": "invalid position"}), 400
+        if not (math.isfinite(radius_km) and radius_km > 0):
+            return jsonify({"ok": False, "error": "invalid radius_km"}), 400
+        if k is not None and k < 1:
+            return jsonify({"ok": False, "error": "invalid k"}), 400
+        radius_km = min(radius_km, ORDER_NEAR_MAX_RADIUS_KM)
+        db.set_courier_location(user["id"], lat, lon)
+        t0 = time.perf_counter()
+        hits = pending_index.nearest(lat, lon, k, max_km=radius_km) if k else pending_index.within(lat, lon, radius_km)
+        query_ms = round((time.perf_counter() - t0) * 1000, 3)
+        rows = db.get_orders_by_ids([i for i, _ in hits])
+        bundles = order_bundles.by_order()
+        orders = []
+        for oid, km in hits:
+            r = rows.get(oid)
+            if not r or r["status"] != "pending": continue
+            b = bundles.get(oid)
+            orders.append(dict(r, distance_km=round(km, 3), bundle_id=b["bundle_id"] if b else None, bundle_order_ids=b["order_ids"] if b else []))
+        return jsonify({"ok": True, "orders": orders, "radius_km": radius_km, "query_ms": query_ms})
+    except Exception as e:
+        logger.error(f"api_orders_near error: {e}"); return jsonify({"ok": False, "error": str(e)}), 500
+
 @app.route("/api/my_orders", methods=["POST"])
 def api_my_orders():
     try:
@@ -2172,6 +5293,46 @@ def api_is_admin():
     except Exception as e:
         logger.error(f"api_is_admin error: {e}"); return jsonify({"ok": False, "admin": False}), 500
 
+@app.route("/admin/geocode_stats")
+def admin_geocode_stats():
+    user = validate_telegram_data(request.args.get('init_data', ''))
+    if not user or user.get("id") not in ADMIN_USER_IDS: return jsonify({"ok": False, "error": "forbidden"}), 403
+    try:
+        return jsonify({"ok": True, "cache": geocode_cache.stats(), "geocoder": geocoder.stats(), "warmup": geocode_warmup.status(), "http": http_client.stats(), "short_urls": short_urls.stats(), "route_cache": route_cache.stats(),
+                        "road_network": road_network.stats() if road_network else None, "pair_costs": pair_costs.stats(),
+                        "route_pool": route_pool.stats(), "route_jobs": route_jobs.stats(),
+                        "order_bundles": order_bundles.stats(),
+                        "pending_index": pending_index.stats()})
+    except Exception as e:
+        logger.error(f"admin_geocode_stats error: {e}"); return jsonify({"ok": False, "error": str(e)}), 500
+
+@app.route("/admin/dispatch")
+def admin_dispatch():
+    """Suggested assignment of pending orders to couriers with a recent location (dispatch_plan)."""
+    user = validate_telegram_data(request.args.get('init_data', ''))
+    if not user or user.get("id") not in ADMIN_USER_IDS: return jsonify({"ok": False, "error": "forbidden"}), 403
+    try:
+        return jsonify(dict(dispatch_plan(), ok=True))
+    except Exception as e:
+        logger.error(f"admin_dispatch error: {e}"); return jsonify({"ok": False, "error": str(e)}), 500
+
+@app.route("/admin/geocode_warmup", methods=["GET", "POST"])
+def admin_geocode_warmup():
+    """
+    GET: bemelegítés állapota (progress, ETA). POST {"action": "start" | "stop"}: indítás / leállítás.
+    """
+    user = validate_telegram_data(request.args.get('init_data', ''))
+    if not user or user.get("id") not in ADMIN_USER_IDS: return jsonify({"ok": False, "error": "forbidden"}), 403
+    try:
+        if request.method == "POST":
+            action = (request.json or {}).get("action", "start")
+            if action == "stop": geocode_warmup.stop()
+            elif action == "start": geocode_warmup.start()
+            else: return jsonify({"ok": False, "error": "bad_action"}), 400
+        return jsonify({"ok": True, "warmup": geocode_warmup.status()})
+    except Exception as e:
+        logger.error(f"admin_geocode_warmup error: {e}"); return jsonify({"ok": False, "error": str(e)}), 500
+
 @app.route("/admin/export_excel")
 def admin_export_excel():
 
@@ -2296,6 +5457,10 @@ def run_flask():
 if __name__ == "__main__":
     # start flask in background thread and start bot polling (if available)
     threading.Thread(target=run_flask, daemon=True).start()
+    threading.Thread(target=geocode_worker, daemon=True).start()
+    threading.Thread(target=short_urls.worker, daemon=True).start()
+    route_pool.start()
+    geocode_warmup.start()
     if TELEGRAM_AVAILABLE:
         RestaurantBot().run()
     else:
@@ -0,0 +1,13 @@
+# file: tests/conftest.py
+"""
+Közös pytest beállítás: az opd3_fixed import a munkakönyvtárban hozza létre a DB-t,
+ezért egy ideiglenes könyvtárból importáljuk (mint a benchmarks.py).
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "fixtures")
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="opd_test_"))
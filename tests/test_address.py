@@ -0,0 +1,152 @@
+# file: tests/test_address.py
+import os
+
+import pytest
+
+import opd3_fixed as opd
+from conftest import FIXTURES
+
+@pytest.mark.parametrize("address, expected", [
+    ("1061 Budapest, Andrássy út 5. 2/3", ("andrássy út", 5)),
+    ("király utca 10, 2. em. 5, budapest", ("király utca", 10)),
+    ("andrássy út 5, fsz. 1, 1061 budapest", ("andrássy út", 5)),
+    ("dob utca 20, iii. em. 2", ("dob utca", 20)),
+    ("Budapest, Kossuth tér 1", ("kossuth tér", 1)),
+    ("Váci 12", ("váci", 12)),
+])
+def test_split_street_house(address, expected):
+    assert opd.split_street_house(address) == expected
+    assert opd.split_street_house(opd.parse_hungarian_address(address)) == expected
+
+def test_local_geocoder_apartment_addresses(tmp_path):
+    index = str(tmp_path / "sample.idx")
+    opd.LocalGeocoder.build_index(os.path.join(FIXTURES, "budapest_addresses_sample.csv"), index)
+    geocoder = opd.LocalGeocoder(index)
+    plain = geocoder.lookup("Király utca 10, Budapest")
+    assert plain is not None
+    assert geocoder.lookup("király utca 10, 2. em. 5, budapest") == plain
+    assert geocoder.lookup("Andrássy út 5, fsz. 1, 1061 Budapest") == geocoder.lookup("Andrássy út 5")
+
+def test_local_geocoder_same_street_in_different_localities(tmp_path):
+    csv_path, index = tmp_path / "fo.csv", str(tmp_path / "fo.idx")
+    csv_path.write_text("street,housenumber,postcode,city,lat,lon\n"
+                        "Fő utca,5,1011,Budapest,47.5040,19.0390\n"
+                        "Fő utca,5,2000,Szentendre,47.6690,19.0750\n"
+                        "Fő utca,5,1221,Budapest,47.4270,19.0350\n"
+                        "Fő utca,7,1221,Budapest,47.4272,19.0352\n", encoding="utf-8")
+    opd.LocalGeocoder.build_index(str(csv_path), index)
+    geocoder = opd.LocalGeocoder(index)
+    assert geocoder.lookup(opd.parse_hungarian_address("Fő utca 5, 1011 Budapest")) == pytest.approx((47.504, 19.039), abs=1e-5)
+    assert geocoder.lookup(opd.parse_hungarian_address("2000 Szentendre, Fő utca 5")) == pytest.approx((47.669, 19.075), abs=1e-5)
+    assert geocoder.lookup(opd.parse_hungarian_address("Szentendre, Fő utca 5")) == pytest.approx((47.669, 19.075), abs=1e-5)
+    assert geocoder.lookup(opd.parse_hungarian_address("Budapest XXII. ker. Fő u. 5")) == pytest.approx((47.427, 19.035), abs=1e-5)
+    assert geocoder.lookup(opd.parse_hungarian_address("Budapest XXII. ker. Fő u. 9")) == pytest.approx((47.4272, 19.0352), abs=1e-5)
+    # település nélkül vagy csak "Budapest"-tel kétértelmű: nincs helyi találat, a cache / szolgáltató dönt
+    assert geocoder.lookup(opd.parse_hungarian_address("Fő u. 5")) is None
+    assert geocoder.lookup(opd.parse_hungarian_address("Budapest, Fő utca 5")) is None
+    assert geocoder.lookup(opd.parse_hungarian_address("2040 Budaörs, Fő utca 5")) is None
+    assert geocoder.counters["ambiguous"] == 2
+    geocoder.close()
+
+def test_local_geocoder_drops_conflicting_duplicates(tmp_path):
+    csv_path, index = tmp_path / "dup.csv", str(tmp_path / "dup.idx")
+    csv_path.write_text("street,housenumber,postcode,lat,lon\n"
+                        "Dob utca,1,1074,47.4970,19.0600\n"
+                        "Dob utca,1,1074,47.5100,19.0900\n", encoding="utf-8")
+    assert opd.LocalGeocoder.build_index(str(csv_path), index) == 0
+
+@pytest.mark.parametrize("address, expected", [
+    ("1061 Budapest, VI. ker. Andrássy u. 5.", "andrássy utca 5, vi. kerület, 1061 budapest"),
+    ("Kálvin tér 5 pl. kapucsengő", "kálvin tér 5 pl. kapucsengő"),
+    ("Keleti pu.", "keleti pályaudvar"),
+    ("Teréz krt. 3, Budapest", "teréz körút 3, budapest"),
+    ("1075 Király u. 8", "király utca 8, 1075 budapest"),
+    ("Budapest 1075 Király u 8", "király utca 8, 1075 budapest"),
+    ("1075 Budapest, Király u. 8", "király utca 8, 1075 budapest"),
+    ("1061 Bp., Andrássy út 5", "andrássy út 5, 1061 budapest"),
+    ("2040 Budaörs Szabadság út 5", "szabadság út 5, 2040 budaörs"),
+    ("2000 Szentendre, Fő utca 5", "fő utca 5, 2000 szentendre"),
+    ("Váci út 1200", "váci út 1200"),
+    ("Bp. XI. Bartók Béla út 5", "bartók béla út 5, xi. kerület, budapest"),
+    ("XI., Bartók Béla út 5", "bartók béla út 5, xi. kerület, budapest"),
+    ("II. Rákóczi Ferenc út 10, 1211 Budapest", "ii. rákóczi ferenc út 10, 1211 budapest"),
+    ("Fő utca 5, II. em. 3", "fő utca 5, ii. em. 3"),
+])
+def test_parse_hungarian_address(address, expected):
+    assert opd.parse_hungarian_address(address) == expected
+
+def test_postcode_before_street_keeps_street_in_key():
+    assert opd.parse_hungarian_address("1075 Király u. 8") != opd.parse_hungarian_address("1075 Dob u. 8")
+    assert opd.split_street_house(opd.parse_hungarian_address("1075 Király u. 8")) == ("király utca", 8)
+
+@pytest.mark.parametrize("address, expected", [
+    ("Budapest, Király utca 10, 2. em. 5", "király utca, budapest"),
+    ("2040 Budaörs, Szabadság út 5", "szabadság út, 2040 budaörs"),
+    ("Budapest, Kossuth 5, 2. em 3", None),
+    ("VII. kerület, Wesselényi 3", None),
+])
+def test_street_query_needs_street_type(address, expected):
+    assert opd._street_query(opd.parse_hungarian_address(address)) == expected
+
+@pytest.mark.parametrize("address, tier", [
+    ("1075 Budapest, Király utca 12", "postcode"),
+    ("VII. kerület, Wesselényi 3", "district"),
+    ("2040 Budaörs, Szabadság út 5", "none"),
+    ("Rákóczi 5, Budapest", "none"),
+])
+def test_table_location_has_no_city_fallback(address, tier):
+    found, coord = opd._table_location(opd.parse_hungarian_address(address))
+    assert found == tier
+    assert (coord is None) == (tier == "none")
+
+def test_unplaceable_order_stays_out_of_route():
+    loc = opd.resolve_orders([{"restaurant_address": "2040 budaörs", "geocode_status": "not_found"}])[0]
+    assert (loc["lat"], loc["lon"], loc["confidence"]) == (None, None, 0.0)
+
+class _StreetOnlyProvider(opd.GeocodeProvider):
+    name = "test"
+    rate_limit = 1000.0
+
+    def _search(self, query):
+        return None if any(c.isdigit() for c in query.split(",")[0]) else (47.5, 19.07)
+
+class _CountingBucket(opd.TokenBucket):
+    def __init__(self):
+        super().__init__(1000.0, 10)
+        self.charged = 0
+
+    def acquire(self):
+        self.charged += 1
+        super().acquire()
+
+def test_warmup_budget_charged_per_upstream_request(tmp_path, monkeypatch):
+    service = opd.GeocoderService(opd.GeocodeCache(str(tmp_path / "cache.db")), _StreetOnlyProvider())
+    monkeypatch.setattr(opd, "geocoder", service)
+    budget = _CountingBucket()
+    loc = opd.resolve_address("Budapest, Király utca 99", budget)
+    assert loc["tier"] == "street"
+    assert budget.charged == service.provider.counters["requests"] == 2
+    opd.resolve_address("Budapest, Király utca 99", budget)
+    assert budget.charged == 2
+
+def test_geocode_provider_does_not_retry_behind_the_rate_limiter():
+    server = opd.GeocodeStandinServer(os.path.join(FIXTURES, "nominatim_recordings.json"))
+    try:
+        for url in (opd.NOMINATIM_URL, opd.StandinProvider(server).url):
+            session = opd.http_client._host(opd.urllib.parse.urlsplit(url).netloc)["session"]
+            assert session.get_adapter(url).max_retries.total == 0
+    finally:
+        server.httpd.server_close()
+
+def test_breaker_probe_slot_taken_after_rate_limit(tmp_path):
+    service = opd.GeocoderService(opd.GeocodeCache(str(tmp_path / "cache.db")), _StreetOnlyProvider())
+    service.breaker = opd.CircuitBreaker(threshold=1, cooldown=0)
+    service.breaker.record_failure()
+    service.limiter = opd.TokenBucket(2.0, 1)
+    service.limiter.acquire()  # a következő token ~0.5 mp múlva
+    waiter = opd.threading.Thread(target=service.lookup, args=("Király utca, Budapest",))
+    waiter.start()
+    opd.time.sleep(0.2)
+    assert service.breaker.state == "open"  # a rate limitre váró kérés még nem foglalta le a próbahelyet
+    waiter.join()
+    assert service.breaker.state == "closed"
@@ -0,0 +1,33 @@
+# file: tests/test_api.py
+import pytest
+
+import opd3_fixed as opd
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(opd, "validate_telegram_data", lambda s: {"id": 5} if s else None)
+    return opd.app.test_client()
+
+@pytest.mark.parametrize("body", [
+    {"lat": 47.5, "lon": 19.04, "radius_km": 0},
+    {"lat": 47.5, "lon": 19.04, "radius_km": -1},
+    {"lat": 47.5, "lon": 19.04, "radius_km": "nan"},
+    {"lat": "nan", "lon": 19.04},
+    {"lat": 47.5, "lon": "inf"},
+    {"lat": 95, "lon": 19.04},
+    {"lat": 47.5, "lon": 19.04, "k": 0},
+    {"lat": 47.5},
+])
+def test_orders_near_rejects_bad_input(client, body):
+    res = client.post("/api/orders_near", json=dict(body, initData="x"))
+    assert res.status_code == 400
+    assert res.json["ok"] is False
+
+def test_orders_near_nearest_first(client):
+    ids = []
+    for i, coord in enumerate([(47.51, 19.05), (47.5, 19.04), (47.9, 19.5)]):
+        oid = opd.db.save_order({"restaurant_address": f"Budapest, Fő utca {i + 1}", "group_id": -1, "message_id": i, "order_details": ""})
+        opd.db.set_order_geocode(oid, "ok", coord, "address"); ids.append(oid)
+    res = client.post("/api/orders_near", json={"initData": "x", "lat": 47.5, "lon": 19.04, "radius_km": 5})
+    assert res.status_code == 200
+    assert [o["id"] for o in res.json["orders"] if o["id"] in ids] == [ids[1], ids[0]]
@@ -0,0 +1,177 @@
+# file: tests/test_routing.py
+import itertools
+import random
+
+import pytest
+
+import opd3_fixed as opd
+
+def _instance(seed, n):
+    rnd = random.Random(seed)
+    pts = [(rnd.random(), rnd.random()) for _ in range(n)]
+    return rnd, [[((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5 for b in pts] for a in pts]
+
+def _closed_length(tour, d):
+    return sum(d[tour[i]][tour[(i + 1) % len(tour)]] for i in range(len(tour)))
+
+def test_local_search_against_brute_force():
+    misses = 0
+    for seed in range(100):
+        rnd, d = _instance(seed, 4 + seed % 5)
+        n = len(d)
+        tour = list(range(n)); rnd.shuffle(tour)
+        start_len = _closed_length(tour, d)
+        res = opd.local_search(list(tour), d, opd.nearest_neighbors(d, n - 1))
+        assert sorted(res) == list(range(n))
+        best = min(_closed_length((0,) + p, d) for p in itertools.permutations(range(1, n)))
+        assert best - 1e-9 <= _closed_length(res, d) <= start_len + 1e-9
+        # 2-opt lokális optimum: egyetlen élcsere sem rövidít
+        for i in range(n):
+            for j in range(i + 2, n - (i == 0)):
+                a, b, c, e = res[i], res[i + 1], res[j], res[(j + 1) % n]
+                assert d[a][c] + d[b][e] >= d[a][b] + d[c][e] - 1e-9
+        misses += _closed_length(res, d) > best + 1e-9
+    assert misses <= 5
+
+def test_pair_cost_cache_hits_across_chunks():
+    keys = [f"cím {i}" for i in range(1200)]
+    coord = {k: (47.0 + i * 1e-4, 19.0) for i, k in enumerate(keys)}
+    pairs = [(keys[i], keys[-1 - i]) for i in range(600)]
+    opd.PairCostCache().put_many("test", {(a, b): (float(i), coord[a], coord[b]) for i, (a, b) in enumerate(pairs)})
+    cache = opd.PairCostCache(lru_size=1)
+    found = cache.get_many("test", {(a, b): (coord[a], coord[b]) for a, b in pairs})
+    assert found == {(a, b): float(i) for i, (a, b) in enumerate(pairs)}
+    assert cache.counters["misses"] == 0
+
+def _brute_force_path(d, start=None, end=None, precedence=None):
+    n = len(d)
+    free = [i for i in range(n) if i != start and i != end]
+    best = None
+    for p in itertools.permutations(free):
+        order = ([start] if start is not None else []) + list(p) + ([end] if end is not None else [])
+        pos = {x: i for i, x in enumerate(order)}
+        if any(pos[x] < pos[before] for x, before in (precedence or {}).items()):
+            continue
+        length = opd.route_length(order, d)
+        best = length if best is None else min(best, length)
+    return best
+
+@pytest.mark.parametrize("numpy_path", [True, False])
+def test_held_karp_against_brute_force(monkeypatch, numpy_path):
+    if not numpy_path:
+        monkeypatch.setattr(opd, "NUMPY_AVAILABLE", False)
+    for seed in range(40):
+        rnd, d = _instance(seed, 3 + seed % 6)
+        n = len(d)
+        d = [[x * (1.0 + 0.3 * rnd.random()) for x in row] for row in d]  # aszimmetrikus (egyirányú utcák)
+        start = rnd.choice([None, 0])
+        end = rnd.choice([None, n - 1])
+        precedence = {}
+        if n >= 5 and seed % 2:
+            precedence = {3: 1, 4: 2}
+        order = opd.held_karp(d, start=start, end=end, precedence=precedence)
+        assert sorted(order) == list(range(n))
+        assert start is None or order[0] == start
+        assert end is None or order[-1] == end
+        pos = {x: i for i, x in enumerate(order)}
+        assert all(pos[before] < pos[x] for x, before in precedence.items())
+        assert opd.route_length(order, d) == pytest.approx(_brute_force_path(d, start, end, precedence))
+
+def test_precedence_route_feasible():
+    for seed in range(30):
+        n = 6 + seed % 3 if seed < 20 else 40
+        rnd, d = _instance(seed, n)
+        start = rnd.choice([None, 0])
+        end = rnd.choice([None, n - 1])
+        # felvétel -> kiszállítás párok a szabad pontok között, egy felvételhez több kiszállítás is tartozhat
+        free = [i for i in range(n) if i != start and i != end]
+        pickups = free[:max(1, len(free) // 3)]
+        precedence = {x: rnd.choice(pickups) for x in free[len(pickups):] if rnd.random() < 0.8}
+        improved = []
+        order, _info = opd._precedence_route(d, start, end, precedence, deadline=opd.time.perf_counter() + 0.05,
+                                             on_improve=lambda o: improved.append(list(o)))
+        assert sorted(order) == list(range(n))
+        assert start is None or order[0] == start
+        assert end is None or order[-1] == end
+        for candidate in [order] + improved:
+            pos = {x: i for i, x in enumerate(candidate)}
+            assert all(pos[before] < pos[x] for x, before in precedence.items())
+        if n <= 8:
+            assert opd.route_length(order, d) >= _brute_force_path(d, start, end, precedence) - 1e-9
+
+@pytest.mark.parametrize("numpy_path", [True, False])
+def test_linear_assignment_against_brute_force(monkeypatch, numpy_path):
+    if not numpy_path:
+        monkeypatch.setattr(opd, "NUMPY_AVAILABLE", False)
+    for seed in range(60):
+        rnd = random.Random(seed)
+        n, m = rnd.randint(1, 6), rnd.randint(1, 6)
+        cost = [[float(rnd.randint(0, 20)) for _ in range(m)] for _ in range(n)]
+        pairs = opd.linear_assignment(cost)
+        assert len(pairs) == min(n, m)
+        assert len({i for i, _ in pairs}) == len({j for _, j in pairs}) == len(pairs)
+        if n <= m:
+            best = min(sum(cost[i][cols[i]] for i in range(n)) for cols in itertools.permutations(range(m), n))
+        else:
+            best = min(sum(cost[rows[j]][j] for j in range(m)) for rows in itertools.permutations(range(n), m))
+        assert sum(cost[i][j] for i, j in pairs) == pytest.approx(best)
+
+def _precedence_instance(n, seed=3):
+    rnd = random.Random(seed)
+    pts = [(f"p{i}", 47.4 + rnd.random() * 0.1, 19.0 + rnd.random() * 0.15) for i in range(n)]
+    precedence = {i: rnd.randrange(0, n // 3) for i in range(n // 3, n)}
+    return pts, [[opd.haversine_distance(a[1:], b[1:]) for b in pts] for a in pts], precedence
+
+def test_zero_budget_still_has_a_deadline(monkeypatch):
+    pts, matrix, precedence = _precedence_instance(60)
+    seen = []
+    real = opd._precedence_route
+    monkeypatch.setattr(opd, "_precedence_route", lambda *a, **kw: seen.append(a[4]) or real(*a, **kw))
+    t0 = opd.time.perf_counter()
+    order, _info = opd._solve_order(pts, matrix, None, None, precedence, 0)
+    assert sorted(order) == list(range(len(pts)))
+    assert seen[0] is not None and seen[0] <= t0 + (opd.ROUTE_FALLBACK_BUDGET_MS + 50) / 1000.0
+
+def test_pool_timeout_fallback_is_bounded():
+    pts, matrix, precedence = _precedence_instance(600)
+    pool = opd.RouteSolverPool(workers=1, grace_ms=0, min_stops=0)
+    pool.start()
+    try:
+        t0 = opd.time.perf_counter()
+        order, info = pool.solve(pts, matrix, None, None, precedence, 10)
+        elapsed = opd.time.perf_counter() - t0
+    finally:
+        pool.stop()
+    assert info["timed_out"]
+    assert sorted(order) == list(range(len(pts)))
+    assert elapsed < 1.0
+
+def test_route_cache_skips_put_after_concurrent_invalidation():
+    cache = opd.RouteCache()
+    stamp = cache.stamp()
+    cache.invalidate_order(1)  # pl. státuszváltás a számítás közben
+    cache.put(cache.key([1, 2]), {"route": "régi"}, stamp)
+    cache.put(cache.key([3]), {"route": "friss"}, stamp)
+    assert cache.get(cache.key([1, 2])) is None
+    assert cache.get(cache.key([3])) == {"route": "friss"}
+    fresh = cache.stamp()
+    cache.put(cache.key([1, 2]), {"route": "új"}, fresh)
+    assert cache.get(cache.key([1, 2])) == {"route": "új"}
+    cache.clear()
+    cache.put(cache.key([3]), {"route": "friss"}, fresh)
+    assert cache.get(cache.key([3])) is None
+    assert cache.stats()["stale_puts"] == 2
+
+def test_route_matrix_keys_pair_costs_by_location(monkeypatch):
+    nodes = [[47.5, 19.0 + i * 0.001] for i in range(50)]
+    edges = [[i, i + 1, opd.haversine_distance(nodes[i], nodes[i + 1]) * 1000, 0] for i in range(49)]
+    monkeypatch.setattr(opd, "road_network", opd.RoadNetwork(nodes, edges))
+    monkeypatch.setattr(opd, "pair_costs", opd.PairCostCache(lru_size=1))
+    # ugyanaz a cím szövege két különböző helyen (pl. felvétel és kiszállítás)
+    points = [("Fő utca 1", 47.5, 19.002), ("Fő utca 1", 47.5, 19.040), ("Dob utca 3", 47.5, 19.020)]
+    direct = opd._matrix_rows(opd.road_network.matrix(points))
+    opd.route_matrix(points)
+    info = {}
+    again = opd._matrix_rows(opd.route_matrix(points, info))
+    assert info["cached"] > 0
+    assert [x for row in again for x in row] == pytest.approx([x for row in direct for x in row])